@@ -0,0 +1,382 @@
+"""
+Concurrency load test for the analytics queries of the sales data warehouse.
+
+Replays a weighted mix of the catalog queries (the reports, their
+approximate variants and cube drill-downs) from concurrent client threads,
+with the parameters varied per request (sample percentages, drill-down
+levels and filters drawn from the loaded data), through a pool of
+read-only connections. For every concurrency level it reports the
+throughput, the p50/p95/p99 latency overall and per query, and how
+saturated the connection pool was, and writes the results to a JSON file
+so runs from different commits can be compared.
+
+Usage:
+    PYTHONPATH=. python benchmarks/load_test.py --concurrency 1 4 16 --duration 10
+    PYTHONPATH=. python benchmarks/load_test.py --concurrency 16 --pool-size 4
+    PYTHONPATH=. python benchmarks/load_test.py --mix cube_drilldown=1 --requests 500
+    PYTHONPATH=. python benchmarks/load_test.py --ephemeral --scale 0.05
+    PYTHONPATH=. python benchmarks/load_test.py --compare benchmarks/results/load-<commit>.json
+"""
+import argparse
+import functools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import psycopg2
+
+from config import DB_CONFIG, SCHEMA_CONFIG
+from queries import analytics_queries
+from queries.cube import LEVELS, query_cube
+from utils.data_generator import generate_all_data
+from utils.db_setup import setup_database
+from utils.db_utils import ReadConnectionPool, set_read_pool
+from utils.ephemeral_postgres import EphemeralPostgres
+from utils.etl_utils import run_etl
+from benchmarks.run_benchmarks import RESULTS_DIR, compare_results, git_commit, print_comparison
+
+# Sample percentages the approximate queries are run with
+SAMPLE_PERCENTS = [1, 5, 10, 25]
+
+# Drill-downs group by up to this many cube levels
+MAX_DRILLDOWN_LEVELS = 3
+
+def _report(name: str) -> Callable[[random.Random, Dict[str, list]], Callable[[], Any]]:
+    """Request builder for a report without parameters."""
+    return lambda rng, domain: getattr(analytics_queries, name)
+
+def _approximate(name: str) -> Callable[[random.Random, Dict[str, list]], Callable[[], Any]]:
+    """Request builder for the approximate mode of a report with a random sample size."""
+    return lambda rng, domain: functools.partial(getattr(analytics_queries, name),
+                                                 approximate=True,
+                                                 sample_percent=rng.choice(SAMPLE_PERCENTS))
+
+def _cube_drilldown(rng: random.Random, domain: Dict[str, list]) -> Callable[[], Any]:
+    """Request builder for a cube query over random levels and filters."""
+    group_by = rng.sample(list(LEVELS), rng.randint(0, MAX_DRILLDOWN_LEVELS))
+    filters: Dict[str, Any] = {}
+    for level, values in domain.items():
+        if values and rng.random() < 0.3:
+            filters[level] = rng.sample(values, rng.randint(1, len(values)))
+    return functools.partial(query_cube, group_by, filters)
+
+def _low_stock_alerts(rng: random.Random, domain: Dict[str, list]) -> Callable[[], Any]:
+    """Request builder for the low stock alerts of a random store, or of all stores."""
+    store_id = rng.choice(domain['store']) if domain['store'] and rng.random() < 0.5 else None
+    return functools.partial(analytics_queries.get_low_stock_alerts, store_id)
+
+# Query name -> request builder taking a random generator and the parameter
+# domain (see parameter_domain) and returning the call to time
+WORKLOAD = {
+    'daily_sales_by_store': _report('get_daily_sales_by_store'),
+    'product_performance': _report('get_product_performance'),
+    'customer_segment_analysis': _report('get_customer_segment_analysis'),
+    'inventory_analysis': _report('get_inventory_analysis'),
+    'sales_trends': _report('get_sales_trends'),
+    'top_performing_stores': _report('get_top_performing_stores'),
+    'customer_purchase_patterns': _report('get_customer_purchase_patterns'),
+    'rfm_segments': _report('get_rfm_segments'),
+    'cohort_retention': _report('get_cohort_retention'),
+    'basket_affinity': _report('get_basket_affinity'),
+    'rolling_store_sales': _report('get_rolling_store_sales'),
+    'low_stock_alerts': _low_stock_alerts,
+    'customer_segment_analysis[approximate]': _approximate('get_customer_segment_analysis'),
+    'top_performing_stores[approximate]': _approximate('get_top_performing_stores'),
+    'cube_drilldown': _cube_drilldown
+}
+
+# Default weights: dashboards mostly drill into the cube, check the stock
+# alerts and use the approximate modes, the full reports are run now and then
+DEFAULT_MIX = {
+    'daily_sales_by_store': 1,
+    'product_performance': 1,
+    'customer_segment_analysis': 1,
+    'inventory_analysis': 1,
+    'sales_trends': 1,
+    'top_performing_stores': 1,
+    'customer_purchase_patterns': 1,
+    'rfm_segments': 1,
+    'cohort_retention': 1,
+    'basket_affinity': 1,
+    'rolling_store_sales': 1,
+    'low_stock_alerts': 3,
+    'customer_segment_analysis[approximate]': 3,
+    'top_performing_stores[approximate]': 3,
+    'cube_drilldown': 12
+}
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    Parse a query mix given as name=weight pairs separated by commas.
+
+    Args:
+        text: Mix such as 'cube_drilldown=10,sales_trends=1'
+
+    Returns:
+        Weight per query name
+    """
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in WORKLOAD:
+            raise ValueError(f"Unknown query {name!r}: use one of {', '.join(WORKLOAD)}")
+        mix[name] = float(weight or 1)
+        if mix[name] < 0:
+            raise ValueError(f"Negative weight for {name}")
+    if not any(mix.values()):
+        raise ValueError("The mix needs a query with a positive weight")
+    return mix
+
+def parameter_domain() -> Dict[str, list]:
+    """Return the cube filter values found in the loaded data (years, stores, segments)."""
+    cube = f"{SCHEMA_CONFIG['fact_schema']}.sales_cube"
+    queries = {
+        'year': f"SELECT DISTINCT date_key / 10000 AS value FROM {cube} WHERE date_key IS NOT NULL",
+        'store': f"SELECT DISTINCT store_id AS value FROM {cube} WHERE store_id IS NOT NULL",
+        'segment': f"SELECT DISTINCT customer_segment AS value FROM {cube} "
+                   "WHERE customer_segment IS NOT NULL"
+    }
+    return {level: sorted(row['value'] for row in analytics_queries.execute_query(query))
+            for level, query in queries.items()}
+
+def latency_summary(latencies: Sequence[float]) -> Dict[str, float]:
+    """
+    Summarize request latencies.
+
+    Args:
+        latencies: Seconds per request
+
+    Returns:
+        p50, p95 and p99 percentiles, mean and maximum in seconds (empty
+        without latencies)
+    """
+    if not len(latencies):
+        return {}
+    values = np.asarray(latencies, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+            'mean': float(values.mean()), 'max': float(values.max())}
+
+def run_load(mix: Dict[str, float], concurrency: int, duration: Optional[float] = None,
+             requests: Optional[int] = None, pool_size: Optional[int] = None,
+             pool_timeout: Optional[float] = 30.0, seed: int = 0) -> Dict[str, Any]:
+    """
+    Replay the query mix from concurrent clients and measure it.
+
+    Each client thread picks queries at random in proportion to their
+    weights and runs them back to back, borrowing a connection from a pool
+    of `pool_size` read-only connections for each query. Failed queries are
+    counted as errors and left out of the latencies.
+
+    Args:
+        mix: Weight per query name (keys of WORKLOAD)
+        concurrency: Number of client threads
+        duration: Seconds to run for (defaults to 10 without `requests`)
+        requests: Total number of requests to run
+        pool_size: Pooled connections (defaults to the concurrency)
+        pool_timeout: Seconds a query waits for a free connection
+        seed: Seed of the random query and parameter choices
+
+    Returns:
+        Elapsed seconds, requests, errors, throughput, overall and per query
+        latency summaries and the pool statistics
+    """
+    if duration is None and requests is None:
+        duration = 10.0
+    names = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in names]
+    domain = parameter_domain()
+
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    lock = threading.Lock()
+    issued = [0]
+    deadline = time.perf_counter() + duration if duration is not None else None
+
+    def client(index: int) -> None:
+        """Run requests until the time or the request budget is used up."""
+        rng = random.Random(f"{seed}-{index}")
+        while deadline is None or time.perf_counter() < deadline:
+            with lock:
+                if requests is not None and issued[0] >= requests:
+                    return
+                issued[0] += 1
+            name = rng.choices(names, weights)[0]
+            call = WORKLOAD[name](rng, domain)
+            start = time.perf_counter()
+            try:
+                call()
+            except psycopg2.Error as e:
+                with lock:
+                    errors[name] += 1
+                print(f"  {name} failed: {e}".rstrip())
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[name].append(elapsed)
+
+    pool = ReadConnectionPool(pool_size or concurrency, pool_timeout)
+    previous = set_read_pool(pool)
+    try:
+        threads = [threading.Thread(target=client, args=(index,), name=f'load-client-{index}')
+                   for index in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        set_read_pool(previous)
+        pool.close()
+
+    pool_stats = pool.statistics()
+    borrowed = pool_stats['borrowed'] or 1
+    pool_stats.update({
+        'wait_ratio': pool_stats['waited'] / borrowed,
+        'mean_wait_seconds': pool_stats['wait_seconds'] / borrowed,
+        'saturation': pool_stats['peak_in_use'] / pool_stats['size']
+    })
+    completed = sum(len(values) for values in latencies.values())
+    return {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests': completed,
+        'errors': sum(errors.values()),
+        'throughput': completed / elapsed if elapsed else 0.0,
+        'latency': latency_summary([value for values in latencies.values() for value in values]),
+        'queries': {name: {'requests': len(latencies[name]), 'errors': errors[name],
+                           **latency_summary(latencies[name])}
+                    for name in names},
+        'pool': pool_stats
+    }
+
+def print_level(level: Dict[str, Any]) -> None:
+    """Print the measurements of one concurrency level."""
+    pool = level['pool']
+    latency = level['latency']
+    print(f"\nConcurrency {level['concurrency']}: {level['requests']} requests "
+          f"({level['errors']} errors) in {level['seconds']:.1f}s, "
+          f"{level['throughput']:.1f} requests/s")
+    if latency:
+        print(f"  {'all':<40} p50={latency['p50']:.4f}s p95={latency['p95']:.4f}s "
+              f"p99={latency['p99']:.4f}s")
+    for name, query in level['queries'].items():
+        if query['requests']:
+            print(f"  {name:<40} p50={query['p50']:.4f}s p95={query['p95']:.4f}s "
+                  f"p99={query['p99']:.4f}s n={query['requests']}")
+    print(f"  pool: {pool['peak_in_use']}/{pool['size']} connections at peak, "
+          f"{pool['wait_ratio']:.1%} of borrows waited "
+          f"(mean {pool['mean_wait_seconds']:.4f}s, max {pool['max_wait_seconds']:.4f}s), "
+          f"{pool['timeouts']} timeouts")
+
+def result_records(level: Dict[str, Any], scale: float) -> List[Dict[str, Any]]:
+    """
+    Flatten a concurrency level into records comparable with compare_results.
+
+    The p95 latency is the compared timing, per query and overall, so a
+    query that slows down under contention is reported as a regression.
+    """
+    records = []
+    for name, query in [('all', level['latency'])] + list(level['queries'].items()):
+        if not query.get('p95'):
+            continue
+        records.append({
+            'group': 'load',
+            'name': f"{name}@{level['concurrency']}",
+            'scale': scale,
+            'seconds': query['p95'],
+            'p50_seconds': query['p50'],
+            'p99_seconds': query['p99'],
+            'requests': query.get('requests', level['requests'])
+        })
+    return records
+
+def load_ephemeral_warehouse(scale: float) -> None:
+    """Create the warehouse and load generated data at a scale factor."""
+    setup_database()
+    with tempfile.TemporaryDirectory(prefix='warehouse-load-') as raw_dir:
+        generate_all_data(scale=scale, output_dir=raw_dir)
+        run_etl(raw_dir)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the load test from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help='client threads; each level is measured in turn')
+    parser.add_argument('--duration', type=float,
+                        help='seconds per concurrency level (default 10)')
+    parser.add_argument('--requests', type=int, help='requests per concurrency level')
+    parser.add_argument('--pool-size', type=int,
+                        help='pooled read connections (defaults to the concurrency)')
+    parser.add_argument('--pool-timeout', type=float, default=30.0,
+                        help='seconds a query waits for a pooled connection')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f"query weights as name=weight,... (queries: {', '.join(WORKLOAD)})")
+    parser.add_argument('--seed', type=int, default=0, help='seed of the query choices')
+    parser.add_argument('--dbname', help='database to query (defaults to DB_NAME)')
+    parser.add_argument('--ephemeral', action='store_true',
+                        help='load generated data into a disposable local server first')
+    parser.add_argument('--scale', type=float, default=0.1,
+                        help='scale factor of the data loaded with --ephemeral '
+                        '(recorded with the results)')
+    parser.add_argument('--output', help='JSON file for the results '
+                        '(defaults to benchmarks/results/load-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative p95 slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.ephemeral:
+        server = EphemeralPostgres()
+        DB_CONFIG.update(server.start())
+        DB_CONFIG['dbname'] = args.dbname or 'sales_warehouse_load'
+    elif args.dbname:
+        DB_CONFIG['dbname'] = args.dbname
+
+    levels = []
+    try:
+        if server is not None:
+            load_ephemeral_warehouse(args.scale)
+        for concurrency in args.concurrency:
+            level = run_load(args.mix, concurrency, args.duration, args.requests,
+                             args.pool_size, args.pool_timeout, args.seed)
+            print_level(level)
+            levels.append(level)
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'mix': args.mix,
+        'levels': levels,
+        'results': [record for level in levels for record in result_records(level, args.scale)]
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{report['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare_results(baseline, report, args.threshold)
+        print(f"\nComparison with {args.compare}:")
+        print_comparison(comparison)
+        if any(row['regression'] for row in comparison):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,425 @@
+"""
+Benchmark harness for the sales data warehouse.
+
+Times the CLI startup, then data generation, CSV to Parquet conversion, the
+ETL stages and every analytics query at one or more scale factors, against a
+throwaway database, records the on-disk size of the fact tables, and writes the results to a
+JSON file so runs from different commits (or fact layouts) can be compared.
+
+Usage:
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --scales 0.01 0.1
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --ephemeral
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --compact --compare benchmarks/results/<commit>.json
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --compare benchmarks/results/old.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from config import DB_CONFIG, SCHEMA_CONFIG
+from queries import analytics_queries, columnar_queries
+from queries.cube import query_cube
+from utils import data_generator
+from utils.data_manager import DataManager
+from utils.db_setup import setup_database
+from utils.ephemeral_postgres import EphemeralPostgres
+from utils.etl_utils import (DIMENSION_FILES, FACT_FILES, load_csv_to_staging,
+                             load_dimension_tables, load_fact_tables)
+from utils.key_cache import clear_key_caches
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Warehouse CLI command lines timed from process start to exit, and the time
+# each may take (seconds)
+STARTUP_COMMANDS = [
+    ['--help'],
+    ['etl', '--help'],
+    ['report', '--help']
+]
+STARTUP_BUDGET_SECONDS = 0.5
+
+REPORTS = [
+    'get_daily_sales_by_store',
+    'get_product_performance',
+    'get_customer_segment_analysis',
+    'get_inventory_analysis',
+    'get_sales_trends',
+    'get_top_performing_stores',
+    'get_customer_purchase_patterns',
+    'get_rfm_segments',
+    'get_cohort_retention',
+    'get_basket_affinity',
+    'get_rolling_store_sales',
+    'get_low_stock_alerts'
+]
+
+# Drill-downs answered from the sales cube
+CUBE_QUERIES = [
+    ['date', 'store'],
+    ['year', 'month', 'category'],
+    ['segment']
+]
+
+# Reports with an approximate mode
+APPROXIMATE_REPORTS = [
+    'get_customer_segment_analysis',
+    'get_top_performing_stores'
+]
+
+class BenchmarkRecorder:
+    """Runs timed calls and collects the results."""
+
+    def __init__(self, repeat: int = 3):
+        """Initialize the recorder with the number of repetitions per query."""
+        self.repeat = repeat
+        self.results: List[Dict[str, Any]] = []
+
+    def run(self, group: str, name: str, scale: float, fn: Callable, *args,
+            repeat: int = 1, **kwargs) -> Any:
+        """
+        Time a call and record the best of `repeat` runs.
+
+        Args:
+            group: Benchmark group (startup, generation, conversion, etl, queries, columnar)
+            name: Benchmark name within the group
+            scale: Scale factor of the data set
+            fn: Callable to time
+            repeat: Number of timed runs
+
+        Returns:
+            The result of the last call
+        """
+        timings = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            timings.append(time.perf_counter() - start)
+
+        record = {
+            'group': group,
+            'name': name,
+            'scale': scale,
+            'seconds': min(timings),
+            'mean_seconds': sum(timings) / len(timings),
+            'runs': repeat
+        }
+        if hasattr(result, '__len__') and not isinstance(result, str):
+            record['rows'] = len(result)
+        self.results.append(record)
+        print(f"  {group:<11} {name:<40} scale={scale:<6} {record['seconds']:.4f}s")
+        return result
+
+def benchmark_generation(recorder: BenchmarkRecorder, scale: float, raw_dir: str) -> None:
+    """Time the data generators and write their output as CSV files."""
+    generate = data_generator
+    products = recorder.run('generation', 'generate_product_data', scale,
+                            generate.generate_product_data,
+                            generate.scaled(generate.NUM_PRODUCTS, scale))
+    customers = recorder.run('generation', 'generate_customer_data', scale,
+                             generate.generate_customer_data,
+                             generate.scaled(generate.NUM_CUSTOMERS, scale))
+    time_dim = recorder.run('generation', 'generate_time_dimension', scale,
+                            generate.generate_time_dimension)
+    stores = recorder.run('generation', 'generate_store_data', scale,
+                          generate.generate_store_data,
+                          generate.scaled(generate.NUM_STORES, scale))
+    sales = recorder.run('generation', 'generate_sales_data', scale,
+                         generate.generate_sales_data, products, customers, stores, time_dim,
+                         generate.scaled(generate.NUM_TRANSACTIONS, scale))
+    inventory = recorder.run('generation', 'generate_inventory_data', scale,
+                             generate.generate_inventory_data, products, stores, time_dim)
+
+    frames = {
+        'products.csv': products,
+        'customers.csv': customers,
+        'time_dimension.csv': time_dim,
+        'stores.csv': stores,
+        'sales.csv': sales,
+        'inventory.csv': inventory
+    }
+    for file_name, frame in frames.items():
+        frame.to_csv(os.path.join(raw_dir, file_name), index=False)
+
+def benchmark_conversion(recorder: BenchmarkRecorder, scale: float, data_dir: str) -> None:
+    """Time sampling and Parquet conversion of every generated file."""
+    data_manager = DataManager(data_dir)
+    for file_name, _ in DIMENSION_FILES + FACT_FILES:
+        recorder.run('conversion', f'create_sample[{file_name}]', scale,
+                     data_manager.create_sample, file_name)
+        recorder.run('conversion', f'convert_to_parquet[{file_name}]', scale,
+                     data_manager.convert_to_parquet, file_name)
+
+def benchmark_columnar(recorder: BenchmarkRecorder, scale: float, processed_dir: str) -> None:
+    """Time every report of the columnar backend."""
+    for report in REPORTS:
+        recorder.run('columnar', report, scale, getattr(columnar_queries, report),
+                     processed_dir, repeat=recorder.repeat)
+
+def _admin_connection():
+    """Connect to the server's maintenance database."""
+    conn = psycopg2.connect(
+        dbname='postgres',
+        user=DB_CONFIG['user'],
+        password=DB_CONFIG['password'],
+        host=DB_CONFIG['host'],
+        port=DB_CONFIG['port']
+    )
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
+def database_available() -> bool:
+    """Check whether the configured server accepts connections."""
+    try:
+        _admin_connection().close()
+        return True
+    except psycopg2.OperationalError as e:
+        print(f"PostgreSQL not reachable, skipping database benchmarks: {e}")
+        return False
+
+def drop_database(dbname: str) -> None:
+    """Drop a benchmark database if it exists."""
+    conn = _admin_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {dbname}")
+    conn.close()
+
+def benchmark_etl(recorder: BenchmarkRecorder, scale: float, raw_dir: str) -> None:
+    """Create a fresh warehouse database and time every ETL stage."""
+    drop_database(DB_CONFIG['dbname'])
+    setup_database()
+    clear_key_caches()
+
+    for file_name, table in DIMENSION_FILES:
+        recorder.run('etl', f'load_csv_to_staging[{file_name}]', scale,
+                     load_csv_to_staging, file_name, table, raw_dir)
+    recorder.run('etl', 'load_dimension_tables', scale, load_dimension_tables)
+    for file_name, table in FACT_FILES:
+        recorder.run('etl', f'load_csv_to_staging[{file_name}]', scale,
+                     load_csv_to_staging, file_name, table, raw_dir)
+    recorder.run('etl', 'load_fact_tables', scale, load_fact_tables)
+
+def benchmark_queries(recorder: BenchmarkRecorder, scale: float) -> None:
+    """Time every analytics query against the loaded warehouse, exact and approximate."""
+    for report in REPORTS:
+        recorder.run('queries', report, scale, getattr(analytics_queries, report),
+                     repeat=recorder.repeat)
+    for report in APPROXIMATE_REPORTS:
+        recorder.run('queries', f'{report}[approximate]', scale,
+                     getattr(analytics_queries, report), approximate=True,
+                     repeat=recorder.repeat)
+    for group_by in CUBE_QUERIES:
+        recorder.run('queries', f"query_cube[{','.join(group_by)}]", scale, query_cube,
+                     group_by, repeat=recorder.repeat)
+
+def scan_fact_sales() -> List[tuple]:
+    """Aggregate every sales fact row through the v_sales view."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        SELECT SUM(quantity), SUM(total_amount), SUM(discount_amount), SUM(net_amount)
+        FROM {SCHEMA_CONFIG['fact_schema']}.v_sales
+        """)
+        rows = cur.fetchall()
+    conn.close()
+    return rows
+
+def benchmark_storage(recorder: BenchmarkRecorder, scale: float) -> None:
+    """Record the size of the fact tables and time a full scan of the sales facts."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    with conn.cursor() as cur:
+        for table in ('fact_sales', 'fact_inventory'):
+            name = f"{SCHEMA_CONFIG['fact_schema']}.{table}"
+            cur.execute("SELECT pg_table_size(%s), pg_indexes_size(%s)", (name, name))
+            table_bytes, index_bytes = cur.fetchone()
+            for kind, size in (('table_bytes', table_bytes), ('index_bytes', index_bytes)):
+                recorder.results.append({'group': 'storage', 'name': f'{table}.{kind}',
+                                         'scale': scale, 'bytes': size})
+                print(f"  {'storage':<11} {table + '.' + kind:<40} scale={scale:<6} {size} bytes")
+    conn.close()
+    recorder.run('storage', 'scan_fact_sales', scale, scan_fact_sales, repeat=recorder.repeat)
+
+def run_cli(argv: List[str]) -> None:
+    """Run the warehouse CLI in a new interpreter."""
+    subprocess.run([sys.executable, os.path.join(PROJECT_DIR, 'warehouse.py')] + argv,
+                   cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, check=True)
+
+def benchmark_startup(recorder: BenchmarkRecorder) -> None:
+    """Time CLI invocations that should not load the heavy dependencies."""
+    for argv in STARTUP_COMMANDS:
+        name = f"warehouse {' '.join(argv)}"
+        recorder.run('startup', name, 0, run_cli, argv, repeat=recorder.repeat)
+        seconds = recorder.results[-1]['seconds']
+        recorder.results[-1]['budget_seconds'] = STARTUP_BUDGET_SECONDS
+        if seconds > STARTUP_BUDGET_SECONDS:
+            print(f"  startup     {name} is over its budget of {STARTUP_BUDGET_SECONDS}s")
+
+def git_commit() -> Optional[str]:
+    """Return the current commit hash, if running inside a git checkout."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scales: List[float], repeat: int = 3, use_database: bool = True,
+                   keep_database: bool = False) -> Dict[str, Any]:
+    """
+    Run every benchmark group at each scale factor.
+
+    Args:
+        scales: Scale factors to generate data for
+        repeat: Number of timed runs per query
+        use_database: Run the ETL and SQL query benchmarks
+        keep_database: Keep the benchmark database after the run
+
+    Returns:
+        Benchmark report with metadata and per-benchmark timings
+    """
+    recorder = BenchmarkRecorder(repeat)
+    use_database = use_database and database_available()
+
+    print("\nStartup:")
+    benchmark_startup(recorder)
+
+    for scale in scales:
+        print(f"\nScale factor {scale}:")
+        with tempfile.TemporaryDirectory(prefix='warehouse-bench-') as data_dir:
+            data_manager = DataManager(data_dir)
+            benchmark_generation(recorder, scale, str(data_manager.raw_dir))
+            benchmark_conversion(recorder, scale, data_dir)
+            benchmark_columnar(recorder, scale, str(data_manager.processed_dir))
+            if use_database:
+                benchmark_etl(recorder, scale, str(data_manager.raw_dir))
+                benchmark_queries(recorder, scale)
+                benchmark_storage(recorder, scale)
+
+    if use_database and not keep_database:
+        drop_database(DB_CONFIG['dbname'])
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scales': scales,
+        'compact_facts': SCHEMA_CONFIG['compact_facts'],
+        'results': recorder.results
+    }
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compare two benchmark reports.
+
+    Args:
+        baseline: Earlier benchmark report
+        current: Benchmark report to check
+        threshold: Relative slowdown reported as a regression
+
+    Returns:
+        Benchmarks present in both reports with their relative change
+    """
+    def key(record):
+        return record['group'], record['name'], record['scale']
+
+    previous = {key(record): record for record in baseline['results']}
+    comparison = []
+    for record in current['results']:
+        # Timings are compared by seconds, storage records by bytes
+        metric = 'seconds' if 'seconds' in record else 'bytes'
+        before = previous.get(key(record))
+        if before is None or not before.get(metric):
+            continue
+        change = record[metric] / before[metric] - 1
+        comparison.append({
+            'group': record['group'],
+            'name': record['name'],
+            'scale': record['scale'],
+            'metric': metric,
+            'baseline': before[metric],
+            'value': record[metric],
+            'change': change,
+            'regression': change > threshold
+        })
+    return comparison
+
+def print_comparison(comparison: List[Dict[str, Any]]) -> None:
+    """Print a comparison table, marking regressions."""
+    for row in comparison:
+        marker = '  REGRESSION' if row['regression'] else ''
+        if row['metric'] == 'seconds':
+            values = f"{row['baseline']:.4f}s -> {row['value']:.4f}s"
+        else:
+            values = f"{row['baseline']} -> {row['value']} bytes"
+        print(f"{row['group']:<11} {row['name']:<40} scale={row['scale']:<6} "
+              f"{values} ({row['change']:+.1%}){marker}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.01, 0.1],
+                        help='scale factors relative to the default data set')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per query (best is reported)')
+    parser.add_argument('--output', help='JSON file for the results '
+                        '(defaults to benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--dbname', default='sales_warehouse_bench',
+                        help='throwaway database used for the ETL and query benchmarks')
+    parser.add_argument('--no-db', action='store_true', help='skip the database benchmarks')
+    parser.add_argument('--ephemeral', action='store_true',
+                        help='run the database benchmarks on a disposable local server')
+    parser.add_argument('--compact', action='store_true',
+                        help='create the fact tables in the compact layout')
+    parser.add_argument('--keep-db', action='store_true',
+                        help='keep the benchmark database after the run')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.ephemeral and not args.no_db:
+        server = EphemeralPostgres()
+        DB_CONFIG.update(server.start())
+
+    # Every module connects through the shared config, so retarget it in place
+    DB_CONFIG['dbname'] = args.dbname
+    if args.compact:
+        SCHEMA_CONFIG['compact_facts'] = True
+
+    try:
+        report = run_benchmarks(args.scales, args.repeat, not args.no_db, args.keep_db)
+    finally:
+        if server is not None:
+            server.stop()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare_results(baseline, report, args.threshold)
+        print(f"\nComparison with {args.compare}:")
+        print_comparison(comparison)
+        if any(row['regression'] for row in comparison):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,6 +2,8 @@
 Configuration settings for the Sales Data Warehouse project.
 """
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,26 +18,161 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5432')
 }
 
+def _parse_endpoints(value: str) -> list:
+    """Parse a comma-separated list of host[:port] endpoints."""
+    endpoints = []
+    for endpoint in filter(None, (item.strip() for item in value.split(','))):
+        host, _, port = endpoint.partition(':')
+        endpoints.append({'host': host, 'port': port or DB_CONFIG['port']})
+    return endpoints
+
+# Read replicas for analytics queries (host/port; the other settings come
+# from DB_CONFIG). ETL and setup always use the primary in DB_CONFIG.
+READ_REPLICAS = _parse_endpoints(os.getenv('DB_READ_HOSTS', ''))
+
+REPLICA_CONFIG = {
+    # Replicas further behind the primary than this are skipped
+    'max_lag_seconds': float(os.getenv('DB_REPLICA_MAX_LAG', '30')),
+    # Seconds to wait for a replica connection
+    'connect_timeout': int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', '2')),
+    # Seconds an unreachable or lagging replica is left out of the rotation
+    'retry_after_seconds': float(os.getenv('DB_REPLICA_RETRY_AFTER', '30'))
+}
+
+READ_POOL_CONFIG = {
+    # Read-only connections kept open for the analytics queries (0: connect per query)
+    'size': int(os.getenv('DB_READ_POOL_SIZE', '0')),
+    # Seconds a query waits for a free pooled connection
+    'timeout': float(os.getenv('DB_READ_POOL_TIMEOUT', '30'))
+}
+
+class ScopedConfig(dict):
+    """
+    Settings that can be overridden for the current thread or task.
+
+    Code that builds SQL reads the settings as usual; within scoped() it
+    sees the overriding values, while other threads keep seeing theirs.
+    This lets e.g. one thread per shard query its own schemas at once.
+    """
+
+    def __init__(self, name: str, *args, **kwargs):
+        """Initialize the settings (name identifies the overrides for debugging)."""
+        super().__init__(*args, **kwargs)
+        self._overrides = ContextVar(f'{name}_overrides', default={})
+
+    def __getitem__(self, key):
+        """Return a setting, overridden or not."""
+        overrides = self._overrides.get()
+        return overrides[key] if key in overrides else super().__getitem__(key)
+
+    def get(self, key, default=None):
+        """Return a setting, or default if there is no such setting."""
+        return self[key] if key in self else default
+
+    @contextmanager
+    def scoped(self, **values):
+        """Override settings until the end of the with block (current thread or task only)."""
+        token = self._overrides.set({**self._overrides.get(), **values})
+        try:
+            yield self
+        finally:
+            self._overrides.reset(token)
+
 # Data warehouse schema configuration
-SCHEMA_CONFIG = {
+SCHEMA_CONFIG = ScopedConfig('schema_config', {
     'schema_name': 'sales_dw',
     'staging_schema': 'staging',
     'dim_schema': 'dimensions',
-    'fact_schema': 'facts'
+    'fact_schema': 'facts',
+    # Create fact tables in the compact layout (integer cents, small integer
+    # quantities, derived amounts computed by the facts.v_sales view)
+    'compact_facts': os.getenv('COMPACT_FACTS', 'false').lower() in ('1', 'true', 'yes')
+})
+
+# Shards of the fact data, e.g. one per region ('east,west'). Every shard has
+# its own staging, fact and ETL schemas (the SCHEMA_CONFIG names suffixed with
+# _<shard>, see utils/shards.py); the conformed dimensions are shared.
+SHARDS = [name.strip() for name in os.getenv('WAREHOUSE_SHARDS', '').split(',') if name.strip()]
+
+SHARD_CONFIG = {
+    # Shards loaded in parallel by the ETL (0 = all of them at once)
+    'workers': int(os.getenv('SHARD_WORKERS', '0')),
+    # Source column the fact rows are partitioned on (see utils/shards.py)
+    'partition_column': os.getenv('SHARD_PARTITION_COLUMN', 'store_id')
+}
+
+# ETL configuration
+ETL_CONFIG = {
+    # Keep staging tables after a successful merge (for debugging)
+    'keep_staging': os.getenv('ETL_KEEP_STAGING', 'false').lower() in ('1', 'true', 'yes'),
+    # Rows read, staged and committed per chunk of a source file
+    'chunk_size': int(os.getenv('ETL_CHUNK_SIZE', '100000')),
+    # Rows merged per transaction into a fact table (0 = one statement per table)
+    'fact_batch_size': int(os.getenv('ETL_FACT_BATCH_SIZE', '0')),
+    # Pause between fact merge batches, to leave room for read traffic
+    'batch_pause_seconds': float(os.getenv('ETL_BATCH_PAUSE_SECONDS', '0')),
+    # Validate source rows while staging and quarantine invalid rows
+    'validate': os.getenv('ETL_VALIDATE', 'true').lower() in ('1', 'true', 'yes'),
+    # Add dates referenced by fact rows but missing from dim_time while staging
+    'extend_time_dimension': os.getenv('ETL_EXTEND_TIME_DIMENSION', 'true').lower() in ('1', 'true', 'yes'),
+    # Directory for reject files (defaults to 'rejects' next to the source data directory)
+    'rejects_dir': os.getenv('ETL_REJECTS_DIR'),
+    # Log DataFrame memory and peak RSS per stage (see utils/memory_profile.py)
+    'profile_memory': os.getenv('ETL_PROFILE_MEMORY', 'false').lower() in ('1', 'true', 'yes'),
+    # Compact inventory snapshots older than this many days into monthly ones (0 = never)
+    'inventory_compact_after_days': int(os.getenv('ETL_INVENTORY_COMPACT_AFTER_DAYS', '0'))
+}
+
+# Task graph of the setup, generation and ETL pipelines (see utils/pipeline.py)
+PIPELINE_CONFIG = {
+    # Tasks run at once (1 runs them one after the other)
+    'workers': int(os.getenv('PIPELINE_WORKERS', '4')),
+    # Retries of a task failing with a transient database error (lost connection, deadlock)
+    'retries': int(os.getenv('PIPELINE_RETRIES', '2')),
+    # Seconds before the first retry, doubled for every further one
+    'retry_delay_seconds': float(os.getenv('PIPELINE_RETRY_DELAY_SECONDS', '1'))
+}
+
+# Micro-batch ingestion of new sales (see utils/streaming.py)
+STREAM_CONFIG = {
+    # Directory watched for CSV files of new sales rows
+    'landing_dir': os.getenv('STREAM_LANDING_DIR', os.path.join('data', 'landing')),
+    # A micro-batch is merged once it has this many rows...
+    'max_batch_rows': int(os.getenv('STREAM_MAX_BATCH_ROWS', '10000')),
+    # ...or once its first row has waited this many seconds
+    'max_batch_seconds': float(os.getenv('STREAM_MAX_BATCH_SECONDS', '2')),
+    # Seconds between checks for new input
+    'poll_seconds': float(os.getenv('STREAM_POLL_SECONDS', '0.5'))
+}
+
+# Calendar configuration for the time dimension
+CALENDAR_CONFIG = {
+    # Holiday calendar: 'us', 'us_federal' or 'none' (see utils/time_dimension.py)
+    'holiday_calendar': os.getenv('HOLIDAY_CALENDAR', 'us'),
+    # First month of the fiscal year (1 = fiscal year equals calendar year)
+    'fiscal_year_start_month': int(os.getenv('FISCAL_YEAR_START_MONTH', '1'))
 }
 
-# File paths
+# Report export configuration
+EXPORT_CONFIG = {
+    # Rows fetched from the server and written per batch
+    'batch_rows': int(os.getenv('EXPORT_BATCH_ROWS', '50000'))
+}
+
+# File paths (created by the code that writes to them, not on import)
 DATA_DIR = 'data'
 RAW_DATA_DIR = os.path.join(DATA_DIR, 'raw')
 PROCESSED_DATA_DIR = os.path.join(DATA_DIR, 'processed')
 
-# Create necessary directories if they don't exist
-for directory in [DATA_DIR, RAW_DATA_DIR, PROCESSED_DATA_DIR]:
-    os.makedirs(directory, exist_ok=True)
-
 # Logging configuration
 LOG_CONFIG = {
     'level': os.getenv('LOG_LEVEL', 'INFO'),
     'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    'file': 'sales_warehouse.log'
+    'datefmt': '%Y-%m-%d %H:%M:%S',
+    # Log file written next to the console output ('' to disable)
+    'file': os.getenv('LOG_FILE', 'sales_warehouse.log'),
+    # Write records as JSON objects with their structured fields
+    'json': os.getenv('LOG_JSON', 'false').lower() in ('1', 'true', 'yes'),
+    # Minimum seconds between progress messages of per-chunk loops
+    'progress_interval': float(os.getenv('LOG_PROGRESS_INTERVAL', '5'))
 } 
\ No newline at end of file
@@ -1,9 +1,8 @@
 """
 Script to generate sample data for the sales data warehouse.
 """
-from utils.data_generator import generate_all_data
+import sys
+from warehouse import main
 
 if __name__ == '__main__':
-    print("Starting data generation for Sales Data Warehouse...")
-    generate_all_data()
-    print("Data generation completed successfully!") 
\ No newline at end of file
+    sys.exit(main(['generate'] + sys.argv[1:]))
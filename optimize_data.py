@@ -5,15 +5,15 @@ and creating sample datasets for development.
 import logging
 from utils.data_manager import DataManager
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 def main():
     """Run data optimization process."""
+    # Configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
     logger.info("Starting data optimization process...")
     
     # Initialize data manager
@@ -1,40 +1,61 @@
 """
 Sample analytics queries for the sales data warehouse.
+
+Sales queries read facts.v_sales, which has the same columns for the
+standard and the compact fact table layout.
 """
-from typing import List, Dict, Any
-import psycopg2
-from config import DB_CONFIG, SCHEMA_CONFIG
-from datetime import datetime, date
-from decimal import Decimal
-import json
+from typing import List, Dict, Any, Optional, Tuple
+from config import SCHEMA_CONFIG
+from datetime import date, timedelta
+from utils.cube import grouping_id
+from utils.customer_activity import RFM_SCORES, RFM_SEGMENTS
+from utils.db_utils import get_read_connection, get_read_db_connection
+from utils.sketches import load_sketches
+
+# Percentage of sales rows read by approximate queries
+APPROX_SAMPLE_PERCENT = 10.0
+
+# Normal quantile of the 95% error bounds reported by approximate queries
+Z_95 = 1.96
+
+# Days summed by the rolling store sales windows
+ROLLING_WINDOWS = (7, 30)
+
+# Basket affinity level -> product column the items are taken from
+AFFINITY_LEVELS = {
+    'category': 'category',
+    'subcategory': 'subcategory',
+    'brand': 'brand',
+    'product': 'product_id'
+}
 
 def get_connection():
-    """Get database connection."""
-    return psycopg2.connect(**DB_CONFIG)
+    """Get a read-only database connection (a read replica when configured)."""
+    return get_read_connection()
 
-def execute_query(query: str) -> List[Dict[str, Any]]:
+def execute_query(query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     Execute a query and return results as a list of dictionaries.
     
+    The connection comes from the read pool when one is configured (see
+    utils.db_utils.get_read_db_connection).
+    
     Args:
         query: SQL query to execute
+        params: Query parameters (optional)
         
     Returns:
         List of dictionaries containing query results
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    cur.execute(query)
-    columns = [desc[0] for desc in cur.description]
-    results = [dict(zip(columns, row)) for row in cur.fetchall()]
-    
-    cur.close()
-    conn.close()
+    with get_read_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            columns = [desc[0] for desc in cur.description]
+            results = [dict(zip(columns, row)) for row in cur.fetchall()]
     return results
 
-def get_daily_sales_by_store() -> List[Dict[str, Any]]:
-    """Get daily sales totals by store."""
+def daily_sales_by_store_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_daily_sales_by_store."""
     query = f"""
     SELECT 
         s.store_name,
@@ -42,16 +63,20 @@ def get_daily_sales_by_store() -> List[Dict[str, Any]]:
         SUM(fs.net_amount) as total_sales,
         COUNT(fs.sale_id) as number_of_transactions,
         AVG(fs.net_amount) as average_transaction_value
-    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fs.store_id = s.store_id
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_time t ON fs.date_id = t.date_id
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fs.store_key = s.store_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_time t ON fs.date_key = t.date_key
     GROUP BY s.store_name, t.full_date
     ORDER BY t.full_date, total_sales DESC
     """
-    return execute_query(query)
+    return query, None
 
-def get_product_performance() -> List[Dict[str, Any]]:
-    """Get product performance metrics."""
+def get_daily_sales_by_store() -> List[Dict[str, Any]]:
+    """Get daily sales totals by store."""
+    return execute_query(*daily_sales_by_store_query())
+
+def product_performance_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_product_performance."""
     query = f"""
     SELECT 
         p.product_name,
@@ -61,15 +86,76 @@ def get_product_performance() -> List[Dict[str, Any]]:
         SUM(fs.quantity) as total_quantity_sold,
         SUM(fs.net_amount) as total_revenue,
         AVG(fs.unit_price) as average_price
-    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_id = p.product_id
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_key = p.product_key
     GROUP BY p.product_name, p.category, p.brand
     ORDER BY total_revenue DESC
     """
-    return execute_query(query)
+    return query, None
+
+def get_product_performance() -> List[Dict[str, Any]]:
+    """Get product performance metrics."""
+    return execute_query(*product_performance_query())
+
+def _sampled_measures(measure: str, total: str, count: str, average: str) -> str:
+    """
+    Build Horvitz-Thompson estimates over a Bernoulli sample of sales.
+    
+    Each sampled row stands for 1/f rows, f being the sampled fraction. The
+    standard error of a sum is sqrt((1 - f) * sum(y^2)) / f, that of a count
+    sqrt((1 - f) * n) / f; a mean is estimated by the sample mean. Every
+    estimate gets a <name>_margin column with its 95% error bound.
+    
+    Args:
+        measure: Sales column to aggregate
+        total: Output name of the estimated sum
+        count: Output name of the estimated number of sales
+        average: Output name of the estimated mean
+    
+    Returns:
+        Select list items (the query needs %(fraction)s and %(z)s parameters)
+    """
+    return f"""
+        SUM({measure}) / %(fraction)s as {total},
+        %(z)s * SQRT((1 - %(fraction)s) * SUM({measure} * {measure})) / %(fraction)s
+            as {total}_margin,
+        COUNT(fs.sale_id) / %(fraction)s as {count},
+        %(z)s * SQRT((1 - %(fraction)s) * COUNT(fs.sale_id)) / %(fraction)s as {count}_margin,
+        AVG({measure}) as {average},
+        %(z)s * COALESCE(STDDEV_SAMP({measure}), 0) * SQRT(1 - %(fraction)s) / SQRT(COUNT(*))
+            as {average}_margin"""
+
+def _sample_params(sample_percent: float) -> Dict[str, Any]:
+    """Parameters of an approximate query over a sample of sales."""
+    return {'percent': sample_percent, 'fraction': sample_percent / 100, 'z': Z_95}
+
+def _with_distinct_estimates(rows: List[Dict[str, Any]], sketch_name: str, member_column: str,
+                             column: str, keep_member: bool = True) -> List[Dict[str, Any]]:
+    """
+    Add distinct customer estimates from the stored sketches to result rows.
+    
+    Args:
+        rows: Query results
+        sketch_name: Name of the sketch grouping (see utils.sketches.CUSTOMER_SKETCHES)
+        member_column: Result column holding the sketch member
+        column: Output name of the estimate (its 95% error bound goes to <column>_margin)
+        keep_member: Keep the member column in the results
+    
+    Returns:
+        The result rows
+    """
+    with get_read_db_connection() as conn:
+        sketches = load_sketches(conn, sketch_name)
+    for row in rows:
+        member = row[member_column] if keep_member else row.pop(member_column)
+        sketch = sketches.get(str(member))
+        estimate = sketch.estimate() if sketch else 0.0
+        row[column] = round(estimate)
+        row[f'{column}_margin'] = round(Z_95 * estimate * sketch.relative_error) if sketch else 0
+    return rows
 
-def get_customer_segment_analysis() -> List[Dict[str, Any]]:
-    """Get customer segment analysis."""
+def customer_segment_analysis_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_customer_segment_analysis."""
     query = f"""
     SELECT 
         c.customer_segment,
@@ -77,33 +163,132 @@ def get_customer_segment_analysis() -> List[Dict[str, Any]]:
         SUM(fs.net_amount) as total_revenue,
         AVG(fs.net_amount) as average_revenue_per_customer,
         COUNT(fs.sale_id) as total_transactions
-    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_id = c.customer_id
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
     GROUP BY c.customer_segment
     ORDER BY total_revenue DESC
     """
-    return execute_query(query)
+    return query, None
+
+def get_customer_segment_analysis(approximate: bool = False,
+                                  sample_percent: float = APPROX_SAMPLE_PERCENT
+                                  ) -> List[Dict[str, Any]]:
+    """
+    Get customer segment analysis.
+    
+    Args:
+        approximate: Estimate the figures from a sample of the sales and the
+            distinct customer sketches instead of scanning every sale; every
+            estimate comes with a *_margin column holding its 95% error bound
+        sample_percent: Percentage of sales rows sampled in approximate mode
+    """
+    if approximate:
+        query = f"""
+        SELECT 
+            c.customer_segment,
+            {_sampled_measures('fs.net_amount', 'total_revenue', 'total_transactions',
+                               'average_revenue_per_customer')}
+        FROM {SCHEMA_CONFIG['fact_schema']}.sample_sales(%(percent)s) fs
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
+        GROUP BY c.customer_segment
+        ORDER BY total_revenue DESC
+        """
+        rows = execute_query(query, _sample_params(sample_percent))
+        return _with_distinct_estimates(rows, 'customers_by_segment', 'customer_segment',
+                                        'number_of_customers')
+    
+    return execute_query(*customer_segment_analysis_query())
+
+def inventory_analysis_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_inventory_analysis."""
+    query = f"""
+    WITH history AS (
+        SELECT 
+            s.store_name,
+            p.category,
+            SUM(fi.units_sold) as total_sold,
+            SUM(fi.units_damaged) as total_damaged,
+            AVG(fi.reorder_point) as average_reorder_point
+        FROM {SCHEMA_CONFIG['fact_schema']}.fact_inventory fi
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fi.store_key = s.store_key
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fi.product_key = p.product_key
+        GROUP BY s.store_name, p.category
+    ),
+    stock AS (
+        SELECT 
+            s.store_name,
+            p.category,
+            SUM(cs.ending_quantity) as current_stock
+        FROM {SCHEMA_CONFIG['fact_schema']}.current_stock cs
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON s.store_id = cs.store_id AND s.is_current
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON p.product_id = cs.product_id AND p.is_current
+        GROUP BY s.store_name, p.category
+    )
+    SELECT 
+        h.store_name,
+        h.category,
+        COALESCE(st.current_stock, 0) as current_stock,
+        h.total_sold,
+        h.total_damaged,
+        h.average_reorder_point
+    FROM history h
+    LEFT JOIN stock st ON st.store_name = h.store_name AND st.category = h.category
+    ORDER BY h.store_name, h.category
+    """
+    return query, None
 
 def get_inventory_analysis() -> List[Dict[str, Any]]:
-    """Get inventory analysis by store and product category."""
+    """
+    Get inventory analysis by store and product category.
+    
+    The current stock is the ending quantity of the latest snapshot of every
+    store and product (the current stock table); units sold and damaged and
+    the reorder points are taken over all snapshots.
+    """
+    return execute_query(*inventory_analysis_query())
+
+def low_stock_alerts_query(store_id: Optional[str] = None
+                           ) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_low_stock_alerts."""
     query = f"""
     SELECT 
+        cs.store_id,
         s.store_name,
+        cs.product_id,
+        p.product_name,
         p.category,
-        SUM(fi.ending_quantity) as current_stock,
-        SUM(fi.units_sold) as total_sold,
-        SUM(fi.units_damaged) as total_damaged,
-        AVG(fi.reorder_point) as average_reorder_point
-    FROM {SCHEMA_CONFIG['fact_schema']}.fact_inventory fi
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fi.store_id = s.store_id
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fi.product_id = p.product_id
-    GROUP BY s.store_name, p.category
-    ORDER BY s.store_name, p.category
-    """
-    return execute_query(query)
+        TO_DATE(cs.date_key::TEXT, 'YYYYMMDD') as snapshot_date,
+        cs.ending_quantity,
+        cs.reorder_point,
+        cs.reorder_point - cs.ending_quantity as shortfall,
+        cs.reorder_quantity
+    FROM {SCHEMA_CONFIG['fact_schema']}.current_stock cs
+    LEFT JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON s.store_id = cs.store_id AND s.is_current
+    LEFT JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON p.product_id = cs.product_id AND p.is_current
+    WHERE cs.ending_quantity < cs.reorder_point
+        AND (%(store_id)s IS NULL OR cs.store_id = %(store_id)s)
+    ORDER BY shortfall DESC, cs.store_id, cs.product_id
+    """
+    return query, {'store_id': store_id}
 
-def get_sales_trends() -> List[Dict[str, Any]]:
-    """Get sales trends by month and category."""
+def get_low_stock_alerts(store_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Get the products whose current stock is below their reorder point.
+    
+    The alerts are read from the partial index of the current stock table
+    that holds the rows below their reorder point only, so the query takes
+    time in proportion to the alerts, not to the stores and products.
+    
+    Args:
+        store_id: Store to report (optional, defaults to every store)
+    
+    Returns:
+        One row per store and product to reorder, largest shortfall first
+    """
+    return execute_query(*low_stock_alerts_query(store_id))
+
+def sales_trends_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_sales_trends."""
     query = f"""
     SELECT 
         t.year,
@@ -112,16 +297,20 @@ def get_sales_trends() -> List[Dict[str, Any]]:
         SUM(fs.net_amount) as total_sales,
         COUNT(fs.sale_id) as number_of_transactions,
         AVG(fs.net_amount) as average_transaction_value
-    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_time t ON fs.date_id = t.date_id
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_id = p.product_id
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_time t ON fs.date_key = t.date_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_key = p.product_key
     GROUP BY t.year, t.month, p.category
     ORDER BY t.year, t.month, total_sales DESC
     """
-    return execute_query(query)
+    return query, None
+
+def get_sales_trends() -> List[Dict[str, Any]]:
+    """Get sales trends by month and category."""
+    return execute_query(*sales_trends_query())
 
-def get_top_performing_stores() -> List[Dict[str, Any]]:
-    """Get top performing stores by revenue and transaction count."""
+def top_performing_stores_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_top_performing_stores."""
     query = f"""
     SELECT 
         s.store_name,
@@ -131,16 +320,50 @@ def get_top_performing_stores() -> List[Dict[str, Any]]:
         COUNT(fs.sale_id) as total_transactions,
         SUM(fs.net_amount) as total_revenue,
         AVG(fs.net_amount) as average_transaction_value,
-        COUNT(DISTINCT fs.customer_id) as unique_customers
-    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fs.store_id = s.store_id
+        COUNT(DISTINCT c.customer_id) as unique_customers
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fs.store_key = s.store_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
     GROUP BY s.store_name, s.store_type, s.city, s.state
     ORDER BY total_revenue DESC
     """
-    return execute_query(query)
+    return query, None
 
-def get_customer_purchase_patterns() -> List[Dict[str, Any]]:
-    """Get customer purchase patterns by time of day and day of week."""
+def get_top_performing_stores(approximate: bool = False,
+                              sample_percent: float = APPROX_SAMPLE_PERCENT
+                              ) -> List[Dict[str, Any]]:
+    """
+    Get top performing stores by revenue and transaction count.
+    
+    Args:
+        approximate: Estimate the figures from a sample of the sales and the
+            distinct customer sketches instead of scanning every sale; every
+            estimate comes with a *_margin column holding its 95% error bound
+        sample_percent: Percentage of sales rows sampled in approximate mode
+    """
+    if approximate:
+        query = f"""
+        SELECT 
+            s.store_id,
+            s.store_name,
+            s.store_type,
+            s.city,
+            s.state,
+            {_sampled_measures('fs.net_amount', 'total_revenue', 'total_transactions',
+                               'average_transaction_value')}
+        FROM {SCHEMA_CONFIG['fact_schema']}.sample_sales(%(percent)s) fs
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fs.store_key = s.store_key
+        GROUP BY s.store_id, s.store_name, s.store_type, s.city, s.state
+        ORDER BY total_revenue DESC
+        """
+        rows = execute_query(query, _sample_params(sample_percent))
+        return _with_distinct_estimates(rows, 'customers_by_store', 'store_id',
+                                        'unique_customers', keep_member=False)
+    
+    return execute_query(*top_performing_stores_query())
+
+def customer_purchase_patterns_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_customer_purchase_patterns."""
     query = f"""
     SELECT 
         t.day_of_week,
@@ -148,48 +371,316 @@ def get_customer_purchase_patterns() -> List[Dict[str, Any]]:
         COUNT(fs.sale_id) as number_of_transactions,
         SUM(fs.net_amount) as total_sales,
         AVG(fs.net_amount) as average_transaction_value
-    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
-    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_time t ON fs.date_id = t.date_id
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_time t ON fs.date_key = t.date_key
     GROUP BY t.day_of_week, EXTRACT(HOUR FROM fs.transaction_time)
     ORDER BY t.day_of_week, hour_of_day
     """
-    return execute_query(query)
+    return query, None
+
+def get_customer_purchase_patterns() -> List[Dict[str, Any]]:
+    """Get customer purchase patterns by time of day and day of week."""
+    return execute_query(*customer_purchase_patterns_query())
+
+def _date_key(day: Optional[date], default: int) -> int:
+    """Return the YYYYMMDD key of a date, or a default without one."""
+    return int(day.strftime('%Y%m%d')) if day else default
+
+def _rfm_segment_case(recency: str, frequency: str) -> str:
+    """Build the CASE expression naming the RFM segment of the scores."""
+    rules = [f"WHEN {recency} >= {min_recency} AND {frequency} >= {min_frequency} THEN '{name}'"
+             for name, min_recency, min_frequency in RFM_SEGMENTS[:-1]]
+    return f"CASE {' '.join(rules)} ELSE '{RFM_SEGMENTS[-1][0]}' END"
+
+def rfm_segments_query(as_of: Optional[date] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_rfm_segments."""
+    query = f"""
+    WITH customers AS (
+        SELECT
+            customer_id,
+            TO_DATE(MAX(last_date_key)::TEXT, 'YYYYMMDD') as last_purchase_date,
+            SUM(transactions)::BIGINT as frequency,
+            SUM(net_amount) as monetary
+        FROM {SCHEMA_CONFIG['fact_schema']}.customer_activity
+        GROUP BY customer_id
+    ),
+    scored AS (
+        SELECT
+            customer_id,
+            last_purchase_date,
+            COALESCE(%(as_of)s::DATE, MAX(last_purchase_date) OVER ()) - last_purchase_date
+                as recency_days,
+            frequency,
+            monetary,
+            NTILE({RFM_SCORES}) OVER (ORDER BY last_purchase_date, customer_id) as recency_score,
+            NTILE({RFM_SCORES}) OVER (ORDER BY frequency, customer_id) as frequency_score,
+            NTILE({RFM_SCORES}) OVER (ORDER BY monetary, customer_id) as monetary_score
+        FROM customers
+    )
+    SELECT 
+        sc.customer_id,
+        c.customer_segment,
+        sc.last_purchase_date,
+        sc.recency_days,
+        sc.frequency,
+        sc.monetary,
+        sc.recency_score,
+        sc.frequency_score,
+        sc.monetary_score,
+        {_rfm_segment_case('sc.recency_score', 'sc.frequency_score')} as rfm_segment
+    FROM scored sc
+    LEFT JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c
+        ON c.customer_id = sc.customer_id AND c.is_current
+    ORDER BY sc.monetary DESC, sc.customer_id
+    """
+    return query, {'as_of': as_of}
+
+def get_rfm_segments(as_of: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Score every customer on recency, frequency and monetary value (RFM).
+    
+    Each measure is split into RFM_SCORES equal groups of customers (NTILE,
+    ties broken by customer id), the most recent, frequent and valuable
+    customers scoring highest, and the recency and frequency scores give the
+    segment (see utils.customer_activity.RFM_SEGMENTS). The figures come from
+    the monthly customer activity, so the query reads one row per customer
+    and month instead of every sale.
+    
+    Args:
+        as_of: Day recency is measured from (defaults to the last day with sales)
+    
+    Returns:
+        One row per customer, by monetary value
+    """
+    return execute_query(*rfm_segments_query(as_of))
+
+def cohort_retention_query() -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_cohort_retention."""
+    query = f"""
+    WITH activity AS (
+        SELECT
+            customer_id,
+            month_key,
+            MIN(month_key) OVER (PARTITION BY customer_id) as cohort_key
+        FROM {SCHEMA_CONFIG['fact_schema']}.customer_activity
+    ),
+    cohorts AS (
+        SELECT
+            cohort_key,
+            (month_key / 100 - cohort_key / 100) * 12 + MOD(month_key, 100) - MOD(cohort_key, 100)
+                as months_since_first_purchase,
+            COUNT(*) as active_customers
+        FROM activity
+        GROUP BY 1, 2
+    )
+    SELECT 
+        TO_DATE(cohort_key::TEXT, 'YYYYMM') as cohort_month,
+        months_since_first_purchase,
+        active_customers,
+        FIRST_VALUE(active_customers) OVER (
+            PARTITION BY cohort_key ORDER BY months_since_first_purchase
+        ) as cohort_size,
+        active_customers::DECIMAL / FIRST_VALUE(active_customers) OVER (
+            PARTITION BY cohort_key ORDER BY months_since_first_purchase
+        ) as retention_rate
+    FROM cohorts
+    ORDER BY cohort_key, months_since_first_purchase
+    """
+    return query, None
 
-def format_decimal(obj):
-    """Helper function to format Decimal objects for JSON serialization."""
-    if isinstance(obj, Decimal):
-        return float(obj)
-    elif isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    return obj
+def get_cohort_retention() -> List[Dict[str, Any]]:
+    """
+    Get the share of each monthly customer cohort buying again in later months.
+    
+    A customer's cohort is the month of their first purchase. Like the RFM
+    scores, the retention is computed from the monthly customer activity.
+    
+    Returns:
+        One row per cohort and month since the first purchase with sales,
+        with the active customers, the cohort size and the retention rate
+    """
+    return execute_query(*cohort_retention_query())
+
+def basket_affinity_query(level: str = 'category', start_date: Optional[date] = None,
+                          end_date: Optional[date] = None, min_baskets: int = 1
+                          ) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_basket_affinity."""
+    if level not in AFFINITY_LEVELS:
+        raise ValueError(f"Unknown affinity level {level}: use one of {', '.join(AFFINITY_LEVELS)}")
+    query = f"""
+    WITH items AS (
+        SELECT DISTINCT fs.date_key, c.customer_id, fs.store_key, p.{AFFINITY_LEVELS[level]} as item
+        FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_key = p.product_key
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
+        WHERE fs.date_key BETWEEN %(start)s AND %(end)s
+    ),
+    item_baskets AS (
+        SELECT item, COUNT(*) as baskets
+        FROM items
+        GROUP BY item
+    ),
+    pairs AS (
+        SELECT a.item as item_a, b.item as item_b, COUNT(*) as baskets
+        FROM items a
+        JOIN items b
+            ON a.date_key = b.date_key AND a.customer_id = b.customer_id
+            AND a.store_key = b.store_key AND a.item < b.item
+        GROUP BY a.item, b.item
+        HAVING COUNT(*) >= %(min_baskets)s
+    ),
+    baskets AS (
+        SELECT COUNT(*) as total
+        FROM (SELECT DISTINCT date_key, customer_id, store_key FROM items) b
+    )
+    SELECT 
+        pairs.item_a,
+        pairs.item_b,
+        pairs.baskets,
+        pairs.baskets::DECIMAL / baskets.total as support,
+        pairs.baskets::DECIMAL / a.baskets as confidence_a_to_b,
+        pairs.baskets::DECIMAL / b.baskets as confidence_b_to_a,
+        pairs.baskets::DECIMAL * baskets.total / (a.baskets * b.baskets) as lift
+    FROM pairs
+    CROSS JOIN baskets
+    JOIN item_baskets a ON a.item = pairs.item_a
+    JOIN item_baskets b ON b.item = pairs.item_b
+    ORDER BY lift DESC, pairs.baskets DESC, pairs.item_a, pairs.item_b
+    """
+    return query, {'start': _date_key(start_date, 0),
+                   'end': _date_key(end_date, 99991231),
+                   'min_baskets': min_baskets}
+
+def get_basket_affinity(level: str = 'category', start_date: Optional[date] = None,
+                        end_date: Optional[date] = None, min_baskets: int = 1
+                        ) -> List[Dict[str, Any]]:
+    """
+    Get the pairs of items bought together and how strongly they attract each other.
+    
+    A basket is what a customer (by customer_id, whatever versions of the
+    customer the sales reference) bought at one store on one day; its items
+    are the distinct products, categories, subcategories or brands in it.
+    For every pair of items the baskets holding both give the support
+    (share of all baskets), the confidence in each direction (share of the
+    baskets holding the first item that also hold the second) and the lift
+    (how much more often the pair occurs than if the items were independent).
+    The baskets are read from the ix_fact_sales_basket index, so a date
+    range only reads its own sales.
+    
+    Args:
+        level: Item level (a key of AFFINITY_LEVELS)
+        start_date: First day of the baskets (optional)
+        end_date: Last day of the baskets (optional)
+        min_baskets: Pairs in fewer baskets are left out
+    
+    Returns:
+        One row per pair of items (item_a < item_b), by lift
+    """
+    return execute_query(*basket_affinity_query(level, start_date, end_date, min_baskets))
+
+def rolling_store_sales_query(start_date: Optional[date] = None,
+                              end_date: Optional[date] = None
+                              ) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Build the SQL query and parameters of get_rolling_store_sales."""
+    windows = ''.join(
+        f"""
+            SUM(net_amount) OVER (
+                PARTITION BY store_id ORDER BY full_date
+                RANGE BETWEEN INTERVAL '{days - 1} days' PRECEDING AND CURRENT ROW
+            ) as sales_{days}_day,
+            SUM(transactions) OVER (
+                PARTITION BY store_id ORDER BY full_date
+                RANGE BETWEEN INTERVAL '{days - 1} days' PRECEDING AND CURRENT ROW
+            )::BIGINT as transactions_{days}_day,"""
+        for days in ROLLING_WINDOWS
+    ).rstrip(',')
+    columns = ''.join(f"""
+        r.sales_{days}_day,
+        r.transactions_{days}_day,""" for days in ROLLING_WINDOWS).rstrip(',')
+    # Days before the start still count towards the windows that reach back into them
+    window_start = (start_date - timedelta(days=max(ROLLING_WINDOWS) - 1)) if start_date else None
+    query = f"""
+    WITH daily AS (
+        SELECT
+            store_id,
+            TO_DATE(date_key::TEXT, 'YYYYMMDD') as full_date,
+            transactions,
+            net_amount
+        FROM {SCHEMA_CONFIG['fact_schema']}.sales_cube
+        WHERE grouping_id = %(grouping_id)s AND date_key BETWEEN %(window_start)s AND %(end)s
+    ),
+    rolling AS (
+        SELECT
+            store_id,
+            full_date,
+            net_amount as daily_sales,
+            transactions as daily_transactions,{windows}
+        FROM daily
+    )
+    SELECT 
+        r.store_id,
+        s.store_name,
+        r.full_date,
+        r.daily_sales,
+        r.daily_transactions,{columns}
+    FROM rolling r
+    LEFT JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON s.store_id = r.store_id AND s.is_current
+    WHERE r.full_date >= %(start)s
+    ORDER BY r.store_id, r.full_date
+    """
+    return query, {'grouping_id': grouping_id(['date', 'store']),
+                   'window_start': _date_key(window_start, 0),
+                   'end': _date_key(end_date, 99991231),
+                   'start': start_date or date.min}
+
+def get_rolling_store_sales(start_date: Optional[date] = None,
+                            end_date: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Get the daily sales of every store with their rolling 7 and 30 day totals.
+    
+    The daily store totals come from the sales cube, so the query reads one
+    row per store and day with sales. A rolling total covers the day and the
+    days before it within the window (ROLLING_WINDOWS), including days
+    before start_date.
+    
+    Args:
+        start_date: First day to report (optional)
+        end_date: Last day to report (optional)
+    
+    Returns:
+        One row per store and day with sales, by store and day
+    """
+    return execute_query(*rolling_store_sales_query(start_date, end_date))
 
 if __name__ == '__main__':
+    from queries.export import dumps
+
     print("\n=== Sales Data Warehouse Analytics ===\n")
     
     print("1. Daily Sales by Store (Top 5):")
     daily_sales = get_daily_sales_by_store()[:5]
-    print(json.dumps(daily_sales, indent=2, default=format_decimal))
+    print(dumps(daily_sales))
     
     print("\n2. Product Performance (Top 5):")
     product_perf = get_product_performance()[:5]
-    print(json.dumps(product_perf, indent=2, default=format_decimal))
+    print(dumps(product_perf))
     
     print("\n3. Customer Segment Analysis:")
     segment_analysis = get_customer_segment_analysis()
-    print(json.dumps(segment_analysis, indent=2, default=format_decimal))
+    print(dumps(segment_analysis))
     
     print("\n4. Inventory Analysis (Top 5):")
     inventory = get_inventory_analysis()[:5]
-    print(json.dumps(inventory, indent=2, default=format_decimal))
+    print(dumps(inventory))
     
     print("\n5. Sales Trends (Top 5):")
     trends = get_sales_trends()[:5]
-    print(json.dumps(trends, indent=2, default=format_decimal))
+    print(dumps(trends))
     
     print("\n6. Top Performing Stores (Top 5):")
     top_stores = get_top_performing_stores()[:5]
-    print(json.dumps(top_stores, indent=2, default=format_decimal))
+    print(dumps(top_stores))
     
     print("\n7. Customer Purchase Patterns (Sample):")
     patterns = get_customer_purchase_patterns()[:5]
-    print(json.dumps(patterns, indent=2, default=format_decimal)) 
\ No newline at end of file
+    print(dumps(patterns)) 
\ No newline at end of file
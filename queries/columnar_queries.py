@@ -0,0 +1,450 @@
+"""
+Columnar analytics queries for the sales data warehouse.
+
+Runs the same reports as ``queries/analytics_queries.py`` directly over the
+Parquet files in ``data/processed`` (see ``DataManager.convert_to_parquet``)
+using Arrow's vectorized hash joins and group-by, so the full report can be
+produced without a PostgreSQL server. The customer and basket analytics
+finish with NumPy over the grouped columns (window ranks and rolling sums),
+so their cost grows linearly with the sales as well.
+"""
+from datetime import date
+from typing import List, Dict, Any, Optional, Sequence
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from config import PROCESSED_DATA_DIR
+from queries.analytics_queries import AFFINITY_LEVELS, ROLLING_WINDOWS
+from utils.customer_activity import RFM_SCORES, RFM_SEGMENTS
+
+# Parquet files produced from the raw CSV extracts
+PARQUET_FILES = {
+    'sales': 'sales.parquet',
+    'inventory': 'inventory.parquet',
+    'products': 'products.parquet',
+    'customers': 'customers.parquet',
+    'stores': 'stores.parquet',
+    'time': 'time_dimension.parquet'
+}
+
+# Join keys are compared as strings so that IDs inferred as integers
+# (e.g. date_id) match regardless of how the Parquet file was written
+KEY_COLUMNS = {'date_id', 'product_id', 'customer_id', 'store_id'}
+
+def read_table(name: str, columns: Sequence[str],
+               data_dir: Optional[str] = None) -> pa.Table:
+    """
+    Read the requested columns of a Parquet extract.
+
+    Args:
+        name: Logical table name (a key of PARQUET_FILES)
+        columns: Columns to read; other columns are never decoded
+        data_dir: Directory holding the Parquet files (defaults to PROCESSED_DATA_DIR)
+
+    Returns:
+        Arrow table with join keys normalized to strings and categorical
+        columns decoded
+    """
+    path = os.path.join(data_dir or PROCESSED_DATA_DIR, PARQUET_FILES[name])
+    table = pq.read_table(path, columns=list(columns))
+    # Categorical columns come back dictionary encoded, which sorting does not support
+    for index, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(index, field.name, pc.cast(table[field.name], field.type.value_type))
+    for column in KEY_COLUMNS.intersection(columns):
+        index = table.schema.get_field_index(column)
+        if not pa.types.is_string(table.schema.field(index).type):
+            table = table.set_column(index, column, pc.cast(table[column], pa.string()))
+    return table
+
+def _is_text(data_type: pa.DataType) -> bool:
+    """Check whether an Arrow type holds strings."""
+    return pa.types.is_string(data_type) or pa.types.is_large_string(data_type)
+
+def _as_date(array: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Convert a string or timestamp column to date32."""
+    if _is_text(array.type):
+        array = pc.strptime(array, format='%Y-%m-%d', unit='s')
+    return pc.cast(array, pa.date32())
+
+def _date_id_as_date(array: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Convert a YYYYMMDD date_id column to date32."""
+    return pc.cast(pc.strptime(array, format='%Y%m%d', unit='s'), pa.date32())
+
+def _as_timestamp(array: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Convert a string column to a timestamp."""
+    if _is_text(array.type):
+        return pc.strptime(array, format='%Y-%m-%d %H:%M:%S', unit='s')
+    return array
+
+def _aggregate(table: pa.Table, keys: List[str],
+               aggregations: Dict[str, tuple]) -> pa.Table:
+    """
+    Group a table and rename the aggregate columns.
+
+    Args:
+        table: Input table
+        keys: Grouping columns
+        aggregations: Mapping of output column to (input column, Arrow aggregate)
+
+    Returns:
+        Aggregated table with the grouping columns followed by the outputs
+    """
+    grouped = table.group_by(keys).aggregate(
+        [(column, function) for column, function in aggregations.values()]
+    )
+    renames = {f'{column}_{function}': output
+               for output, (column, function) in aggregations.items()}
+    grouped = grouped.rename_columns([renames.get(name, name) for name in grouped.column_names])
+    return grouped.select(keys + list(aggregations))
+
+def _to_records(table: pa.Table, sort_keys: List[tuple]) -> List[Dict[str, Any]]:
+    """Sort a table and return it as a list of dictionaries."""
+    return table.sort_by(sort_keys).to_pylist()
+
+def get_daily_sales_by_store(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get daily sales totals by store."""
+    sales = read_table('sales', ['sale_id', 'store_id', 'date_id', 'net_amount'], data_dir)
+    stores = read_table('stores', ['store_id', 'store_name'], data_dir)
+    time_dim = read_table('time', ['date_id', 'full_date'], data_dir)
+
+    joined = sales.join(stores, 'store_id').join(time_dim, 'date_id')
+    joined = joined.set_column(joined.schema.get_field_index('full_date'), 'full_date',
+                               _as_date(joined['full_date']))
+    result = _aggregate(joined, ['store_name', 'full_date'], {
+        'total_sales': ('net_amount', 'sum'),
+        'number_of_transactions': ('sale_id', 'count'),
+        'average_transaction_value': ('net_amount', 'mean')
+    })
+    return _to_records(result, [('full_date', 'ascending'), ('total_sales', 'descending')])
+
+def get_product_performance(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get product performance metrics."""
+    sales = read_table('sales', ['sale_id', 'product_id', 'quantity', 'net_amount', 'unit_price'],
+                       data_dir)
+    products = read_table('products', ['product_id', 'product_name', 'category', 'brand'], data_dir)
+
+    joined = sales.join(products, 'product_id')
+    result = _aggregate(joined, ['product_name', 'category', 'brand'], {
+        'total_sales': ('sale_id', 'count'),
+        'total_quantity_sold': ('quantity', 'sum'),
+        'total_revenue': ('net_amount', 'sum'),
+        'average_price': ('unit_price', 'mean')
+    })
+    return _to_records(result, [('total_revenue', 'descending')])
+
+def get_customer_segment_analysis(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get customer segment analysis."""
+    sales = read_table('sales', ['sale_id', 'customer_id', 'net_amount'], data_dir)
+    customers = read_table('customers', ['customer_id', 'customer_segment'], data_dir)
+
+    joined = sales.join(customers, 'customer_id')
+    result = _aggregate(joined, ['customer_segment'], {
+        'number_of_customers': ('customer_id', 'count_distinct'),
+        'total_revenue': ('net_amount', 'sum'),
+        'average_revenue_per_customer': ('net_amount', 'mean'),
+        'total_transactions': ('sale_id', 'count')
+    })
+    return _to_records(result, [('total_revenue', 'descending')])
+
+def _latest_snapshots(inventory: pa.Table) -> pa.Table:
+    """Keep the latest inventory snapshot (date_id, then inventory_id) per store and product."""
+    ordered = inventory.sort_by([('store_id', 'ascending'), ('product_id', 'ascending'),
+                                 ('date_id', 'descending'), ('inventory_id', 'descending')])
+    first = np.zeros(ordered.num_rows, dtype=bool)
+    first[:1] = True
+    for column in ('store_id', 'product_id'):
+        values = ordered[column].combine_chunks()
+        first[1:] |= pc.not_equal(values[1:], values[:-1]).to_numpy(zero_copy_only=False)
+    return ordered.filter(pa.array(first))
+
+def get_inventory_analysis(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get inventory analysis by store and product category (stock of the latest snapshots)."""
+    inventory = read_table('inventory', ['inventory_id', 'date_id', 'store_id', 'product_id',
+                                         'ending_quantity', 'units_sold', 'units_damaged',
+                                         'reorder_point'], data_dir)
+    stores = read_table('stores', ['store_id', 'store_name'], data_dir)
+    products = read_table('products', ['product_id', 'category'], data_dir)
+
+    history = _aggregate(inventory.join(stores, 'store_id').join(products, 'product_id'),
+                         ['store_name', 'category'], {
+        'total_sold': ('units_sold', 'sum'),
+        'total_damaged': ('units_damaged', 'sum'),
+        'average_reorder_point': ('reorder_point', 'mean')
+    })
+    stock = _aggregate(_latest_snapshots(inventory).join(stores, 'store_id').join(products, 'product_id'),
+                       ['store_name', 'category'], {
+        'current_stock': ('ending_quantity', 'sum')
+    })
+    result = history.join(stock, ['store_name', 'category'], join_type='left outer')
+    result = result.set_column(result.schema.get_field_index('current_stock'), 'current_stock',
+                               pc.fill_null(result['current_stock'], 0))
+    result = result.select(['store_name', 'category', 'current_stock', 'total_sold',
+                            'total_damaged', 'average_reorder_point'])
+    return _to_records(result, [('store_name', 'ascending'), ('category', 'ascending')])
+
+def get_low_stock_alerts(data_dir: Optional[str] = None,
+                         store_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get the products whose latest stock is below their reorder point."""
+    inventory = read_table('inventory', ['inventory_id', 'date_id', 'store_id', 'product_id',
+                                         'ending_quantity', 'reorder_point', 'reorder_quantity'],
+                           data_dir)
+    stores = read_table('stores', ['store_id', 'store_name'], data_dir)
+    products = read_table('products', ['product_id', 'product_name', 'category'], data_dir)
+
+    latest = _latest_snapshots(inventory)
+    alerts = latest.filter(pc.less(latest['ending_quantity'], latest['reorder_point']))
+    if store_id is not None:
+        alerts = alerts.filter(pc.equal(alerts['store_id'], store_id))
+    alerts = alerts.append_column('snapshot_date', _date_id_as_date(alerts['date_id']))
+    alerts = alerts.append_column('shortfall', pc.subtract(alerts['reorder_point'],
+                                                           alerts['ending_quantity']))
+    alerts = (alerts.join(stores, 'store_id', join_type='left outer')
+              .join(products, 'product_id', join_type='left outer'))
+    alerts = alerts.select(['store_id', 'store_name', 'product_id', 'product_name', 'category',
+                            'snapshot_date', 'ending_quantity', 'reorder_point', 'shortfall',
+                            'reorder_quantity'])
+    return _to_records(alerts, [('shortfall', 'descending'), ('store_id', 'ascending'),
+                                ('product_id', 'ascending')])
+
+def get_sales_trends(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get sales trends by month and category."""
+    sales = read_table('sales', ['sale_id', 'date_id', 'product_id', 'net_amount'], data_dir)
+    time_dim = read_table('time', ['date_id', 'year', 'month'], data_dir)
+    products = read_table('products', ['product_id', 'category'], data_dir)
+
+    joined = sales.join(time_dim, 'date_id').join(products, 'product_id')
+    result = _aggregate(joined, ['year', 'month', 'category'], {
+        'total_sales': ('net_amount', 'sum'),
+        'number_of_transactions': ('sale_id', 'count'),
+        'average_transaction_value': ('net_amount', 'mean')
+    })
+    return _to_records(result, [('year', 'ascending'), ('month', 'ascending'),
+                                ('total_sales', 'descending')])
+
+def get_top_performing_stores(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get top performing stores by revenue and transaction count."""
+    sales = read_table('sales', ['sale_id', 'store_id', 'customer_id', 'net_amount'], data_dir)
+    stores = read_table('stores', ['store_id', 'store_name', 'store_type', 'city', 'state'],
+                        data_dir)
+
+    joined = sales.join(stores, 'store_id')
+    result = _aggregate(joined, ['store_name', 'store_type', 'city', 'state'], {
+        'total_transactions': ('sale_id', 'count'),
+        'total_revenue': ('net_amount', 'sum'),
+        'average_transaction_value': ('net_amount', 'mean'),
+        'unique_customers': ('customer_id', 'count_distinct')
+    })
+    return _to_records(result, [('total_revenue', 'descending')])
+
+def get_customer_purchase_patterns(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get customer purchase patterns by time of day and day of week."""
+    sales = read_table('sales', ['sale_id', 'date_id', 'net_amount', 'transaction_time'], data_dir)
+    time_dim = read_table('time', ['date_id', 'day_of_week'], data_dir)
+
+    joined = sales.join(time_dim, 'date_id')
+    joined = joined.append_column('hour_of_day', pc.hour(_as_timestamp(joined['transaction_time'])))
+    result = _aggregate(joined, ['day_of_week', 'hour_of_day'], {
+        'number_of_transactions': ('sale_id', 'count'),
+        'total_sales': ('net_amount', 'sum'),
+        'average_transaction_value': ('net_amount', 'mean')
+    })
+    return _to_records(result, [('day_of_week', 'ascending'), ('hour_of_day', 'ascending')])
+
+def _ntile(values: np.ndarray, tiebreak: np.ndarray, buckets: int) -> np.ndarray:
+    """
+    Number rows from 1 to `buckets` like SQL NTILE(buckets) OVER (ORDER BY values, tiebreak).
+
+    The first len(values) % buckets groups hold one row more than the others.
+    """
+    n = len(values)
+    order = np.lexsort((tiebreak, values))
+    size, extra = divmod(n, buckets)
+    position = np.arange(n)
+    larger = extra * (size + 1)
+    tiles = np.where(position < larger, position // (size + 1),
+                     extra + (position - larger) // max(size, 1)) + 1
+    scores = np.empty(n, dtype=np.int64)
+    scores[order] = tiles
+    return scores
+
+def get_rfm_segments(data_dir: Optional[str] = None,
+                     as_of: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Score every customer on recency, frequency and monetary value (RFM)."""
+    sales = read_table('sales', ['customer_id', 'date_id', 'net_amount'], data_dir)
+    customers = read_table('customers', ['customer_id', 'customer_segment'], data_dir)
+
+    sales = sales.append_column('full_date', _date_id_as_date(sales['date_id']))
+    result = _aggregate(sales, ['customer_id'], {
+        'last_purchase_date': ('full_date', 'max'),
+        'frequency': ('net_amount', 'count'),
+        'monetary': ('net_amount', 'sum')
+    })
+    ids = np.asarray(result['customer_id'].to_pylist(), dtype=str)
+    last = result['last_purchase_date'].cast(pa.int32()).to_numpy()
+    frequency = result['frequency'].to_numpy()
+    monetary = result['monetary'].to_numpy()
+    reference = (as_of - date(1970, 1, 1)).days if as_of else last.max()
+
+    recency = _ntile(last, ids, RFM_SCORES)
+    frequency_score = _ntile(frequency, ids, RFM_SCORES)
+    segments = np.select([(recency >= min_recency) & (frequency_score >= min_frequency)
+                          for _, min_recency, min_frequency in RFM_SEGMENTS[:-1]],
+                         [name for name, _, _ in RFM_SEGMENTS[:-1]], RFM_SEGMENTS[-1][0])
+    result = result.append_column('recency_days', pa.array(reference - last, pa.int64()))
+    result = result.append_column('recency_score', pa.array(recency))
+    result = result.append_column('frequency_score', pa.array(frequency_score))
+    result = result.append_column('monetary_score', pa.array(_ntile(monetary, ids, RFM_SCORES)))
+    result = result.append_column('rfm_segment', pa.array(segments.tolist(), pa.string()))
+
+    result = result.join(customers, 'customer_id', join_type='left outer')
+    result = result.select(['customer_id', 'customer_segment', 'last_purchase_date',
+                            'recency_days', 'frequency', 'monetary', 'recency_score',
+                            'frequency_score', 'monetary_score', 'rfm_segment'])
+    return _to_records(result, [('monetary', 'descending'), ('customer_id', 'ascending')])
+
+def get_cohort_retention(data_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get the share of each monthly customer cohort buying again in later months."""
+    sales = read_table('sales', ['customer_id', 'date_id'], data_dir)
+
+    month_key = pc.divide(pc.cast(sales['date_id'], pa.int64()), 100)
+    activity = (pa.table({'customer_id': sales['customer_id'], 'month_key': month_key})
+                .group_by(['customer_id', 'month_key']).aggregate([]))
+    cohorts = _aggregate(activity, ['customer_id'], {'cohort_key': ('month_key', 'min')})
+    activity = activity.join(cohorts, 'customer_id')
+    month = activity['month_key'].to_numpy()
+    cohort = activity['cohort_key'].to_numpy()
+    activity = activity.append_column(
+        'months_since_first_purchase',
+        pa.array((month // 100 - cohort // 100) * 12 + month % 100 - cohort % 100)
+    )
+
+    result = _aggregate(activity, ['cohort_key', 'months_since_first_purchase'], {
+        'active_customers': ('customer_id', 'count')
+    })
+    sizes = result.filter(pc.equal(result['months_since_first_purchase'], 0))
+    sizes = sizes.select(['cohort_key', 'active_customers']).rename_columns(['cohort_key',
+                                                                              'cohort_size'])
+    result = result.join(sizes, 'cohort_key')
+    keys = result['cohort_key'].to_numpy()
+    months = (keys // 100 - 1970) * 12 + keys % 100 - 1
+    result = result.append_column(
+        'cohort_month', pa.array(months.astype('datetime64[M]').astype('datetime64[D]'), pa.date32())
+    )
+    result = result.append_column(
+        'retention_rate', pc.divide(pc.cast(result['active_customers'], pa.float64()),
+                                    result['cohort_size'])
+    )
+    result = result.select(['cohort_month', 'months_since_first_purchase', 'active_customers',
+                            'cohort_size', 'retention_rate'])
+    return _to_records(result, [('cohort_month', 'ascending'),
+                                ('months_since_first_purchase', 'ascending')])
+
+def get_basket_affinity(data_dir: Optional[str] = None, level: str = 'category',
+                        start_date: Optional[date] = None, end_date: Optional[date] = None,
+                        min_baskets: int = 1) -> List[Dict[str, Any]]:
+    """Get the pairs of items bought together and how strongly they attract each other."""
+    if level not in AFFINITY_LEVELS:
+        raise ValueError(f"Unknown affinity level {level}: use one of {', '.join(AFFINITY_LEVELS)}")
+    basket = ['date_id', 'customer_id', 'store_id']
+    sales = read_table('sales', basket + ['product_id'], data_dir)
+    if start_date:
+        sales = sales.filter(pc.greater_equal(sales['date_id'], start_date.strftime('%Y%m%d')))
+    if end_date:
+        sales = sales.filter(pc.less_equal(sales['date_id'], end_date.strftime('%Y%m%d')))
+    column = AFFINITY_LEVELS[level]
+    if column != 'product_id':
+        sales = sales.join(read_table('products', ['product_id', column], data_dir), 'product_id')
+
+    items = (pa.table({**{key: sales[key] for key in basket}, 'item': sales[column]})
+             .group_by(basket + ['item']).aggregate([]))
+    total = items.select(basket).group_by(basket).aggregate([]).num_rows
+    item_baskets = items.group_by('item').aggregate([([], 'count_all')])
+
+    pairs = items.rename_columns(basket + ['item_a']).join(
+        items.rename_columns(basket + ['item_b']), basket)
+    pairs = pairs.filter(pc.less(pairs['item_a'], pairs['item_b']))
+    result = pairs.group_by(['item_a', 'item_b']).aggregate([([], 'count_all')])
+    result = result.filter(pc.greater_equal(result['count_all'], min_baskets))
+    result = result.rename_columns(['baskets' if name == 'count_all' else name
+                                    for name in result.column_names])
+    for side in ('a', 'b'):
+        counts = item_baskets.rename_columns([f'item_{side}' if name == 'item' else f'baskets_{side}'
+                                              for name in item_baskets.column_names])
+        result = result.join(counts, f'item_{side}')
+
+    both = result['baskets'].to_numpy().astype(float)
+    with_a = result['baskets_a'].to_numpy()
+    with_b = result['baskets_b'].to_numpy()
+    result = result.select(['item_a', 'item_b', 'baskets'])
+    result = result.append_column('support', pa.array(both / total if total else both))
+    result = result.append_column('confidence_a_to_b', pa.array(both / with_a))
+    result = result.append_column('confidence_b_to_a', pa.array(both / with_b))
+    result = result.append_column('lift', pa.array(both * total / (with_a * with_b)))
+    return _to_records(result, [('lift', 'descending'), ('baskets', 'descending'),
+                                ('item_a', 'ascending'), ('item_b', 'ascending')])
+
+def get_rolling_store_sales(data_dir: Optional[str] = None, start_date: Optional[date] = None,
+                            end_date: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Get the daily sales of every store with their rolling 7 and 30 day totals."""
+    sales = read_table('sales', ['sale_id', 'store_id', 'date_id', 'net_amount'], data_dir)
+    stores = read_table('stores', ['store_id', 'store_name'], data_dir)
+
+    if end_date:
+        sales = sales.filter(pc.less_equal(sales['date_id'], end_date.strftime('%Y%m%d')))
+    daily = _aggregate(sales, ['store_id', 'date_id'], {
+        'daily_sales': ('net_amount', 'sum'),
+        'daily_transactions': ('sale_id', 'count')
+    })
+    daily = daily.append_column('full_date', _date_id_as_date(daily['date_id']))
+
+    # Sorted by store and day, a window is the rows whose composite key lies
+    # within the window's days of the row's key: rolling sums are
+    # differences of running totals
+    store_ids = np.asarray(daily['store_id'].to_pylist(), dtype=str)
+    days = daily['full_date'].cast(pa.int32()).to_numpy().astype(np.int64)
+    _, store_codes = np.unique(store_ids, return_inverse=True)
+    order = np.lexsort((days, store_codes))
+    daily = daily.take(pa.array(order))
+    keys = (store_codes[order].astype(np.int64) << 32) + days[order]
+    columns = ['store_id', 'store_name', 'full_date', 'daily_sales', 'daily_transactions']
+    for window in ROLLING_WINDOWS:
+        first = np.searchsorted(keys, keys - (window - 1), side='left')
+        for measure, name in (('daily_sales', f'sales_{window}_day'),
+                              ('daily_transactions', f'transactions_{window}_day')):
+            running = np.concatenate(([0], np.cumsum(daily[measure].to_numpy())))
+            daily = daily.append_column(name, pa.array(running[1:] - running[first]))
+            columns.append(name)
+
+    if start_date:
+        daily = daily.filter(pc.greater_equal(daily['full_date'], pa.scalar(start_date, pa.date32())))
+    result = daily.join(stores, 'store_id', join_type='left outer').select(columns)
+    return _to_records(result, [('store_id', 'ascending'), ('full_date', 'ascending')])
+
+if __name__ == '__main__':
+    from queries.export import dumps
+
+    print("\n=== Sales Data Warehouse Analytics (columnar) ===\n")
+
+    print("1. Daily Sales by Store (Top 5):")
+    print(dumps(get_daily_sales_by_store()[:5]))
+
+    print("\n2. Product Performance (Top 5):")
+    print(dumps(get_product_performance()[:5]))
+
+    print("\n3. Customer Segment Analysis:")
+    print(dumps(get_customer_segment_analysis()))
+
+    print("\n4. Inventory Analysis (Top 5):")
+    print(dumps(get_inventory_analysis()[:5]))
+
+    print("\n5. Sales Trends (Top 5):")
+    print(dumps(get_sales_trends()[:5]))
+
+    print("\n6. Top Performing Stores (Top 5):")
+    print(dumps(get_top_performing_stores()[:5]))
+
+    print("\n7. Customer Purchase Patterns (Sample):")
+    print(dumps(get_customer_purchase_patterns()[:5]))
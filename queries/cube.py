@@ -0,0 +1,86 @@
+"""
+Slice and drill-down queries answered from the pre-aggregated sales cube.
+
+Any combination of the cube dimensions (date, store, category, segment),
+plus the year and month of the date, can be grouped by and filtered on:
+
+    query_cube(['category'])
+    query_cube(['month', 'store'], filters={'year': 2023, 'segment': ['VIP', 'Premium']})
+"""
+from typing import Any, Dict, List, Optional
+from config import SCHEMA_CONFIG
+from queries.analytics_queries import execute_query
+from utils.cube import grouping_id
+
+# Query level -> (cube dimension it is computed from, output columns and their expressions)
+LEVELS = {
+    'date': ('date', {'full_date': "TO_DATE(cube.date_key::TEXT, 'YYYYMMDD')"}),
+    'year': ('date', {'year': 'cube.date_key / 10000'}),
+    'month': ('date', {'month': 'cube.date_key / 100 %% 100'}),
+    'store': ('store', {'store_id': 'cube.store_id', 'store_name': 's.store_name'}),
+    'category': ('category', {'category': 'cube.category'}),
+    'segment': ('segment', {'customer_segment': 'cube.customer_segment'})
+}
+
+def query_cube(group_by: List[str], filters: Optional[Dict[str, Any]] = None
+               ) -> List[Dict[str, Any]]:
+    """
+    Aggregate the sales measures by any combination of levels.
+
+    Args:
+        group_by: Levels to group by (keys of LEVELS), in output order
+        filters: Level -> value or list of values to keep; for 'store' the
+            values are store ids
+
+    Returns:
+        One dictionary per group with the level columns, transactions,
+        quantity, total_amount, discount_amount, net_amount and
+        average_transaction_value
+    """
+    filters = filters or {}
+    unknown = (set(group_by) | set(filters)) - set(LEVELS)
+    if unknown:
+        raise ValueError(f"Unknown cube levels: {', '.join(sorted(unknown))}")
+
+    # Cells grouped by every dimension that is grouped by or filtered on
+    dimensions = {LEVELS[level][0] for level in list(group_by) + list(filters)}
+    params: Dict[str, Any] = {'grouping_id': grouping_id(dimensions)}
+
+    columns = []
+    for level in group_by:
+        columns.extend(LEVELS[level][1].items())
+    conditions = ['cube.grouping_id = %(grouping_id)s']
+    for level, values in filters.items():
+        # Filter on the first expression of the level (the key for stores)
+        expression = next(iter(LEVELS[level][1].values()))
+        params[level] = list(values) if isinstance(values, (list, tuple, set)) else [values]
+        conditions.append(f"{expression} = ANY(%({level})s)")
+
+    select = ''.join(f"{expression} as {name},\n        " for name, expression in columns)
+    group_order = ''
+    if columns:
+        group_order = (f"GROUP BY {', '.join(expression for _, expression in columns)}\n    "
+                       f"ORDER BY {', '.join(expression for _, expression in columns)}")
+    store_join = ''
+    if 'store' in group_by:
+        store_join = (f"LEFT JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s "
+                      "ON s.store_id = cube.store_id AND s.is_current")
+
+    query = f"""
+    SELECT
+        {select}SUM(cube.transactions)::BIGINT as transactions,
+        SUM(cube.quantity)::BIGINT as quantity,
+        SUM(cube.total_amount) as total_amount,
+        SUM(cube.discount_amount) as discount_amount,
+        SUM(cube.net_amount) as net_amount,
+        SUM(cube.net_amount) / NULLIF(SUM(cube.transactions), 0) as average_transaction_value
+    FROM {SCHEMA_CONFIG['fact_schema']}.sales_cube cube
+    {store_join}
+    WHERE {' AND '.join(conditions)}
+    {group_order}
+    """
+    return execute_query(query, params)
+
+if __name__ == '__main__':
+    for row in query_cube(['category']):
+        print(row)
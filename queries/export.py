@@ -0,0 +1,373 @@
+"""
+Streaming export of query results to JSON, NDJSON, CSV and Parquet.
+
+Rows are fetched from a server-side cursor in batches of
+EXPORT_CONFIG['batch_rows'] and converted to Arrow record batches one column
+at a time, so NUMERIC, date and timestamp values are converted by Arrow
+instead of by a Python callback per value. CSV and Parquet files are written
+by Arrow; JSON and NDJSON rows are serialized with orjson when it is
+installed, with the json module as a fallback. Only one batch is held in
+memory, whatever the size of the result. Reports stream their query the
+same way; only the approximate modes, completed from the sketches, and
+sharded reports, merged across the shards, are held in memory in full.
+NUMERIC values are exported as doubles, as the analytics output always did.
+
+Usage:
+    python -m queries.export daily_sales_by_store reports/daily_sales.parquet
+    python -m queries.export --query "SELECT * FROM facts.v_sales" sales.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime
+from itertools import chain
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from config import EXPORT_CONFIG
+from queries import analytics_queries
+from utils.db_utils import get_read_connection
+from utils.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional: the json module is used instead
+    orjson = None
+
+# File extension -> export format
+FORMATS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.parquet': 'parquet'
+}
+
+# PostgreSQL type OID -> Arrow type of the exported column (others are inferred)
+PG_ARROW_TYPES = {
+    16: pa.bool_(),                       # boolean
+    20: pa.int64(),                       # bigint
+    21: pa.int16(),                       # smallint
+    23: pa.int32(),                       # integer
+    700: pa.float64(),                    # real
+    701: pa.float64(),                    # double precision
+    1700: pa.float64(),                   # numeric
+    25: pa.string(),                      # text
+    1042: pa.string(),                    # char
+    1043: pa.string(),                    # varchar
+    1082: pa.date32(),                    # date
+    1114: pa.timestamp('us'),             # timestamp
+    1184: pa.timestamp('us', tz='UTC')    # timestamptz
+}
+
+# Report name -> analytics query function
+REPORTS = {
+    'daily_sales_by_store': analytics_queries.get_daily_sales_by_store,
+    'product_performance': analytics_queries.get_product_performance,
+    'customer_segment_analysis': analytics_queries.get_customer_segment_analysis,
+    'inventory_analysis': analytics_queries.get_inventory_analysis,
+    'sales_trends': analytics_queries.get_sales_trends,
+    'top_performing_stores': analytics_queries.get_top_performing_stores,
+    'customer_purchase_patterns': analytics_queries.get_customer_purchase_patterns,
+    'rfm_segments': analytics_queries.get_rfm_segments,
+    'cohort_retention': analytics_queries.get_cohort_retention,
+    'basket_affinity': analytics_queries.get_basket_affinity,
+    'rolling_store_sales': analytics_queries.get_rolling_store_sales,
+    'low_stock_alerts': analytics_queries.get_low_stock_alerts
+}
+
+# Report name -> builder of the report's SQL query and parameters, which
+# takes the arguments of the report function (streamed by export_report)
+REPORT_QUERIES = {
+    'daily_sales_by_store': analytics_queries.daily_sales_by_store_query,
+    'product_performance': analytics_queries.product_performance_query,
+    'customer_segment_analysis': analytics_queries.customer_segment_analysis_query,
+    'inventory_analysis': analytics_queries.inventory_analysis_query,
+    'sales_trends': analytics_queries.sales_trends_query,
+    'top_performing_stores': analytics_queries.top_performing_stores_query,
+    'customer_purchase_patterns': analytics_queries.customer_purchase_patterns_query,
+    'rfm_segments': analytics_queries.rfm_segments_query,
+    'cohort_retention': analytics_queries.cohort_retention_query,
+    'basket_affinity': analytics_queries.basket_affinity_query,
+    'rolling_store_sales': analytics_queries.rolling_store_sales_query,
+    'low_stock_alerts': analytics_queries.low_stock_alerts_query
+}
+
+# Reports whose function takes approximate=True
+APPROXIMATE_REPORTS = ['customer_segment_analysis', 'top_performing_stores']
+
+def export_format(path: str, fmt: Optional[str] = None) -> str:
+    """
+    Determine the export format of a file.
+
+    Args:
+        path: Output file
+        fmt: Explicit format (one of the FORMATS values)
+
+    Returns:
+        Export format
+    """
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in FORMATS.values():
+        raise ValueError(f"Unknown export format for {path}: use one of "
+                         f"{', '.join(sorted(set(FORMATS.values())))}")
+    return fmt
+
+def column_array(values: Sequence[Any], data_type: Optional[pa.DataType]) -> pa.Array:
+    """
+    Convert the values of one column to an Arrow array.
+
+    Args:
+        values: Column values as returned by psycopg2
+        data_type: Arrow type of the column (None: inferred, with decimals
+            converted to doubles)
+
+    Returns:
+        Arrow array
+    """
+    if data_type is not None and not pa.types.is_floating(data_type):
+        return pa.array(values, type=data_type)
+    # Decimals are inferred as decimal128 and converted to doubles in bulk,
+    # through their text form so that e.g. 316.40 becomes exactly float('316.40')
+    array = pa.array(values)
+    if pa.types.is_decimal(array.type):
+        array = array.cast(pa.string())
+        data_type = data_type or pa.float64()
+    if data_type is not None and array.type != data_type:
+        array = array.cast(data_type)
+    return array
+
+def record_batches(row_batches: Iterable[Sequence[tuple]], columns: List[str],
+                   types: Optional[List[Optional[pa.DataType]]] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Convert batches of rows to Arrow record batches.
+
+    Types inferred from the first batch are kept for the following ones, so
+    every batch has the same schema.
+
+    Args:
+        row_batches: Batches of row tuples
+        columns: Column names
+        types: Arrow type per column (None entries are inferred)
+
+    Yields:
+        One record batch per batch of rows
+    """
+    types = list(types) if types is not None else [None] * len(columns)
+    for rows in row_batches:
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+        batch = pa.RecordBatch.from_arrays(
+            [column_array(column, data_type) for column, data_type in zip(values, types)],
+            names=columns)
+        types = [None if pa.types.is_null(field.type) else field.type for field in batch.schema]
+        yield batch
+
+def query_batches(query: str, params: Optional[Dict[str, Any]] = None,
+                  batch_rows: Optional[int] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Run a query on a read connection and stream its result as record batches.
+
+    Args:
+        query: SQL query
+        params: Query parameters (optional)
+        batch_rows: Rows per batch (defaults to EXPORT_CONFIG['batch_rows'])
+
+    Yields:
+        Record batches of at most batch_rows rows
+    """
+    batch_rows = batch_rows or EXPORT_CONFIG['batch_rows']
+    conn = get_read_connection()
+    try:
+        with conn.cursor(name='export_rows') as cur:
+            cur.itersize = batch_rows
+            cur.execute(query, params)
+            # A named cursor describes its result after the first fetch
+            first = cur.fetchmany(batch_rows)
+            columns = [desc[0] for desc in cur.description]
+            types = [PG_ARROW_TYPES.get(desc[1]) for desc in cur.description]
+            rest = iter(lambda: cur.fetchmany(batch_rows), [])
+            yield from record_batches(chain([first], rest), columns, types)
+    finally:
+        conn.close()
+
+def row_batches(rows: List[Dict[str, Any]], batch_rows: Optional[int] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Convert query results (a list of dictionaries) to record batches.
+
+    Args:
+        rows: Rows as returned by the analytics queries
+        batch_rows: Rows per batch (defaults to EXPORT_CONFIG['batch_rows'])
+
+    Yields:
+        Record batches of at most batch_rows rows
+    """
+    batch_rows = batch_rows or EXPORT_CONFIG['batch_rows']
+    columns = list(rows[0]) if rows else []
+    # Rows are converted to tuples one batch at a time
+    batches = ([tuple(row.values()) for row in rows[start:start + batch_rows]]
+               for start in range(0, len(rows), batch_rows))
+    yield from record_batches(batches if rows else [[]], columns)
+
+def _json_default(obj):
+    """Serialize dates for the json module fallback."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _dump_rows(rows: List[Dict[str, Any]], indent: bool = False) -> bytes:
+    """Serialize a list of rows as a JSON array."""
+    if orjson is not None:
+        return orjson.dumps(rows, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(rows, default=_json_default, indent=2 if indent else None).encode()
+
+def _dump_row(row: Dict[str, Any]) -> bytes:
+    """Serialize one row as a JSON object."""
+    if orjson is not None:
+        return orjson.dumps(row)
+    return json.dumps(row, default=_json_default).encode()
+
+def write_batches(batches: Iterable[pa.RecordBatch], out: BinaryIO, fmt: str) -> int:
+    """
+    Write record batches to a binary file object.
+
+    Args:
+        batches: Record batches with the same schema
+        out: Binary file object
+        fmt: Export format
+
+    Returns:
+        Number of rows written
+    """
+    rows = 0
+    writer = None
+    first = True
+    if fmt == 'json':
+        out.write(b'[')
+    for batch in batches:
+        rows += batch.num_rows
+        if fmt == 'parquet':
+            writer = writer or pq.ParquetWriter(out, batch.schema)
+            writer.write_batch(batch)
+        elif fmt == 'csv':
+            writer = writer or pacsv.CSVWriter(out, batch.schema)
+            writer.write_batch(batch)
+        elif batch.num_rows:
+            records = batch.to_pylist()
+            if fmt == 'json':
+                # Serialize the batch as one array and splice it into the output array
+                out.write((b'' if first else b',') + _dump_rows(records)[1:-1])
+            else:
+                out.write(b'\n'.join(_dump_row(record) for record in records) + b'\n')
+            first = False
+    if fmt == 'json':
+        out.write(b']\n')
+    if writer is not None:
+        writer.close()
+    return rows
+
+def _write(batches: Iterable[pa.RecordBatch], path: str, fmt: Optional[str]) -> int:
+    """Write record batches to a file ('-' for standard output)."""
+    fmt = export_format(path, fmt) if path != '-' else (fmt or 'ndjson')
+    if path == '-':
+        rows = write_batches(batches, sys.stdout.buffer, fmt)
+        sys.stdout.buffer.flush()
+        return rows
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as out:
+        rows = write_batches(batches, out, fmt)
+    logger.info(f"Exported {rows} rows to {path}", extra={'rows': rows})
+    return rows
+
+def export_query(query: str, path: str, fmt: Optional[str] = None,
+                 params: Optional[Dict[str, Any]] = None, batch_rows: Optional[int] = None) -> int:
+    """
+    Stream the result of a query to a file.
+
+    Args:
+        query: SQL query
+        path: Output file ('-' for standard output); the extension selects
+            the format unless fmt is given
+        fmt: Export format ('json', 'ndjson', 'csv' or 'parquet')
+        params: Query parameters (optional)
+        batch_rows: Rows fetched and written per batch
+
+    Returns:
+        Number of rows exported
+    """
+    return _write(query_batches(query, params, batch_rows), path, fmt)
+
+def export_report(report: str, path: str, fmt: Optional[str] = None,
+                  shards: Optional[Sequence[str]] = None, batch_rows: Optional[int] = None,
+                  **kwargs) -> int:
+    """
+    Run an analytics report and write its rows to a file.
+
+    The report's query is streamed like export_query, except in approximate
+    mode and on shards, where the report function returns the rows.
+
+    Args:
+        report: Report name (a key of REPORTS)
+        path: Output file ('-' for standard output)
+        fmt: Export format
+        shards: Run the report on these shards and merge the results (see
+            queries/sharded.py)
+        batch_rows: Rows fetched and written per batch
+        **kwargs: Arguments of the report function (e.g. approximate=True)
+
+    Returns:
+        Number of rows exported
+    """
+    if report not in REPORTS:
+        raise ValueError(f"Unknown report {report}: use one of {', '.join(REPORTS)}")
+    if shards:
+        # Imported here: the shard helpers load the ETL modules
+        from queries.sharded import run_report
+        return _write(row_batches(run_report(report, shards), batch_rows), path, fmt)
+    if kwargs.pop('approximate', False):
+        return _write(row_batches(REPORTS[report](approximate=True, **kwargs), batch_rows),
+                      path, fmt)
+    query, params = REPORT_QUERIES[report](**kwargs)
+    return export_query(query, path, fmt, params, batch_rows)
+
+def dumps(rows: List[Dict[str, Any]], indent: bool = True) -> str:
+    """
+    Serialize query results as a JSON array.
+
+    Args:
+        rows: Rows as returned by the analytics queries
+        indent: Indent the output by two spaces
+
+    Returns:
+        JSON text
+    """
+    records = [record for batch in row_batches(rows) for record in batch.to_pylist()]
+    return _dump_rows(records, indent).decode()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Export a report or a query from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('report', nargs='?', choices=list(REPORTS), help='report to export')
+    parser.add_argument('output', help="output file ('-' for standard output)")
+    parser.add_argument('--query', help='SQL query to export instead of a report')
+    parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                        help='export format (defaults to the output file extension)')
+    parser.add_argument('--batch-rows', type=int, help='rows fetched and written per batch')
+    args = parser.parse_args(argv)
+    if bool(args.report) == bool(args.query):
+        parser.error('give either a report or --query')
+    if args.query:
+        export_query(args.query, args.output, args.format, batch_rows=args.batch_rows)
+    else:
+        export_report(args.report, args.output, args.format, batch_rows=args.batch_rows)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
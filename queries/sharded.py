@@ -0,0 +1,244 @@
+"""
+Fan-out/merge analytics queries over the shards of the fact data.
+
+A report runs on every shard at once (one thread and connection per shard,
+see utils/shards.py) and the per-shard rows are merged into the rows the
+report gives on an unsharded warehouse: sums and counts are added, averages
+are recomputed from the merged sums and counts, and the rows are sorted as
+the report sorts them.
+
+Distinct customer counts cannot be added in general. A group found in one
+shard only keeps its exact count, which is always the case for per-store
+figures when the shards are partitioned on the store; otherwise the count
+is estimated from the union of the shards' distinct customer sketches, or,
+without a sketch, added up (exact when the shards are partitioned on the
+customer, an upper bound otherwise).
+
+Usage:
+    WAREHOUSE_SHARDS=east,west python -m queries.sharded sales_trends
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from queries import analytics_queries
+from utils.db_utils import get_read_connection
+from utils.logging_utils import setup_logger
+from utils.shards import shard_names, shard_scope
+from utils.sketches import load_sketches
+
+logger = setup_logger(__name__)
+
+# Report -> analytics query, group columns, merge rule per measure and
+# sort order ((column, descending) pairs). Rules: 'sum', ('ratio',
+# numerator, denominator), ('mean', weight column or None for an unweighted
+# mean of the shard averages) and ('distinct', sketch name or None).
+SHARDED_REPORTS = {
+    'daily_sales_by_store': {
+        'query': analytics_queries.get_daily_sales_by_store,
+        'keys': ('store_name', 'full_date'),
+        'measures': {
+            'total_sales': 'sum',
+            'number_of_transactions': 'sum',
+            'average_transaction_value': ('ratio', 'total_sales', 'number_of_transactions')
+        },
+        'order': (('full_date', False), ('total_sales', True))
+    },
+    'product_performance': {
+        'query': analytics_queries.get_product_performance,
+        'keys': ('product_name', 'category', 'brand'),
+        'measures': {
+            'total_sales': 'sum',
+            'total_quantity_sold': 'sum',
+            'total_revenue': 'sum',
+            'average_price': ('mean', 'total_sales')
+        },
+        'order': (('total_revenue', True),)
+    },
+    'customer_segment_analysis': {
+        'query': analytics_queries.get_customer_segment_analysis,
+        'keys': ('customer_segment',),
+        'measures': {
+            'number_of_customers': ('distinct', 'customers_by_segment'),
+            'total_revenue': 'sum',
+            'average_revenue_per_customer': ('ratio', 'total_revenue', 'total_transactions'),
+            'total_transactions': 'sum'
+        },
+        'order': (('total_revenue', True),)
+    },
+    'inventory_analysis': {
+        'query': analytics_queries.get_inventory_analysis,
+        'keys': ('store_name', 'category'),
+        'measures': {
+            'current_stock': 'sum',
+            'total_sold': 'sum',
+            'total_damaged': 'sum',
+            'average_reorder_point': ('mean', None)
+        },
+        'order': (('store_name', False), ('category', False))
+    },
+    'sales_trends': {
+        'query': analytics_queries.get_sales_trends,
+        'keys': ('year', 'month', 'category'),
+        'measures': {
+            'total_sales': 'sum',
+            'number_of_transactions': 'sum',
+            'average_transaction_value': ('ratio', 'total_sales', 'number_of_transactions')
+        },
+        'order': (('year', False), ('month', False), ('total_sales', True))
+    },
+    'top_performing_stores': {
+        'query': analytics_queries.get_top_performing_stores,
+        'keys': ('store_name', 'store_type', 'city', 'state'),
+        'measures': {
+            'total_transactions': 'sum',
+            'total_revenue': 'sum',
+            'average_transaction_value': ('ratio', 'total_revenue', 'total_transactions'),
+            'unique_customers': ('distinct', None)
+        },
+        'order': (('total_revenue', True),)
+    },
+    'customer_purchase_patterns': {
+        'query': analytics_queries.get_customer_purchase_patterns,
+        'keys': ('day_of_week', 'hour_of_day'),
+        'measures': {
+            'number_of_transactions': 'sum',
+            'total_sales': 'sum',
+            'average_transaction_value': ('ratio', 'total_sales', 'number_of_transactions')
+        },
+        'order': (('day_of_week', False), ('hour_of_day', False))
+    }
+}
+
+def _run_in_shard(shard: str, function: Callable[[], Any]) -> Any:
+    """Call a function with SCHEMA_CONFIG pointed at a shard."""
+    with shard_scope(shard):
+        return function()
+
+def fan_out(function: Callable[[], Any], shards: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Call a query function on every shard concurrently.
+
+    Args:
+        function: Function that builds and runs queries from SCHEMA_CONFIG
+        shards: Shard names (defaults to SHARDS)
+
+    Returns:
+        Result of the function per shard
+    """
+    shards = shard_names(shards)
+    if not shards:
+        raise ValueError("No shards configured: set WAREHOUSE_SHARDS or pass shards")
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        futures = {shard: pool.submit(_run_in_shard, shard, function) for shard in shards}
+        return {shard: future.result() for shard, future in futures.items()}
+
+def _shard_sketches(shards: Sequence[str], sketch_name: str) -> Dict[str, Any]:
+    """Merge the sketches of one grouping across shards, per member."""
+    def load():
+        conn = get_read_connection()
+        try:
+            return load_sketches(conn, sketch_name)
+        finally:
+            conn.close()
+    merged: Dict[str, Any] = {}
+    for sketches in fan_out(load, shards).values():
+        for member, sketch in sketches.items():
+            if member in merged:
+                merged[member].merge(sketch)
+            else:
+                merged[member] = sketch
+    return merged
+
+def _add(values: List[Any]) -> Any:
+    """Add the non-null values of a measure."""
+    values = [value for value in values if value is not None]
+    return sum(values[1:], values[0]) if values else None
+
+def _divide(numerator: Any, denominator: Any) -> Any:
+    """Divide two merged measures, as Decimal when the numerator is one."""
+    if numerator is None or not denominator:
+        return None
+    if isinstance(numerator, Decimal):
+        return numerator / Decimal(denominator)
+    return numerator / denominator
+
+def merge_rows(shard_rows: Dict[str, List[Dict[str, Any]]], keys: Sequence[str],
+               measures: Dict[str, Any], order: Sequence = ()) -> List[Dict[str, Any]]:
+    """
+    Merge the rows of a report from every shard.
+
+    Args:
+        shard_rows: Rows per shard
+        keys: Group columns identifying a row
+        measures: Merge rule per measure column (see SHARDED_REPORTS)
+        order: (column, descending) pairs to sort the merged rows by
+
+    Returns:
+        Merged rows, with the columns in the order of the shard rows
+    """
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for rows in shard_rows.values():
+        for row in rows:
+            groups.setdefault(tuple(row[key] for key in keys), []).append(row)
+
+    sketches: Dict[str, Dict[str, Any]] = {}
+    merged = []
+    for group, rows in groups.items():
+        row = dict(rows[0])
+        # Additive measures first: ratios are computed from the merged sums
+        for column, rule in measures.items():
+            if rule == 'sum':
+                row[column] = _add([r[column] for r in rows])
+        for column, rule in measures.items():
+            if rule == 'sum' or len(rows) == 1:
+                continue
+            kind = rule[0]
+            if kind == 'ratio':
+                row[column] = _divide(row[rule[1]], row[rule[2]])
+            elif kind == 'mean' and rule[1] is not None:
+                weights = [r[rule[1]] for r in rows]
+                row[column] = _divide(_add([r[column] * w for r, w in zip(rows, weights)]),
+                                      _add(weights))
+            elif kind == 'mean':
+                row[column] = _divide(_add([r[column] for r in rows]), len(rows))
+            elif kind == 'distinct' and rule[1] is not None:
+                if rule[1] not in sketches:
+                    sketches[rule[1]] = _shard_sketches(list(shard_rows), rule[1])
+                sketch = sketches[rule[1]].get(str(group[0]))
+                row[column] = round(sketch.estimate()) if sketch else _add([r[column] for r in rows])
+            elif kind == 'distinct':
+                logger.warning(f"{column} of {group} spans shards: adding up the shard counts")
+                row[column] = _add([r[column] for r in rows])
+            else:
+                raise ValueError(f"Unknown merge rule for {column}: {rule!r}")
+        merged.append(row)
+
+    # Sort by the last column first so the earlier columns take precedence
+    for column, descending in reversed(order):
+        merged.sort(key=lambda row: (row[column] is None, row[column]), reverse=descending)
+    return merged
+
+def run_report(report: str, shards: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Run an analytics report on every shard and merge the results.
+
+    Args:
+        report: Report name (a key of SHARDED_REPORTS)
+        shards: Shard names (defaults to SHARDS)
+
+    Returns:
+        Rows of the report over all shards
+    """
+    if report not in SHARDED_REPORTS:
+        raise ValueError(f"Report {report} cannot be merged across shards: use one of "
+                         f"{', '.join(SHARDED_REPORTS)}")
+    spec = SHARDED_REPORTS[report]
+    shard_rows = fan_out(spec['query'], shards)
+    return merge_rows(shard_rows, spec['keys'], spec['measures'], spec['order'])
+
+if __name__ == '__main__':
+    from queries.export import dumps
+    if len(sys.argv) != 2 or sys.argv[1] not in SHARDED_REPORTS:
+        sys.exit(f"usage: python -m queries.sharded {{{','.join(SHARDED_REPORTS)}}}")
+    print(dumps(run_report(sys.argv[1])))
@@ -1,9 +1,8 @@
 """
 Script to run the ETL process for the sales data warehouse.
 """
-from utils.etl_utils import run_etl
+import sys
+from warehouse import main
 
 if __name__ == '__main__':
-    print("Starting ETL process for Sales Data Warehouse...")
-    run_etl()
-    print("ETL process completed successfully!") 
\ No newline at end of file
+    sys.exit(main(['etl'] + sys.argv[1:]))
@@ -1,9 +1,8 @@
 """
 Script to set up the sales data warehouse database.
 """
-from utils.db_setup import setup_database
+import sys
+from warehouse import main
 
 if __name__ == '__main__':
-    print("Starting database setup for Sales Data Warehouse...")
-    setup_database()
-    print("Database setup completed successfully!") 
\ No newline at end of file
+    sys.exit(main(['setup'] + sys.argv[1:]))
@@ -5,22 +5,69 @@ import os
 import pytest
 from pathlib import Path
 from dotenv import load_dotenv
+from config import DB_CONFIG
+from utils.data_generator import generate_all_data
+from utils.db_setup import setup_database
+from utils.ephemeral_postgres import EphemeralPostgres
+from utils.etl_utils import run_etl
+from utils.key_cache import clear_key_caches
 
 # Load test environment variables
 load_dotenv('.env.test')
 
+def pytest_addoption(parser):
+    """Add the scale factor option for database-backed tests."""
+    parser.addoption('--warehouse-scale', type=float,
+                     default=float(os.getenv('TEST_WAREHOUSE_SCALE', '0.01')),
+                     help='scale factor of the data loaded into the test warehouse')
+
 @pytest.fixture(scope='session')
 def test_data_dir():
     """Return the path to the test data directory."""
     return Path(__file__).parent / 'data'
 
 @pytest.fixture(scope='session')
-def test_db_config():
-    """Return test database configuration."""
-    return {
-        'dbname': os.getenv('TEST_DB_NAME', 'test_titanic_db'),
-        'user': os.getenv('TEST_DB_USER', 'postgres'),
-        'password': os.getenv('TEST_DB_PASSWORD', 'postgres'),
-        'host': os.getenv('TEST_DB_HOST', 'localhost'),
-        'port': os.getenv('TEST_DB_PORT', '5432')
-    } 
\ No newline at end of file
+def postgres_server():
+    """Start a disposable PostgreSQL server for the test session."""
+    server = EphemeralPostgres()
+    try:
+        server.start()
+    except RuntimeError as e:
+        pytest.skip(f"Ephemeral PostgreSQL unavailable: {e}")
+    yield server
+    server.stop()
+
+@pytest.fixture(scope='session')
+def test_db_config(postgres_server):
+    """
+    Return test database configuration.
+
+    The shared DB_CONFIG is pointed at the disposable server for the session,
+    so every module that connects through it uses the test database.
+    """
+    original = dict(DB_CONFIG)
+    DB_CONFIG.update(postgres_server.config)
+    DB_CONFIG['dbname'] = os.getenv('TEST_DB_NAME', 'sales_warehouse_test')
+    yield dict(DB_CONFIG)
+    DB_CONFIG.clear()
+    DB_CONFIG.update(original)
+
+@pytest.fixture(scope='session')
+def warehouse_db(test_db_config):
+    """Create the warehouse schemas and tables in the test database."""
+    setup_database()
+    clear_key_caches()
+    return test_db_config
+
+@pytest.fixture(scope='session')
+def raw_data_dir(request, tmp_path_factory):
+    """Generate source data at the chosen scale factor."""
+    raw_dir = str(tmp_path_factory.mktemp('raw'))
+    generate_all_data(scale=request.config.getoption('--warehouse-scale'), output_dir=raw_dir)
+    return raw_dir
+
+@pytest.fixture(scope='session')
+def loaded_warehouse(warehouse_db, raw_data_dir):
+    """Run the ETL of the generated data into the test database."""
+    run_etl(raw_data_dir)
+    return warehouse_db
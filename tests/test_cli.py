@@ -0,0 +1,55 @@
+"""
+Tests for the warehouse command line interface.
+"""
+import os
+import subprocess
+import sys
+import pyarrow.parquet as pq
+import pytest
+import warehouse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be loaded just to parse the command line
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'psycopg2']
+
+def test_help_does_not_import_heavy_modules():
+    """Test that --help starts without pandas, numpy, pyarrow or psycopg2."""
+    script = (
+        "import contextlib, io, sys, warehouse\n"
+        "for argv in (['--help'], ['etl', '--help'], ['report', '--help']):\n"
+        "    with contextlib.redirect_stdout(io.StringIO()):\n"
+        "        try:\n"
+        "            warehouse.main(argv)\n"
+        "        except SystemExit:\n"
+        "            pass\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True,
+                            text=True, check=True)
+    assert result.stdout.strip() == ''
+
+def test_report_command(loaded_warehouse, tmp_path):
+    """Test that the report command exports a report."""
+    path = tmp_path / 'stores.parquet'
+    assert warehouse.main(['report', 'top_performing_stores', '--output', str(path)]) == 0
+    assert pq.read_table(path).num_rows > 0
+
+def test_report_command_approximate(loaded_warehouse, tmp_path):
+    """Test that --approximate runs the reports with an approximate mode and rejects others."""
+    path = tmp_path / 'segments.csv'
+    assert warehouse.main(['report', 'customer_segment_analysis', '--approximate',
+                           '--output', str(path)]) == 0
+    assert path.read_text().count('\n') > 1
+    with pytest.raises(SystemExit, match='--approximate is only supported by '
+                                         'customer_segment_analysis, top_performing_stores'):
+        warehouse.main(['report', 'product_performance', '--approximate',
+                        '--output', str(tmp_path / 'products.csv')])
+    assert not (tmp_path / 'products.csv').exists()
+
+def test_report_command_rejects_unshardable_reports(tmp_path):
+    """Test that reports without a shard merge rule are rejected when shards are given."""
+    with pytest.raises(SystemExit, match='rfm_segments cannot be merged across shards'):
+        warehouse.main(['report', 'rfm_segments', '--shards', 'east,west',
+                        '--output', str(tmp_path / 'rfm.csv')])
+    assert not (tmp_path / 'rfm.csv').exists()
@@ -0,0 +1,158 @@
+"""
+Tests for queries/columnar_queries.py
+"""
+import os
+from datetime import date
+import pandas as pd
+import pytest
+from queries import columnar_queries
+
+@pytest.fixture
+def parquet_dir(tmp_path):
+    """Write a tiny warehouse extract as Parquet files."""
+    frames = {
+        'stores': pd.DataFrame({
+            'store_id': ['S001', 'S002'],
+            'store_name': ['Store 1', 'Store 2'],
+            'store_type': ['Mall', 'Outlet'],
+            'city': ['City1', 'City2'],
+            'state': ['State1', 'State2']
+        }),
+        'products': pd.DataFrame({
+            'product_id': ['P0001', 'P0002'],
+            'product_name': ['Product 1', 'Product 2'],
+            'category': ['Toys', 'Books'],
+            'brand': ['Brand 1', 'Brand 2']
+        }),
+        'customers': pd.DataFrame({
+            'customer_id': ['C0001', 'C0002', 'C0003'],
+            'customer_segment': ['Regular', 'VIP', 'Regular']
+        }),
+        'time': pd.DataFrame({
+            'date_id': [20230101, 20230102],
+            'full_date': ['2023-01-01', '2023-01-02'],
+            'day_of_week': ['Sunday', 'Monday'],
+            'year': [2023, 2023],
+            'month': [1, 1]
+        }),
+        'sales': pd.DataFrame({
+            'sale_id': ['T000001', 'T000002', 'T000003', 'T000004'],
+            'date_id': [20230101, 20230101, 20230102, 20230102],
+            'product_id': ['P0001', 'P0002', 'P0001', 'P0001'],
+            'customer_id': ['C0001', 'C0002', 'C0001', 'C0003'],
+            'store_id': ['S001', 'S001', 'S002', 'S001'],
+            'quantity': [1, 2, 3, 1],
+            'unit_price': [10.0, 5.0, 10.0, 10.0],
+            'net_amount': [9.0, 10.0, 27.0, 10.0],
+            'transaction_time': ['2023-01-01 09:15:00', '2023-01-01 17:40:00',
+                                 '2023-01-02 09:05:00', '2023-01-02 12:00:00']
+        }),
+        'inventory': pd.DataFrame({
+            'inventory_id': ['I000001', 'I000002', 'I000003', 'I000004'],
+            'date_id': [20230101, 20230101, 20230101, 20221225],
+            'store_id': ['S001', 'S001', 'S002', 'S001'],
+            'product_id': ['P0001', 'P0002', 'P0001', 'P0001'],
+            'ending_quantity': [5, 7, 9, 1],
+            'units_sold': [1, 2, 3, 4],
+            'units_damaged': [0, 1, 0, 0],
+            'reorder_point': [10, 20, 30, 10],
+            'reorder_quantity': [50, 60, 70, 50]
+        })
+    }
+    for name, frame in frames.items():
+        frame.to_parquet(tmp_path / columnar_queries.PARQUET_FILES[name], index=False)
+    return str(tmp_path)
+
+def test_daily_sales_by_store(parquet_dir):
+    """Test daily store totals and ordering."""
+    rows = columnar_queries.get_daily_sales_by_store(parquet_dir)
+    assert [(r['store_name'], r['full_date'].isoformat(), r['total_sales']) for r in rows] == [
+        ('Store 1', '2023-01-01', 19.0),
+        ('Store 2', '2023-01-02', 27.0),
+        ('Store 1', '2023-01-02', 10.0)
+    ]
+    assert rows[0]['number_of_transactions'] == 2
+    assert rows[0]['average_transaction_value'] == 9.5
+
+def test_customer_segment_analysis(parquet_dir):
+    """Test distinct customer counts per segment."""
+    rows = columnar_queries.get_customer_segment_analysis(parquet_dir)
+    assert rows[0] == {
+        'customer_segment': 'Regular',
+        'number_of_customers': 2,
+        'total_revenue': 46.0,
+        'average_revenue_per_customer': 46.0 / 3,
+        'total_transactions': 3
+    }
+
+def test_top_performing_stores(parquet_dir):
+    """Test store ranking and unique customers."""
+    rows = columnar_queries.get_top_performing_stores(parquet_dir)
+    assert [r['store_name'] for r in rows] == ['Store 1', 'Store 2']
+    assert rows[0]['unique_customers'] == 3
+    assert rows[0]['total_transactions'] == 3
+
+def test_customer_purchase_patterns(parquet_dir):
+    """Test hour-of-day extraction and day-of-week ordering."""
+    rows = columnar_queries.get_customer_purchase_patterns(parquet_dir)
+    assert [(r['day_of_week'], r['hour_of_day']) for r in rows] == [
+        ('Monday', 9), ('Monday', 12), ('Sunday', 9), ('Sunday', 17)
+    ]
+
+def test_inventory_and_product_reports(parquet_dir):
+    """Test the remaining reports run over the extract."""
+    inventory = columnar_queries.get_inventory_analysis(parquet_dir)
+    assert [(r['store_name'], r['category'], r['current_stock']) for r in inventory] == [
+        ('Store 1', 'Books', 7), ('Store 1', 'Toys', 5), ('Store 2', 'Toys', 9)
+    ]
+    assert inventory[1]['total_sold'] == 5
+    products = columnar_queries.get_product_performance(parquet_dir)
+    assert products[0]['product_name'] == 'Product 1'
+    assert products[0]['total_quantity_sold'] == 5
+    trends = columnar_queries.get_sales_trends(parquet_dir)
+    assert {r['category']: r['total_sales'] for r in trends} == {'Toys': 46.0, 'Books': 10.0}
+
+def test_low_stock_alerts(parquet_dir):
+    """Test that alerts come from the latest snapshots, largest shortfall first."""
+    rows = columnar_queries.get_low_stock_alerts(parquet_dir)
+    assert [(r['store_id'], r['product_id'], r['shortfall']) for r in rows] == [
+        ('S002', 'P0001', 21), ('S001', 'P0002', 13), ('S001', 'P0001', 5)
+    ]
+    assert rows[0]['snapshot_date'] == date(2023, 1, 1)
+    assert rows[0]['reorder_quantity'] == 70
+    store = columnar_queries.get_low_stock_alerts(parquet_dir, store_id='S001')
+    assert [r['product_id'] for r in store] == ['P0002', 'P0001']
+
+def test_rfm_segments(parquet_dir):
+    """Test NTILE scores with ties broken by customer id, and the segments."""
+    rows = columnar_queries.get_rfm_segments(parquet_dir)
+    assert [(r['customer_id'], r['recency_days'], r['frequency'], r['monetary']) for r in rows] == [
+        ('C0001', 0, 2, 36.0), ('C0002', 1, 1, 10.0), ('C0003', 0, 1, 10.0)
+    ]
+    assert [(r['recency_score'], r['frequency_score'], r['monetary_score'], r['rfm_segment'])
+            for r in rows] == [(2, 3, 3, 'At Risk'), (1, 1, 1, 'Lost'), (3, 2, 2, 'Needs Attention')]
+    assert rows[1]['customer_segment'] == 'VIP'
+
+def test_cohort_retention_and_rolling_sales(parquet_dir):
+    """Test cohorts and rolling store totals reaching back before the start date."""
+    [cohort] = columnar_queries.get_cohort_retention(parquet_dir)
+    assert cohort['cohort_month'].isoformat() == '2023-01-01'
+    assert (cohort['active_customers'], cohort['cohort_size'], cohort['retention_rate']) == (3, 3, 1.0)
+
+    rows = columnar_queries.get_rolling_store_sales(parquet_dir, start_date=date(2023, 1, 2))
+    assert [(r['store_name'], r['daily_sales'], r['sales_7_day'], r['transactions_30_day'])
+            for r in rows] == [('Store 1', 10.0, 29.0, 3), ('Store 2', 27.0, 27.0, 1)]
+
+def test_basket_affinity(parquet_dir):
+    """Test support, confidence and lift of items bought on the same store visit."""
+    sales = pd.read_parquet(os.path.join(parquet_dir, columnar_queries.PARQUET_FILES['sales']))
+    extra = sales.iloc[[1]].assign(sale_id='T000005', customer_id='C0001', net_amount=5.0)
+    pd.concat([sales, extra]).to_parquet(
+        os.path.join(parquet_dir, columnar_queries.PARQUET_FILES['sales']), index=False)
+
+    [pair] = columnar_queries.get_basket_affinity(parquet_dir)
+    assert (pair['item_a'], pair['item_b'], pair['baskets']) == ('Books', 'Toys', 1)
+    assert pair['support'] == 0.25
+    assert pair['confidence_a_to_b'] == 0.5
+    assert pair['lift'] == pytest.approx(4 / 6)
+    assert columnar_queries.get_basket_affinity(parquet_dir, min_baskets=2) == []
@@ -0,0 +1,411 @@
+"""
+Tests for the database setup and ETL against a disposable PostgreSQL server.
+"""
+import math
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import date
+import pandas as pd
+import psycopg2
+import pytest
+from config import ETL_CONFIG, SCHEMA_CONFIG
+from queries import analytics_queries, columnar_queries
+from queries.cube import query_cube
+from utils.cube import build_sales_cube
+from utils.customer_activity import build_customer_activity
+from utils.data_manager import DataManager
+from utils import etl_utils
+from utils.db_utils import execute_query
+from utils.etl_utils import (DIMENSION_FILES, FACT_FILES, load_csv_to_staging, merge_fact_table,
+                             resolve_surrogate_keys, run_etl)
+from utils.shards import setup_shards, shard_scope
+from utils.time_dimension import extend_time_dimension
+
+@contextmanager
+def empty_shard(name):
+    """Load facts into an empty shard of their own, leaving the loaded facts unchanged."""
+    setup_shards([name])
+    with shard_scope(name):
+        yield
+
+def write_sources(raw_data_dir, data_dir, **frames):
+    """Copy the generated source files to data_dir, replacing the ones given as DataFrames."""
+    os.makedirs(data_dir, exist_ok=True)
+    for file_name, _ in DIMENSION_FILES + FACT_FILES:
+        name = file_name[:-len('.csv')]
+        if name in frames:
+            frames[name].to_csv(os.path.join(data_dir, file_name), index=False)
+        else:
+            shutil.copy(os.path.join(raw_data_dir, file_name), data_dir)
+    return str(data_dir)
+
+def read_source(raw_data_dir, name):
+    """Read a generated source file as text."""
+    return pd.read_csv(os.path.join(raw_data_dir, f'{name}.csv'), dtype=str)
+
+def test_create_tables(warehouse_db):
+    """Test table creation."""
+    conn = psycopg2.connect(**warehouse_db)
+    try:
+        with conn.cursor() as cur:
+            # Check if tables exist
+            cur.execute("""
+                SELECT table_schema, table_name
+                FROM information_schema.tables
+                WHERE table_schema IN %s
+            """, ((SCHEMA_CONFIG['dim_schema'], SCHEMA_CONFIG['fact_schema']),))
+            tables = {table for _, table in cur.fetchall()}
+            assert {'dim_product', 'dim_customer', 'dim_time', 'dim_store',
+                    'fact_sales', 'fact_inventory'} <= tables
+    finally:
+        conn.close()
+
+def test_load_data(loaded_warehouse):
+    """Test data loading."""
+    conn = psycopg2.connect(**loaded_warehouse)
+    try:
+        with conn.cursor() as cur:
+            # Check if data was loaded
+            cur.execute(f"SELECT COUNT(*) FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales")
+            count = cur.fetchone()[0]
+            assert count > 0
+    finally:
+        conn.close()
+
+def test_analytics_queries(loaded_warehouse):
+    """Test the analytics queries run against the loaded warehouse."""
+    stores = analytics_queries.get_top_performing_stores()
+    assert stores
+    assert sum(row['total_transactions'] for row in stores) == sum(
+        row['number_of_transactions'] for row in analytics_queries.get_daily_sales_by_store()
+    )
+
+def test_extend_time_dimension(loaded_warehouse):
+    """Test that fact dates outside dim_time are added to it."""
+    conn = psycopg2.connect(**loaded_warehouse)
+    try:
+        added = extend_time_dimension(conn, pd.Series(['20300101', '20300101', 'bad']))
+        assert added == 1
+        assert extend_time_dimension(conn, pd.Series(['20300101'])) == 0
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT day_of_week, holiday_name
+                FROM {SCHEMA_CONFIG['dim_schema']}.dim_time
+                WHERE date_key = 20300101
+            """)
+            assert cur.fetchone() == ('Tuesday', "New Year's Day")
+    finally:
+        conn.close()
+
+def test_approximate_queries(loaded_warehouse):
+    """Test approximate results against the exact ones."""
+    exact = {row['customer_segment']: row
+             for row in analytics_queries.get_customer_segment_analysis()}
+    approximate = analytics_queries.get_customer_segment_analysis(approximate=True,
+                                                                  sample_percent=100)
+    assert {row['customer_segment'] for row in approximate} == set(exact)
+    for row in approximate:
+        expected = exact[row['customer_segment']]
+        # A 100% sample is exact; distinct counts come from the sketches
+        assert round(float(row['total_revenue']), 2) == float(expected['total_revenue'])
+        assert abs(row['number_of_customers'] - expected['number_of_customers']) <= max(
+            2, row['number_of_customers_margin'])
+
+def test_cube_matches_fact_queries(loaded_warehouse):
+    """Test that cube drill-downs agree with the queries over the facts."""
+    trends = analytics_queries.get_sales_trends()
+    cube = {(row['year'], row['month'], row['category']): row
+            for row in query_cube(['year', 'month', 'category'])}
+    assert len(cube) == len(trends)
+    for row in trends:
+        cell = cube[(row['year'], row['month'], row['category'])]
+        assert cell['net_amount'] == row['total_sales']
+        assert cell['transactions'] == row['number_of_transactions']
+
+    segment = analytics_queries.get_customer_segment_analysis()[0]
+    [cell] = query_cube([], filters={'segment': segment['customer_segment']})
+    assert cell['transactions'] == segment['total_transactions']
+
+@pytest.mark.parametrize('build, table', [(build_sales_cube, 'sales_cube'),
+                                          (build_customer_activity, 'customer_activity')])
+def test_rebuild_does_not_block_readers(loaded_warehouse, build, table):
+    """Test that a rebuild runs while a reader holds the table, which keeps the old rows."""
+    reader = psycopg2.connect(**loaded_warehouse)
+    try:
+        with reader.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute(f"SELECT COUNT(*) FROM facts.{table}")
+            before = cur.fetchone()[0]
+            rebuild = threading.Thread(target=build, daemon=True)
+            rebuild.start()
+            rebuild.join(10)
+            assert not rebuild.is_alive()
+            cur.execute(f"SELECT COUNT(*) FROM facts.{table}")
+            assert cur.fetchone()[0] == before
+    finally:
+        reader.close()
+    assert execute_query(f"SELECT COUNT(*) AS n FROM facts.{table}")[0]['n'] == before
+
+def _assert_rows_match(rows, expected, keys):
+    """Assert that query rows equal the columnar ones (amounts are loaded rounded to cents)."""
+    assert len(rows) == len(expected)
+    columnar = {tuple(row[key] for key in keys): row for row in expected}
+    for row in rows:
+        reference = columnar[tuple(row[key] for key in keys)]
+        assert list(row) == list(reference)
+        for column, value in row.items():
+            if isinstance(value, (int, float)) or hasattr(value, 'as_integer_ratio'):
+                assert math.isclose(float(value), float(reference[column]), rel_tol=1e-4,
+                                    abs_tol=0.05), column
+            else:
+                assert value == reference[column], column
+
+def test_customer_analytics_match_columnar(loaded_warehouse, raw_data_dir, tmp_path):
+    """Test the RFM, cohort, basket and rolling sales queries against the columnar versions."""
+    data_manager = DataManager(str(tmp_path))
+    for file_name, _ in DIMENSION_FILES + FACT_FILES:
+        shutil.copy(os.path.join(raw_data_dir, file_name), data_manager.raw_dir)
+        data_manager.convert_to_parquet(file_name)
+    parquet_dir = str(data_manager.processed_dir)
+
+    _assert_rows_match(analytics_queries.get_rfm_segments(),
+                       columnar_queries.get_rfm_segments(parquet_dir), ['customer_id'])
+    _assert_rows_match(analytics_queries.get_cohort_retention(),
+                       columnar_queries.get_cohort_retention(parquet_dir),
+                       ['cohort_month', 'months_since_first_purchase'])
+    _assert_rows_match(analytics_queries.get_rolling_store_sales(),
+                       columnar_queries.get_rolling_store_sales(parquet_dir),
+                       ['store_id', 'full_date'])
+    for level in ('category', 'product'):
+        _assert_rows_match(analytics_queries.get_basket_affinity(level),
+                           columnar_queries.get_basket_affinity(parquet_dir, level),
+                           ['item_a', 'item_b'])
+
+def test_changed_customer_gets_new_version(loaded_warehouse, raw_data_dir, tmp_path):
+    """Test that a changed customer is versioned and later facts reference the new version."""
+    customer = read_source(raw_data_dir, 'customers').iloc[[0]].copy()
+    customer['customer_id'] = 'C990001'
+    customer['modified_date'] = '2023-01-01'
+    sales = read_source(raw_data_dir, 'sales').iloc[:6].copy()
+    sales['sale_id'] = [f'T99000{i}' for i in range(1, 7)]
+    sales['customer_id'] = 'C990001'
+    sales['store_id'] = sales['store_id'].iloc[0]
+
+    with empty_shard('scd2'):
+        run_etl(write_sources(raw_data_dir, tmp_path / 'v1', customers=customer,
+                              sales=sales.iloc[:3]))
+        customer['city'] = 'Moved City'
+        customer['modified_date'] = '2024-06-01'
+        run_etl(write_sources(raw_data_dir, tmp_path / 'v2', customers=customer,
+                              sales=sales.iloc[3:]))
+
+        versions = execute_query(f"""
+        SELECT customer_key, city, valid_from, valid_to, is_current
+        FROM {SCHEMA_CONFIG['dim_schema']}.dim_customer
+        WHERE customer_id = 'C990001'
+        ORDER BY customer_key
+        """)
+        assert len(versions) == 2
+        old, new = versions
+        assert not old['is_current'] and old['valid_to'] == date(2024, 6, 1)
+        assert new['is_current'] and new['valid_to'] is None
+        assert new['valid_from'] == date(2024, 6, 1) and new['city'] == 'Moved City'
+
+        facts = execute_query(f"""
+        SELECT sale_id, customer_key FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales
+        ORDER BY sale_id
+        """)
+        assert [row['customer_key'] for row in facts] == (
+            [old['customer_key']] * 3 + [new['customer_key']] * 3)
+
+        # Both versions are one customer
+        [store] = analytics_queries.get_top_performing_stores()
+        assert store['total_transactions'] == 6
+        assert store['unique_customers'] == 1
+
+def test_facts_reference_surrogate_keys(loaded_warehouse, raw_data_dir, tmp_path, monkeypatch):
+    """Test the surrogate keys of fact rows and the handling of unknown natural keys."""
+    types = execute_query("""
+    SELECT column_name, data_type FROM information_schema.columns
+    WHERE table_schema = %s AND table_name = 'fact_sales'
+        AND column_name IN ('date_key', 'product_key', 'customer_key', 'store_key')
+    """, (SCHEMA_CONFIG['fact_schema'],))
+    assert {row['column_name']: row['data_type'] for row in types} == dict.fromkeys(
+        ['date_key', 'product_key', 'customer_key', 'store_key'], 'integer')
+
+    keys = ['sale_id', 'date_id', 'product_id', 'customer_id', 'store_id']
+    loaded = pd.DataFrame(execute_query(f"""
+    SELECT fs.sale_id, t.date_id, p.product_id, c.customer_id, s.store_id
+    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_time t ON fs.date_key = t.date_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_key = p.product_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fs.store_key = s.store_key
+    ORDER BY fs.sale_id
+    """), columns=keys)
+    source = read_source(raw_data_dir, 'sales')[keys].sort_values('sale_id', ignore_index=True)
+    assert loaded.equals(source)
+
+    # Rows with unknown natural keys are rejected by validation, or fail the load without it
+    sales = read_source(raw_data_dir, 'sales').iloc[:5].copy()
+    sales.loc[1, 'product_id'] = 'P999999'
+    monkeypatch.setitem(ETL_CONFIG, 'rejects_dir', str(tmp_path / 'rejects'))
+    with empty_shard('keys'):
+        run_etl(write_sources(raw_data_dir, tmp_path / 'data', sales=sales), dimensions=False)
+        loaded = execute_query(f"SELECT sale_id FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales")
+    assert sorted(row['sale_id'] for row in loaded) == sorted(sales['sale_id'].drop(1))
+    [rejects_file] = (tmp_path / 'rejects').glob('sales.*.rejects.csv')
+    rejects = pd.read_csv(rejects_file, dtype=str)
+    assert list(rejects['sale_id']) == [sales.loc[1, 'sale_id']]
+    assert list(rejects['reject_reason']) == ['unknown product_id']
+
+    conn = psycopg2.connect(**loaded_warehouse)
+    try:
+        with pytest.raises(ValueError, match='P999999'):
+            resolve_surrogate_keys(sales, 'stg_sales', conn)
+    finally:
+        conn.close()
+
+def test_reloading_sources_adds_no_rows(loaded_warehouse, raw_data_dir, tmp_path):
+    """Test that a file loaded twice, or a member listed twice, is loaded once."""
+    customers = read_source(raw_data_dir, 'customers')
+    duplicate = customers.iloc[[0, 0]].copy()
+    duplicate['customer_id'] = 'C990002'
+    duplicate['city'] = ['Latest City', 'First City']
+    duplicate['modified_date'] = ['2023-02-01', '2023-01-01']
+    data_dir = write_sources(raw_data_dir, tmp_path / 'data',
+                             customers=pd.concat([customers, duplicate]))
+
+    def row_counts():
+        return {table: execute_query(f"SELECT COUNT(*) AS n FROM {table}")[0]['n'] for table in (
+            f"{SCHEMA_CONFIG['dim_schema']}.dim_customer",
+            f"{SCHEMA_CONFIG['fact_schema']}.fact_sales",
+            f"{SCHEMA_CONFIG['fact_schema']}.fact_inventory")}
+
+    with empty_shard('reload'):
+        run_etl(data_dir)
+        loaded = row_counts()
+        run_etl(data_dir, force=True)
+        assert row_counts() == loaded
+        assert loaded[f"{SCHEMA_CONFIG['fact_schema']}.fact_sales"] == len(
+            read_source(raw_data_dir, 'sales'))
+
+    versions = execute_query(f"""
+    SELECT city, is_current FROM {SCHEMA_CONFIG['dim_schema']}.dim_customer
+    WHERE customer_id = 'C990002'
+    """)
+    assert versions == [{'city': 'Latest City', 'is_current': True}]
+
+def test_failed_run_resumes_after_last_checkpoint(loaded_warehouse, raw_data_dir, tmp_path,
+                                                  monkeypatch):
+    """Test that a resumed run skips completed stages and continues a file after its last chunk."""
+    sales_rows = len(read_source(raw_data_dir, 'sales'))
+    chunk_size = sales_rows // 4 + 1
+    monkeypatch.setitem(ETL_CONFIG, 'chunk_size', chunk_size)
+    data_dir = write_sources(raw_data_dir, tmp_path / 'data')
+
+    staged, copied = [], []
+    interrupt = {'after_chunks': 2}
+    load_csv_to_staging = etl_utils.load_csv_to_staging
+    copy_to_staging = etl_utils._copy_to_staging
+
+    def record_load(csv_file, staging_table, *args, **kwargs):
+        staged.append(staging_table)
+        return load_csv_to_staging(csv_file, staging_table, *args, **kwargs)
+
+    def interrupted_copy(cur, df, staging_table):
+        if staging_table == 'stg_sales':
+            copied.append(len(df))
+            if interrupt['after_chunks'] is not None and len(copied) > interrupt['after_chunks']:
+                raise RuntimeError('interrupted')
+        copy_to_staging(cur, df, staging_table)
+
+    monkeypatch.setattr(etl_utils, 'load_csv_to_staging', record_load)
+    monkeypatch.setattr(etl_utils, '_copy_to_staging', interrupted_copy)
+    with empty_shard('resume'):
+        ledgers = []
+        open_ledger = etl_utils.RunLedger.open
+        monkeypatch.setattr(etl_utils.RunLedger, 'open', lambda conn, resume=True: (
+            ledgers.append(conn) or open_ledger(conn, resume)))
+        with pytest.raises(RuntimeError, match='interrupted'):
+            run_etl(data_dir, workers=1)
+        # The failed run closed the connection of its ledger
+        assert ledgers[0].closed
+        assert staged == ['stg_products', 'stg_customers', 'stg_time_dimension', 'stg_stores',
+                          'stg_sales']
+
+        staged.clear()
+        copied.clear()
+        interrupt['after_chunks'] = None
+        run_etl(data_dir, workers=1)
+        # Dimensions are not staged or merged again; sales continue after two chunks
+        assert staged == ['stg_sales', 'stg_inventory']
+        assert sum(copied) == sales_rows - 2 * chunk_size
+
+        counts = execute_query(f"""
+        SELECT (SELECT COUNT(*) FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales) AS sales,
+            (SELECT COUNT(*) FROM {SCHEMA_CONFIG['fact_schema']}.fact_inventory) AS inventory,
+            (SELECT status FROM {SCHEMA_CONFIG['schema_name']}.etl_runs
+             ORDER BY run_id DESC LIMIT 1) AS status,
+            (SELECT COUNT(*) FROM {SCHEMA_CONFIG['schema_name']}.etl_runs) AS runs
+        """)[0]
+    inventory_rows = len(read_source(raw_data_dir, 'inventory'))
+    assert counts == {'sales': sales_rows, 'inventory': inventory_rows, 'status': 'completed',
+                      'runs': 1}
+
+def test_batched_merge_matches_single_merge(loaded_warehouse, raw_data_dir):
+    """Test that merging staging in key ranges gives the same facts as one statement."""
+    with empty_shard('batches'):
+        staged = load_csv_to_staging('sales.csv', 'stg_sales', raw_data_dir)
+        facts_query = f"SELECT * FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales ORDER BY sale_id"
+        batch_size = staged // 5 + 1
+        conn = psycopg2.connect(**loaded_warehouse)
+        try:
+            with conn.cursor() as cur:
+                assert len(etl_utils._batch_bounds(cur, 'stg_sales', 'sale_id', batch_size)) == 5
+            assert merge_fact_table(conn, 'fact_sales', batch_size) == staged
+            batched = execute_query(facts_query)
+
+            with conn.cursor() as cur:
+                cur.execute(f"TRUNCATE TABLE {SCHEMA_CONFIG['fact_schema']}.fact_sales")
+            conn.commit()
+            assert merge_fact_table(conn, 'fact_sales') == staged
+            assert execute_query(facts_query) == batched
+
+            # Merging again in batches updates every row in place
+            assert merge_fact_table(conn, 'fact_sales', batch_size) == staged
+            assert execute_query(facts_query) == batched
+        finally:
+            conn.close()
+    assert len(batched) == len(read_source(raw_data_dir, 'sales'))
+
+def test_compact_sales_view_matches_source(loaded_warehouse, raw_data_dir, tmp_path, monkeypatch):
+    """Test that facts.v_sales over compact facts gives the source rows and amounts."""
+    monkeypatch.setitem(ETL_CONFIG, 'rejects_dir', str(tmp_path / 'rejects'))
+    with SCHEMA_CONFIG.scoped(compact_facts=True), empty_shard('compact'):
+        run_etl(raw_data_dir, dimensions=False)
+        assert execute_query("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = 'fact_sales' AND column_name = 'unit_price_cents'
+        """, (SCHEMA_CONFIG['fact_schema'],))
+        rows = execute_query(f"""
+        SELECT fs.sale_id, fs.date_key, p.product_id, c.customer_id, s.store_id, fs.quantity,
+            fs.unit_price, fs.total_amount, fs.discount_amount, fs.net_amount, fs.payment_method
+        FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_key = p.product_key
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
+        JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON fs.store_key = s.store_key
+        """)
+    sales = read_source(raw_data_dir, 'sales').set_index('sale_id')
+    assert sorted(row['sale_id'] for row in rows) == sorted(sales.index)
+    for row in rows:
+        source = sales.loc[row['sale_id']]
+        assert (row['date_key'], row['product_id'], row['customer_id'], row['store_id'],
+                row['quantity'], row['payment_method']) == (
+            int(source['date_id']), source['product_id'], source['customer_id'],
+            source['store_id'], int(source['quantity']), source['payment_method'])
+        # Amounts are stored in cents, so they match the source to the cent
+        for column in ('unit_price', 'total_amount', 'discount_amount', 'net_amount'):
+            assert math.isclose(row[column], float(source[column]), abs_tol=0.011), column
@@ -0,0 +1,57 @@
+"""
+Tests for streaming exports of query results.
+"""
+import csv
+import json
+from datetime import date
+from decimal import Decimal
+import pyarrow.parquet as pq
+from queries import analytics_queries
+from queries.export import (REPORT_QUERIES, REPORTS, column_array, dumps, export_query,
+                            export_report)
+
+def test_decimals_and_dates_are_converted_natively():
+    """Test that decimals become the nearest doubles and dates stay dates."""
+    assert column_array([Decimal('316.40'), None], None).to_pylist() == [316.4, None]
+    assert json.loads(dumps([{'day': date(2023, 1, 2), 'amount': Decimal('0.10')}])) == [
+        {'day': '2023-01-02', 'amount': 0.1}
+    ]
+
+def test_exports_match_across_formats(loaded_warehouse, tmp_path):
+    """Test that a query streamed in small batches exports the same rows in every format."""
+    query = """
+    SELECT sale_id, date_key, quantity, net_amount, transaction_time
+    FROM facts.v_sales ORDER BY sale_id LIMIT 250
+    """
+    counts = {fmt: export_query(query, str(tmp_path / f'sales.{fmt}'), batch_rows=100)
+              for fmt in ('json', 'ndjson', 'csv', 'parquet')}
+    assert set(counts.values()) == {250}
+
+    rows = json.loads((tmp_path / 'sales.json').read_text())
+    lines = [json.loads(line) for line in (tmp_path / 'sales.ndjson').read_text().splitlines()]
+    assert rows == lines
+    with open(tmp_path / 'sales.csv', newline='') as f:
+        assert [row['sale_id'] for row in csv.DictReader(f)] == [row['sale_id'] for row in rows]
+    table = pq.read_table(tmp_path / 'sales.parquet')
+    assert table.column('net_amount').to_pylist() == [row['net_amount'] for row in rows]
+
+def test_export_report(loaded_warehouse, tmp_path):
+    """Test that a report exports all of its rows."""
+    path = tmp_path / 'trends.parquet'
+    rows = export_report('sales_trends', str(path))
+    assert rows > 0
+    assert pq.read_table(path).num_rows == rows
+
+def test_reports_are_streamed(loaded_warehouse, tmp_path, monkeypatch):
+    """Test that report exports stream their query and give the rows of the report functions."""
+    assert list(REPORT_QUERIES) == list(REPORTS)
+    expected = {report: json.loads(dumps(function())) for report, function in REPORTS.items()}
+
+    def fetch_all(query, params=None):
+        raise AssertionError('report rows fetched at once')
+
+    monkeypatch.setattr(analytics_queries, 'execute_query', fetch_all)
+    for report in REPORTS:
+        path = tmp_path / f'{report}.json'
+        assert export_report(report, str(path), batch_rows=7) == len(expected[report])
+        assert json.loads(path.read_text()) == expected[report]
@@ -0,0 +1,141 @@
+"""
+Tests for the current stock table and the inventory snapshot compaction.
+"""
+import os
+import shutil
+import pandas as pd
+import pytest
+from config import SCHEMA_CONFIG
+from queries import analytics_queries
+from utils.db_utils import execute_query
+from utils.etl_utils import run_etl
+from utils.inventory import compact_inventory_snapshots, compaction_cutoff, update_current_stock
+from utils.shards import setup_shards, shard_scope
+
+STOCK_QUERY = """
+SELECT store_id, product_id, date_key, inventory_id, ending_quantity, reorder_point
+FROM facts_inventory.current_stock
+ORDER BY store_id, product_id
+"""
+
+MONTHLY_QUERY = """
+SELECT store_key, product_key, date_key / 100 AS month_key,
+    SUM(units_received) AS received, SUM(units_sold) AS sold, SUM(units_damaged) AS damaged,
+    (ARRAY_AGG(ending_quantity ORDER BY date_key DESC))[1] AS month_end_stock
+FROM facts_inventory.fact_inventory
+GROUP BY 1, 2, 3
+ORDER BY 1, 2, 3
+"""
+
+@pytest.fixture
+def inventory_shard(loaded_warehouse):
+    """Load inventory into an empty shard of its own, leaving the loaded facts unchanged."""
+    setup_shards(['inventory'])
+    with shard_scope('inventory'):
+        yield
+
+def test_current_stock_is_latest_snapshot(loaded_warehouse):
+    """Test the current stock and the alerts against the latest fact snapshots."""
+    latest = execute_query("""
+    SELECT DISTINCT ON (s.store_id, p.product_id)
+        s.store_id, p.product_id, fi.date_key, fi.inventory_id, fi.ending_quantity, fi.reorder_point
+    FROM facts.fact_inventory fi
+    JOIN dimensions.dim_store s ON fi.store_key = s.store_key
+    JOIN dimensions.dim_product p ON fi.product_key = p.product_key
+    ORDER BY s.store_id, p.product_id, fi.date_key DESC
+    """)
+    assert execute_query(STOCK_QUERY.replace('facts_inventory', 'facts')) == latest
+
+    alerts = analytics_queries.get_low_stock_alerts()
+    expected = {(row['store_id'], row['product_id']) for row in latest
+                if row['ending_quantity'] < row['reorder_point']}
+    assert {(row['store_id'], row['product_id']) for row in alerts} == expected
+    assert all(row['shortfall'] > 0 for row in alerts)
+    assert [row['shortfall'] for row in alerts] == sorted((row['shortfall'] for row in alerts),
+                                                         reverse=True)
+
+    stock = sum(row['current_stock'] for row in analytics_queries.get_inventory_analysis())
+    assert stock == sum(row['ending_quantity'] for row in latest)
+
+def test_current_stock_is_updated_incrementally(inventory_shard, raw_data_dir, tmp_path):
+    """Test that loading newer snapshots updates the current stock like a rebuild."""
+    inventory = pd.read_csv(os.path.join(raw_data_dir, 'inventory.csv'), dtype=str)
+    dates = sorted(inventory['date_id'].unique())
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    shutil.copy(os.path.join(raw_data_dir, 'sales.csv'), data_dir)
+
+    inventory[inventory['date_id'] < dates[len(dates) // 2]].to_csv(data_dir / 'inventory.csv',
+                                                                    index=False)
+    run_etl(str(data_dir), dimensions=False)
+    first = execute_query(STOCK_QUERY)
+    inventory.to_csv(data_dir / 'inventory.csv', index=False)
+    run_etl(str(data_dir), dimensions=False)
+    stock = execute_query(STOCK_QUERY)
+    assert stock != first
+    assert {row['date_key'] for row in stock} == {int(dates[-1])}
+
+    update_current_stock(full=True)
+    assert execute_query(STOCK_QUERY) == stock
+
+def test_compaction_keeps_month_totals(inventory_shard, raw_data_dir):
+    """Test that compacted months keep their unit totals and month end stock."""
+    run_etl(raw_data_dir, dimensions=False, force=True)
+    before = execute_query(MONTHLY_QUERY)
+    stock = execute_query(STOCK_QUERY)
+    latest = max(row['date_key'] for row in stock)
+    cutoff = compaction_cutoff(latest, 60)
+
+    removed = compact_inventory_snapshots(60)
+    assert removed > 0
+    assert execute_query(MONTHLY_QUERY) == before
+    assert execute_query(STOCK_QUERY) == stock
+    snapshots = execute_query("""
+    SELECT MAX(n) AS old, (SELECT COUNT(*) FROM facts_inventory.fact_inventory
+                           WHERE date_key >= %(cutoff)s) AS recent
+    FROM (
+        SELECT COUNT(*) AS n FROM facts_inventory.fact_inventory
+        WHERE date_key < %(cutoff)s
+        GROUP BY store_key, product_key, date_key / 100
+    ) monthly
+    """, {'cutoff': cutoff})[0]
+    assert snapshots['old'] == 1
+    assert snapshots['recent'] > 0
+    assert compact_inventory_snapshots(60) == 0
+
+def test_compaction_keeps_months_too_large_for_compact_facts(loaded_warehouse, raw_data_dir,
+                                                            tmp_path):
+    """Test that months whose totals overflow the compact SMALLINT units are left weekly."""
+    inventory = pd.read_csv(os.path.join(raw_data_dir, 'inventory.csv'), dtype=str)
+    first = inventory.iloc[0]
+    large = ((inventory['store_id'] == first['store_id'])
+             & (inventory['product_id'] == first['product_id'])
+             & (inventory['date_id'].str[:6] == first['date_id'][:6]))
+    assert large.sum() > 1
+    # 20000 units a week fit the column, a month of them does not
+    for column in ('units_received', 'units_sold'):
+        inventory.loc[large, column] = (inventory.loc[large, column].astype(int) + 20000).astype(str)
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    shutil.copy(os.path.join(raw_data_dir, 'sales.csv'), data_dir)
+    inventory.to_csv(data_dir / 'inventory.csv', index=False)
+
+    with SCHEMA_CONFIG.scoped(compact_facts=True):
+        setup_shards(['compact_stock'])
+        with shard_scope('compact_stock'):
+            run_etl(str(data_dir), dimensions=False)
+            monthly_query = MONTHLY_QUERY.replace('facts_inventory', SCHEMA_CONFIG['fact_schema'])
+            before = execute_query(monthly_query)
+            assert compact_inventory_snapshots(60) > 0
+            assert execute_query(monthly_query) == before
+            kept = execute_query(f"""
+            SELECT COUNT(*) AS n FROM {SCHEMA_CONFIG['fact_schema']}.fact_inventory
+            WHERE inventory_id = ANY(%(ids)s)
+            """, {'ids': list(inventory.loc[large, 'inventory_id'])})
+    assert kept[0]['n'] == large.sum()
+
+def test_compaction_cutoff():
+    """Test that only whole months before the cutoff are compacted."""
+    assert compaction_cutoff(20240315, 30) == 20240201
+    assert compaction_cutoff(20240301, 0) == 20240301
+    assert compaction_cutoff(20240110, 365) == 20230101
@@ -0,0 +1,67 @@
+"""
+Tests for the dimension key cache shared by the ETL workers.
+"""
+import threading
+import time
+from utils.key_cache import DimensionKeyCache
+
+class FakeConnection:
+    """Connection whose dim_time table is a list, with fetches that can be held."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.hold = None
+        self.fetching = threading.Event()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        after = params[0] if params else 0
+        self.result = [row for row in self.conn.rows if row[1] > after]
+
+    def fetchall(self):
+        hold, self.conn.hold = self.conn.hold, None
+        if hold is not None:
+            self.conn.fetching.set()
+            hold.wait()
+        return self.result
+
+def test_refreshes_keep_keys_of_concurrent_refreshes():
+    """Test that a full refresh during an incremental one keeps the keys it read."""
+    conn = FakeConnection([('20240101', 1)])
+    cache = DimensionKeyCache('dim_time')
+    cache.refresh(conn)
+    readers_map = cache._keys
+
+    # An incremental refresh reads the second date and is held before it stores it
+    conn.rows.append(('20240102', 2))
+    release = conn.hold = threading.Event()
+    incremental = threading.Thread(target=cache.refresh, args=(conn,), daemon=True)
+    incremental.start()
+    assert conn.fetching.wait(5)
+
+    # Meanwhile a third date is added and the cache fully reloaded
+    conn.rows.append(('20240103', 3))
+    full = threading.Thread(target=cache.refresh, args=(conn,), kwargs={'full': True},
+                            daemon=True)
+    full.start()
+    time.sleep(0.1)
+    release.set()
+    incremental.join(5)
+    full.join(5)
+
+    assert [cache.lookup(date_id) for date_id in ('20240101', '20240102', '20240103')] == [1, 2, 3]
+    # Maps handed out to lookups are never changed
+    assert readers_map == {'20240101': 1}
@@ -0,0 +1,45 @@
+"""
+Tests for the read connection pool and the concurrency load test.
+"""
+import pytest
+from psycopg2.pool import PoolError
+from benchmarks.load_test import DEFAULT_MIX, latency_summary, parse_mix, run_load
+from utils.db_utils import ReadConnectionPool
+
+def test_latency_summary():
+    """Test the latency percentiles."""
+    summary = latency_summary([i / 100 for i in range(1, 101)])
+    assert summary['p50'] == pytest.approx(0.505)
+    assert summary['p99'] == pytest.approx(0.9901)
+    assert summary['max'] == 1.0
+    assert latency_summary([]) == {}
+    assert parse_mix('cube_drilldown=3,sales_trends') == {'cube_drilldown': 3.0, 'sales_trends': 1.0}
+    with pytest.raises(ValueError):
+        parse_mix('no_such_query=1')
+
+def test_pool_reuses_and_bounds_connections(loaded_warehouse):
+    """Test that the pool reuses connections and times out when all are in use."""
+    pool = ReadConnectionPool(1, timeout=0.05)
+    with pool.connection() as first:
+        with pytest.raises(PoolError):
+            with pool.connection():
+                pass
+    with pool.connection() as second:
+        assert second is first
+    stats = pool.statistics()
+    pool.close()
+    assert first.closed
+    assert stats['opened'] == 1
+    assert stats['borrowed'] == 2
+    assert stats['timeouts'] == 1
+    assert stats['peak_in_use'] == 1
+
+def test_load_run_measures_every_request(loaded_warehouse):
+    """Test a short load run through a pool smaller than the number of clients."""
+    level = run_load(DEFAULT_MIX, concurrency=4, requests=40, pool_size=2)
+    assert level['requests'] == 40
+    assert level['errors'] == 0
+    assert sum(query['requests'] for query in level['queries'].values()) == 40
+    assert level['latency']['p50'] <= level['latency']['p95'] <= level['latency']['p99']
+    assert level['pool']['peak_in_use'] <= 2
+    assert level['pool']['borrowed'] >= 40
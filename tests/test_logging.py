@@ -0,0 +1,91 @@
+"""
+Tests for the queued, structured logging.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import pytest
+from config import LOG_CONFIG
+from utils.logging_utils import JsonFormatter, ProgressLogger, setup_logger, stop_logging
+
+class ListHandler(logging.Handler):
+    """Collects records in a list."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def log_file(tmp_path):
+    """Write JSON logs to a temporary file for one test."""
+    settings = dict(LOG_CONFIG)
+    stop_logging()
+    LOG_CONFIG.update({'file': str(tmp_path / 'warehouse.log'), 'json': True})
+    yield tmp_path / 'warehouse.log'
+    stop_logging()
+    LOG_CONFIG.update(settings)
+
+def test_records_are_written_as_json_by_the_listener(log_file):
+    """Test that queued records reach the log file with their structured fields."""
+    logger = setup_logger('tests.logging')
+    logger.info("Loaded rows", extra={'stage': 'stg_sales', 'rows': 42})
+    stop_logging()
+
+    entry = json.loads(log_file.read_text().splitlines()[-1])
+    assert entry['message'] == "Loaded rows"
+    assert entry['stage'] == 'stg_sales'
+    assert entry['rows'] == 42
+    assert entry['level'] == 'INFO'
+
+def test_importing_modules_starts_no_listener(tmp_path):
+    """Test that the log file and listener thread are only created by the first record."""
+    script = (
+        "import threading\n"
+        "import utils.etl_utils, queries.analytics_queries\n"
+        "from utils import logging_utils\n"
+        "assert logging_utils._listener is None\n"
+        "assert threading.active_count() == 1\n"
+        "import os; assert not os.path.exists('sales_warehouse.log')\n"
+        "logging_utils.setup_logger('tests.lazy').info('first record')\n"
+        "assert logging_utils._listener is not None\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'PYTHONPATH': root, 'LOG_FILE': 'sales_warehouse.log'}
+    result = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'first record' in (tmp_path / 'sales_warehouse.log').read_text()
+
+def test_progress_is_rate_limited():
+    """Test that progress is logged once per interval plus once when done."""
+    logger = logging.getLogger('tests.progress')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = ListHandler()
+    logger.addHandler(handler)
+    try:
+        progress = ProgressLogger(logger, 'stg_sales', interval=3600)
+        for _ in range(1000):
+            progress.update(100)
+        progress.done()
+        assert len(handler.records) == 1
+        assert handler.records[0].rows == 100000
+
+        progress = ProgressLogger(logger, 'stg_sales', interval=0)
+        progress.update(5)
+        progress.update(5)
+        assert [record.rows for record in handler.records[1:]] == [5, 10]
+    finally:
+        logger.removeHandler(handler)
+
+def test_json_formatter_skips_missing_fields():
+    """Test that only the structured fields given are written."""
+    record = logging.LogRecord('x', logging.WARNING, __file__, 1, "Rejected %d rows", (3,), None)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['message'] == "Rejected 3 rows"
+    assert 'stage' not in entry and 'rows' not in entry
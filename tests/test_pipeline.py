@@ -0,0 +1,77 @@
+"""
+Tests for the task graph executor of the pipelines.
+"""
+import threading
+import time
+import psycopg2
+import pytest
+from config import SCHEMA_CONFIG
+from utils.pipeline import Pipeline
+from utils.shards import shard_scope
+
+def test_independent_tasks_overlap():
+    """Test that tasks run once their dependencies completed, independent ones at once."""
+    finished = []
+    lock = threading.Lock()
+
+    def task(name, seconds):
+        def run():
+            time.sleep(seconds)
+            with lock:
+                finished.append(name)
+        return run
+
+    pipeline = Pipeline('test', workers=3, retries=0)
+    pipeline.add('a', task('a', 0.2))
+    pipeline.add('b', task('b', 0.2))
+    pipeline.add('c', task('c', 0.05), ['a'])
+    pipeline.add('d', task('d', 0.05), ['b', 'c'])
+    timings = pipeline.run()
+
+    assert finished.index('c') > finished.index('a')
+    assert finished[-1] == 'd'
+    assert timings['b']['start'] < timings['a']['seconds']
+    assert all(timing['status'] == 'completed' for timing in timings.values())
+    # Wall time is the longest chain (a, c, d), not the sum of the tasks
+    assert pipeline.seconds < 0.45
+    assert pipeline.critical_path() == ['a', 'c', 'd']
+    report = pipeline.report()
+    assert 'Critical path: a -> c -> d' in report
+    assert '* a ' in report and '  b ' in report
+
+def test_transient_errors_are_retried():
+    """Test that a transient database error is retried and other errors stop the pipeline."""
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+    pipeline = Pipeline('test', workers=2, retries=2, retry_delay=0.01)
+    pipeline.add('flaky', flaky)
+    assert pipeline.run()['flaky']['attempts'] == 3
+
+    ran = []
+    pipeline = Pipeline('test', workers=2, retries=2, retry_delay=0.01)
+    pipeline.add('broken', lambda: 1 / 0)
+    pipeline.add('after', lambda: ran.append('after'), ['broken'])
+    with pytest.raises(ZeroDivisionError):
+        pipeline.run()
+    assert not ran
+    assert pipeline.timings['broken']['attempts'] == 1
+    assert pipeline.timings['broken']['status'] == 'failed'
+    assert pipeline.timings['after']['status'] == 'not run'
+
+def test_tasks_see_the_callers_shard_scope():
+    """Test that tasks run with the schemas of the thread that runs the pipeline."""
+    seen = {}
+    pipeline = Pipeline('test', workers=2)
+    pipeline.add('schema', lambda: seen.update(schema=SCHEMA_CONFIG['fact_schema']))
+    with shard_scope('east'):
+        pipeline.run()
+    assert seen['schema'] == 'facts_east'
+    with pytest.raises(ValueError):
+        pipeline.add('orphan', lambda: None, ['missing'])
+    with pytest.raises(ValueError):
+        pipeline.add('schema', lambda: None)
@@ -0,0 +1,111 @@
+"""
+Tests for routing analytics reads to a streaming replica of the test server.
+"""
+import time
+import psycopg2
+import pytest
+from config import READ_REPLICAS, REPLICA_CONFIG
+from queries import analytics_queries
+from utils import db_utils
+from utils.db_utils import ReadConnectionPool, get_read_connection, replication_lag
+from utils.ephemeral_postgres import EphemeralPostgres
+
+@pytest.fixture(scope='module')
+def replica(loaded_warehouse, postgres_server):
+    """Start a streaming replica of the loaded test server."""
+    server = EphemeralPostgres(primary=postgres_server)
+    try:
+        server.start()
+    except RuntimeError as e:
+        pytest.skip(f"Replica unavailable: {e}")
+    yield server
+    server.stop()
+
+@pytest.fixture
+def read_replicas(replica):
+    """Route reads to the replica for one test."""
+    settings = dict(REPLICA_CONFIG)
+    READ_REPLICAS[:] = [{'host': 'localhost', 'port': str(replica.port)}]
+    db_utils._skipped_replicas.clear()
+    yield READ_REPLICAS
+    READ_REPLICAS.clear()
+    REPLICA_CONFIG.update(settings)
+    db_utils._skipped_replicas.clear()
+
+def is_standby(conn) -> bool:
+    """Check whether a connection is to a standby server."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_is_in_recovery()")
+        return cur.fetchone()[0]
+
+def test_reads_use_replica(read_replicas):
+    """Test that analytics queries run on the replica."""
+    conn = get_read_connection()
+    try:
+        assert is_standby(conn)
+        assert replication_lag(conn) <= REPLICA_CONFIG['max_lag_seconds']
+    finally:
+        conn.close()
+    assert analytics_queries.get_top_performing_stores()
+
+def test_lagging_replica_falls_back_to_primary(read_replicas):
+    """Test that a replica over the lag limit is skipped."""
+    REPLICA_CONFIG['max_lag_seconds'] = -1
+    conn = get_read_connection()
+    try:
+        assert not is_standby(conn)
+    finally:
+        conn.close()
+
+def test_unreachable_replica_falls_back_to_primary(read_replicas, replica):
+    """Test that an unreachable replica is skipped."""
+    READ_REPLICAS.insert(0, {'host': 'localhost', 'port': '1'})
+    for _ in range(2):
+        conn = get_read_connection()
+        try:
+            assert is_standby(conn)
+        finally:
+            conn.close()
+
+def test_disconnected_replica_falls_back_to_primary(read_replicas, replica):
+    """Test that a standby no longer receiving WAL is skipped however idle the primary is."""
+    conn = psycopg2.connect(**replica.config)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SHOW primary_conninfo")
+        conninfo = cur.fetchone()[0]
+        cur.execute("ALTER SYSTEM SET primary_conninfo = ''")
+        cur.execute("SELECT pg_reload_conf()")
+    try:
+        deadline = time.monotonic() + 10
+        while replication_lag(conn) != float('inf') and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert replication_lag(conn) == float('inf')
+        read_conn = get_read_connection()
+        try:
+            assert not is_standby(read_conn)
+        finally:
+            read_conn.close()
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("ALTER SYSTEM SET primary_conninfo = %s", (conninfo,))
+            cur.execute("SELECT pg_reload_conf()")
+        conn.close()
+
+def test_pooled_replica_connection_is_replaced_when_lagging(read_replicas):
+    """Test that an idle pooled replica connection is checked again and replaced if behind."""
+    pool = ReadConnectionPool(1)
+    try:
+        with pool.connection() as first:
+            assert is_standby(first)
+        # Fresh enough connections are reused without a check
+        with pool.connection() as conn:
+            assert conn is first
+        REPLICA_CONFIG['retry_after_seconds'] = 0
+        REPLICA_CONFIG['max_lag_seconds'] = -1
+        with pool.connection() as conn:
+            assert first.closed
+            assert not is_standby(conn)
+        assert pool.statistics()['stale'] == 1
+    finally:
+        pool.close()
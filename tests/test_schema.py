@@ -0,0 +1,88 @@
+"""
+Tests for the source dtype registry and the memory instrumentation.
+"""
+import logging
+import time
+import numpy as np
+import pandas as pd
+from queries import columnar_queries
+from utils.data_generator import generate_all_data
+from utils.data_manager import DataManager
+from utils.etl_utils import compute_row_hash
+from utils.memory_profile import current_rss, track_memory
+from utils.schema import downcast, source_dtypes
+
+def test_repeated_text_is_read_as_categories():
+    """Test that fact keys and low-cardinality text are categorical."""
+    dtypes = source_dtypes('stg_sales')
+    assert dtypes['payment_method'] == 'category'
+    assert dtypes['product_id'] == 'category'
+    assert dtypes['sale_id'] is str
+    assert source_dtypes('stg_customers')['customer_id'] is str
+
+def test_downcast_keeps_values_and_row_hashes():
+    """Test that integers become int32 without changing their text form."""
+    df = pd.DataFrame({
+        'store_id': ['S001', 'S002'],
+        'store_size': [1200.5, 800.0],
+        'beginning_quantity': [5, 7],
+        'ending_quantity': [3.0, None]
+    })
+    hashes = compute_row_hash(df, list(df.columns))
+    downcast(df, 'stg_inventory')
+    downcast(df, 'stg_stores')
+    assert df['beginning_quantity'].dtype == 'int32'
+    assert df['ending_quantity'].dtype == 'float64'
+    assert df['store_size'].dtype == 'float64'
+    assert compute_row_hash(df, list(df.columns)).equals(hashes)
+
+def test_compact_parquet_files_answer_columnar_reports(tmp_path):
+    """Test that Parquet files written with the registry dtypes serve the columnar reports."""
+    manager = DataManager(str(tmp_path))
+    generate_all_data(scale=0.002, output_dir=str(manager.raw_dir))
+    for name in columnar_queries.PARQUET_FILES.values():
+        manager.convert_to_parquet(name.replace('.parquet', '.csv'))
+    sales = pd.read_parquet(manager.processed_dir / 'sales.parquet')
+    assert isinstance(sales['payment_method'].dtype, pd.CategoricalDtype)
+    assert sales['quantity'].dtype == 'int32'
+    assert columnar_queries.get_inventory_analysis(str(manager.processed_dir))
+    assert columnar_queries.get_daily_sales_by_store(str(manager.processed_dir))
+
+def test_track_memory_reports_frames_and_peak_rss():
+    """Test that an enabled stage logs its largest DataFrame and the peak RSS."""
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger('utils.memory_profile')
+    logger.addHandler(handler)
+    try:
+        with track_memory('test stage', enabled=True) as memory:
+            memory.frame(pd.DataFrame({'x': range(1000)}))
+        with track_memory('quiet stage', enabled=False) as memory:
+            memory.frame(pd.DataFrame({'x': range(10)}))
+    finally:
+        logger.removeHandler(handler)
+    assert [record.stage for record in records] == ['test stage']
+    assert records[0].frame_bytes >= 8000
+    assert records[0].peak_rss_bytes > 0
+
+def test_concurrent_stages_keep_their_peaks():
+    """Test that a stage starting inside another does not lose the outer stage's peak."""
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger('utils.memory_profile')
+    logger.addHandler(handler)
+    try:
+        with track_memory('outer stage', enabled=True):
+            before = current_rss()
+            block = np.ones(2 ** 24)
+            time.sleep(0.2)
+            del block
+            with track_memory('inner stage', enabled=True):
+                pass
+    finally:
+        logger.removeHandler(handler)
+    peaks = {record.stage: record.peak_rss_bytes for record in records}
+    assert peaks['outer stage'] >= before + 100 * 2 ** 20
+    assert peaks['inner stage'] < peaks['outer stage']
@@ -0,0 +1,69 @@
+"""
+Tests for loading and querying the fact data in shards.
+"""
+import math
+import os
+import threading
+import pandas as pd
+import pytest
+from config import SCHEMA_CONFIG
+from queries.export import REPORTS
+from queries.sharded import SHARDED_REPORTS, run_report
+from utils.db_utils import execute_query
+from utils.shards import partition_fact_files, run_sharded_etl, setup_shards, shard_scope
+
+SHARDS = ('east', 'west')
+
+@pytest.fixture(scope='module')
+def sharded_warehouse(loaded_warehouse, raw_data_dir, tmp_path_factory):
+    """Load the generated data a second time, split into two shards."""
+    data_dir = str(tmp_path_factory.mktemp('sharded'))
+    # The test data has a single store: split on the customer so both shards get sales
+    rows = partition_fact_files(raw_data_dir, data_dir, SHARDS, column='customer_id')
+    setup_shards(SHARDS)
+    run_sharded_etl(data_dir, SHARDS)
+    return {'data_dir': data_dir, 'rows': rows}
+
+def test_shard_scope_is_per_thread():
+    """Test that a shard scope only changes the schemas seen by its own thread."""
+    seen = {}
+    with shard_scope('east'):
+        thread = threading.Thread(target=lambda: seen.update(SCHEMA_CONFIG))
+        thread.start()
+        thread.join()
+        assert SCHEMA_CONFIG['fact_schema'] == 'facts_east'
+        assert SCHEMA_CONFIG['dim_schema'] == 'dimensions'
+    assert SCHEMA_CONFIG['fact_schema'] == seen['fact_schema'] == 'facts'
+    with pytest.raises(ValueError):
+        with shard_scope('East; DROP'):
+            pass
+
+def test_partition_keeps_customers_together(sharded_warehouse, raw_data_dir):
+    """Test that every customer's sales go to one shard and no row is lost."""
+    customers = {shard: set(pd.read_csv(os.path.join(sharded_warehouse['data_dir'], shard, 'sales.csv'),
+                                        dtype=str)['customer_id'])
+                 for shard in SHARDS}
+    assert customers['east'] and customers['west']
+    assert not customers['east'] & customers['west']
+    source_rows = sum(len(pd.read_csv(os.path.join(raw_data_dir, name)))
+                      for name in ('sales.csv', 'inventory.csv'))
+    assert sum(sharded_warehouse['rows'].values()) == source_rows
+
+    loaded = sum(execute_query(f"SELECT COUNT(*) AS n FROM facts_{shard}.fact_sales")[0]['n']
+                 for shard in SHARDS)
+    assert loaded == execute_query("SELECT COUNT(*) AS n FROM facts.fact_sales")[0]['n']
+
+@pytest.mark.parametrize('report', list(SHARDED_REPORTS))
+def test_sharded_reports_match_unsharded(sharded_warehouse, report):
+    """Test that merged shard results match the report on the unsharded facts."""
+    spec = SHARDED_REPORTS[report]
+    expected = {tuple(row[key] for key in spec['keys']): row for row in REPORTS[report]()}
+    merged = run_report(report, SHARDS)
+    assert len(merged) == len(expected)
+    for row in merged:
+        reference = expected[tuple(row[key] for key in spec['keys'])]
+        assert list(row) == list(reference)
+        for column, rule in spec['measures'].items():
+            # Distinct counts spanning shards are sketch estimates
+            tolerance = 0.05 if isinstance(rule, tuple) and rule[0] == 'distinct' else 1e-9
+            assert math.isclose(row[column], reference[column], rel_tol=tolerance), column
@@ -0,0 +1,31 @@
+"""
+Tests for the HyperLogLog distinct count sketches.
+"""
+import pandas as pd
+from utils.sketches import HyperLogLog
+
+def test_estimate_within_error_bounds():
+    """Test small and large cardinalities against their error bounds."""
+    for count in (10, 1000, 200000):
+        sketch = HyperLogLog()
+        sketch.add(pd.Series([f'C{i}' for i in range(count)]))
+        assert abs(sketch.estimate() - count) <= max(1, 3 * sketch.relative_error * count)
+
+def test_merge_and_repeated_values():
+    """Test that merging sketches and re-adding values count each value once."""
+    first, second = HyperLogLog(), HyperLogLog()
+    first.add(pd.Series([f'C{i}' for i in range(5000)]))
+    second.add(pd.Series([f'C{i}' for i in range(2500, 7500)]))
+    estimate = first.estimate()
+    first.add(pd.Series([f'C{i}' for i in range(5000)]))
+    assert first.estimate() == estimate
+
+    first.merge(second)
+    assert abs(first.estimate() - 7500) <= 3 * first.relative_error * 7500
+
+def test_serialization():
+    """Test that registers survive a round trip through bytes."""
+    sketch = HyperLogLog(precision=10)
+    sketch.add(pd.Series(range(100)))
+    restored = HyperLogLog.from_bytes(sketch.to_bytes(), 10)
+    assert restored.estimate() == sketch.estimate()
@@ -0,0 +1,69 @@
+"""
+Tests for the micro-batch ingestion of new sales.
+"""
+import io
+import os
+import pandas as pd
+import pytest
+from utils.cube import build_sales_cube
+from utils.customer_activity import build_customer_activity
+from utils.db_utils import execute_query
+from utils.shards import setup_shards, shard_scope
+from utils.streaming import LandingDirectory, LineStream, run_ingest
+
+CUBE_QUERY = """
+SELECT grouping_id, date_key, store_id, category, customer_segment, transactions, net_amount
+FROM facts_stream.sales_cube
+ORDER BY 1, 2, 3, 4, 5
+"""
+
+ACTIVITY_QUERY = """
+SELECT * FROM facts_stream.customer_activity ORDER BY customer_id, month_key
+"""
+
+@pytest.fixture
+def stream_shard(loaded_warehouse):
+    """Ingest into an empty shard of its own, leaving the loaded facts unchanged."""
+    setup_shards(['stream'])
+    with shard_scope('stream'):
+        yield
+
+@pytest.fixture
+def sales(raw_data_dir):
+    """Return the generated sales rows as text."""
+    return pd.read_csv(os.path.join(raw_data_dir, 'sales.csv'), dtype=str)
+
+def test_landing_files_are_merged_once(stream_shard, sales, tmp_path):
+    """Test that overlapping files are merged in bounded batches and the cube stays exact."""
+    landing = tmp_path / 'landing'
+    landing.mkdir()
+    sales.iloc[:80].to_csv(landing / 'a.csv', index=False)
+    sales.iloc[40:120].to_csv(landing / 'b.csv', index=False)
+
+    totals = run_ingest(LandingDirectory(str(landing)), max_batch_rows=50, once=True)
+    assert totals == {'batches': 4, 'rows': 160, 'rejected': 0, 'new': 120}
+    assert sorted(os.listdir(landing / 'processed')) == ['a.csv', 'b.csv']
+    loaded = execute_query("""
+    SELECT COUNT(*) AS n FROM facts_stream.fact_sales WHERE sale_id = ANY(%(ids)s)
+    """, {'ids': list(sales['sale_id'].iloc[:120])})
+    assert loaded[0]['n'] == 120
+
+    # Adding the new sales to the cube and the activity gives the rows of a rebuild
+    cells = execute_query(CUBE_QUERY)
+    build_sales_cube()
+    assert execute_query(CUBE_QUERY) == cells
+    activity = execute_query(ACTIVITY_QUERY)
+    build_customer_activity()
+    assert execute_query(ACTIVITY_QUERY) == activity
+
+def test_stdin_lines_are_merged(stream_shard, sales):
+    """Test that CSV lines read from a stream are merged until it ends, once only."""
+    text = sales.iloc[200:250].to_csv(index=False)
+    first = run_ingest(LineStream(io.StringIO(text)), max_batch_seconds=0, poll_seconds=0.01)
+    again = run_ingest(LineStream(io.StringIO(text)), max_batch_seconds=0, poll_seconds=0.01)
+    assert first['rows'] == again['rows'] == 50
+    assert again['new'] == 0
+    loaded = execute_query("""
+    SELECT COUNT(*) AS n FROM facts_stream.fact_sales WHERE sale_id = ANY(%(ids)s)
+    """, {'ids': list(sales['sale_id'].iloc[200:250])})
+    assert loaded[0]['n'] == 50
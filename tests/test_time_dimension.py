@@ -0,0 +1,34 @@
+"""
+Tests for the calendar builder of the time dimension.
+"""
+from utils.time_dimension import (HolidayCalendar, FixedHoliday, US_HOLIDAYS,
+                                  generate_calendar)
+
+def test_calendar_covers_range():
+    """Test that every day of a multi-decade range gets one row."""
+    calendar = generate_calendar('2000-01-01', '2029-12-31')
+    assert len(calendar) == 10958
+    assert calendar['date_id'].is_unique
+    leap_day = calendar[calendar['date_id'] == '20240229'].iloc[0]
+    assert leap_day['day_of_week'] == 'Thursday'
+    assert leap_day['day_of_year'] == 60
+    assert leap_day['week_of_year'] == 9
+
+def test_holiday_rules():
+    """Test fixed-date and n-th weekday holidays."""
+    calendar = generate_calendar('2023-01-01', '2024-12-31', holidays=US_HOLIDAYS)
+    holidays = dict(zip(calendar.loc[calendar['is_holiday'], 'date_id'],
+                        calendar.loc[calendar['is_holiday'], 'holiday_name']))
+    assert holidays['20231123'] == 'Thanksgiving'
+    assert holidays['20241128'] == 'Thanksgiving'
+    assert holidays['20240704'] == 'Independence Day'
+    assert len(holidays) == 8
+
+def test_custom_calendar_and_fiscal_year():
+    """Test a custom holiday calendar and a fiscal year starting in October."""
+    calendar = generate_calendar('2023-09-30', '2023-10-01',
+                                 holidays=HolidayCalendar([FixedHoliday('Company Day', 10, 1)]),
+                                 fiscal_start_month=10)
+    assert list(calendar['fiscal_year']) == [2023, 2024]
+    assert list(calendar['fiscal_quarter']) == [4, 1]
+    assert list(calendar['holiday_name']) == ['', 'Company Day']
@@ -0,0 +1,88 @@
+"""
+Tests for the validation of source rows before staging.
+"""
+import pandas as pd
+from utils.schema import source_dtypes
+from utils.validation import validate_chunk
+
+def sales_rows():
+    """Return two valid sales rows as read from a source file."""
+    return pd.DataFrame({
+        'sale_id': ['T000001', 'T000002'],
+        'date_id': ['20230101', '20230102'],
+        'product_id': ['P0001', 'P0002'],
+        'customer_id': ['C0001', 'C0002'],
+        'store_id': ['S001', 'S002'],
+        'quantity': [2, 1],
+        'unit_price': [10.0, 5.5],
+        'total_amount': [20.0, 5.5],
+        'discount_amount': [2.0, 0.0],
+        'net_amount': [18.0, 5.5],
+        'payment_method': ['Cash', 'Credit Card'],
+        'transaction_time': ['2023-01-01 10:00:00', '2023-01-02 11:30:00']
+    })
+
+def test_valid_rows_pass():
+    """Test that valid rows are kept."""
+    valid, rejects, warnings = validate_chunk(sales_rows(), 'stg_sales')
+    assert len(valid) == 2
+    assert rejects.empty
+    assert warnings == {}
+
+def test_invalid_rows_are_rejected_with_reasons():
+    """Test that each failed check quarantines the row with its reason."""
+    df = sales_rows()
+    df.loc[0, 'net_amount'] = 20.0
+    df.loc[1, 'sale_id'] = 'X2'
+    df.loc[1, 'transaction_time'] = 'not a time'
+
+    valid, rejects, _ = validate_chunk(df, 'stg_sales')
+    assert valid.empty
+    assert list(rejects['source_row']) == [1, 2]
+    assert rejects.loc[0, 'reject_reason'] == 'net_amount != total_amount - discount_amount'
+    assert 'invalid transaction_time' in rejects.loc[1, 'reject_reason']
+    assert 'missing or malformed sale_id' in rejects.loc[1, 'reject_reason']
+
+def test_missing_and_out_of_range_values_are_rejected():
+    """Test that values the warehouse tables cannot store are rejected before staging."""
+    df = pd.concat([sales_rows()] * 3, ignore_index=True)
+    df['sale_id'] = [f'T00000{i}' for i in range(1, 7)]
+    df.loc[0, 'quantity'] = None
+    df.loc[1, 'net_amount'] = None
+    df.loc[2, 'payment_method'] = None
+    df.loc[3, 'transaction_time'] = None
+    df.loc[4, ['quantity', 'total_amount', 'net_amount']] = [40000, 400000.0, 400000.0]
+    df.loc[4, 'discount_amount'] = 0.0
+
+    valid, rejects, _ = validate_chunk(df, 'stg_sales')
+    assert list(valid.index) == [4, 5]
+    assert list(rejects['reject_reason']) == ['missing quantity', 'missing net_amount',
+                                              'missing payment_method',
+                                              'missing transaction_time']
+
+    valid, rejects, _ = validate_chunk(df, 'stg_sales', compact=True)
+    assert list(valid.index) == [5]
+    assert rejects['reject_reason'].iloc[-1] == 'quantity out of range for the compact layout'
+
+def test_warnings_do_not_reject():
+    """Test that warning checks count rows but keep them."""
+    products = pd.DataFrame({
+        'product_id': ['P0001'],
+        'product_name': ['Product 1'],
+        'category': ['Toys'],
+        'subcategory': ['Subcategory 1'],
+        'brand': ['Brand 1'],
+        'unit_price': [10.0],
+        'cost': [12.0],
+        'created_date': ['2020-01-01'],
+        'modified_date': ['2020-01-01']
+    })
+    valid, rejects, warnings = validate_chunk(products, 'stg_products')
+    assert len(valid) == 1
+    assert rejects.empty
+    assert warnings == {'cost exceeds unit_price': 1}
+
+def test_text_columns_are_read_as_strings():
+    """Test that phone numbers keep their + prefix when read."""
+    assert source_dtypes('stg_customers')['phone'] is str
+    assert source_dtypes('stg_sales')['date_id'] is str
@@ -0,0 +1,134 @@
+"""
+Pre-aggregated sales cube.
+
+The cube holds the sales measures for every combination of the date, store,
+product category and customer segment dimensions (GROUP BY CUBE), so any
+slice or drill-down over them is answered from a few cube rows instead of
+the fact table. It is rebuilt after every load, and micro-batches of new
+sales are added to the cells they fall in; queries/cube.py reads it.
+"""
+import psycopg2
+from typing import Iterable
+from config import DB_CONFIG, SCHEMA_CONFIG
+from utils.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Cube dimension -> (cube column, expression over the sales joined to the
+# dimensions), in GROUPING() bit order: the first dimension is the high bit
+CUBE_DIMENSIONS = {
+    'date': ('date_key', 'fs.date_key'),
+    'store': ('store_id', 'st.store_id'),
+    'category': ('category', 'p.category'),
+    'segment': ('customer_segment', 'c.customer_segment')
+}
+
+# Cube measure -> aggregate over the sales; every measure is additive
+CUBE_MEASURES = {
+    'transactions': 'COUNT(*)',
+    'quantity': 'SUM(fs.quantity)',
+    'total_amount': 'SUM(fs.total_amount)',
+    'discount_amount': 'SUM(fs.discount_amount)',
+    'net_amount': 'SUM(fs.net_amount)'
+}
+
+def grouping_id(dimensions: Iterable[str]) -> int:
+    """
+    Return the grouping id of the cube cells grouped by the given dimensions.
+
+    Args:
+        dimensions: Dimensions kept in the cells (keys of CUBE_DIMENSIONS)
+
+    Returns:
+        GROUPING() bitmask with a bit set for every rolled-up dimension
+    """
+    kept = set(dimensions)
+    unknown = kept - set(CUBE_DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown cube dimensions: {', '.join(sorted(unknown))}")
+    names = list(CUBE_DIMENSIONS)
+    return sum(1 << (len(names) - 1 - i) for i, name in enumerate(names) if name not in kept)
+
+def _cube_insert_query(where: str = '', additive: bool = False) -> str:
+    """
+    Build the insert of the cube cells aggregated from the sales.
+
+    Args:
+        where: Condition on the sales (fs) to aggregate
+        additive: Add the measures to existing cells instead of failing on them
+
+    Returns:
+        SQL statement
+    """
+    cube_columns = [column for column, _ in CUBE_DIMENSIONS.values()]
+    expressions = [expression for _, expression in CUBE_DIMENSIONS.values()]
+    conflict = ''
+    if additive:
+        cell = ', '.join(['grouping_id', 'COALESCE(date_key, 0)'] +
+                         [f"COALESCE({column}, '')" for column in cube_columns[1:]])
+        updates = ',\n        '.join(f"{measure} = sales_cube.{measure} + EXCLUDED.{measure}"
+                                       for measure in CUBE_MEASURES)
+        conflict = f"ON CONFLICT ({cell}) DO UPDATE SET\n        {updates}"
+    return f"""
+    INSERT INTO {SCHEMA_CONFIG['fact_schema']}.sales_cube AS sales_cube (
+        grouping_id, {', '.join(cube_columns)}, {', '.join(CUBE_MEASURES)}
+    )
+    SELECT
+        GROUPING({', '.join(expressions)}),
+        {', '.join(expressions)},
+        {', '.join(CUBE_MEASURES.values())}
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store st ON fs.store_key = st.store_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON fs.product_key = p.product_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
+    {f'WHERE {where}' if where else ''}
+    GROUP BY CUBE({', '.join(expressions)})
+    HAVING COUNT(*) > 0  -- no grand total row without sales
+    {conflict}
+    """
+
+def add_to_sales_cube(cur, staging_table: str) -> int:
+    """
+    Add new sales to the cube cells they fall in.
+
+    Every measure is additive, so the cells of the new sales are aggregated
+    and added to the stored ones. Sales must be added once only: sales that
+    replace loaded ones need a rebuild (build_sales_cube).
+
+    Args:
+        cur: Cursor of the transaction that inserted the sales
+        staging_table: Staging table holding the sale_id of the new sales
+
+    Returns:
+        Number of cube cells updated or added
+    """
+    cur.execute(_cube_insert_query(
+        f"fs.sale_id IN (SELECT sale_id FROM {SCHEMA_CONFIG['staging_schema']}.{staging_table})",
+        additive=True
+    ))
+    return cur.rowcount
+
+def build_sales_cube() -> int:
+    """
+    Rebuild the sales cube from the sales facts.
+
+    The cube is replaced in one transaction, so readers see the old cube,
+    without waiting, until the new one is committed.
+
+    Returns:
+        Number of cube cells
+    """
+    logger.info("Building sales cube...")
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    # DELETE rather than TRUNCATE, whose exclusive lock would block readers
+    # for the whole rebuild
+    cur.execute(f"DELETE FROM {SCHEMA_CONFIG['fact_schema']}.sales_cube")
+    cur.execute(_cube_insert_query())
+    cells = cur.rowcount
+    cur.execute(f"ANALYZE {SCHEMA_CONFIG['fact_schema']}.sales_cube")
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info(f"Sales cube built with {cells} cells.", extra={'stage': 'cube', 'rows': cells})
+    return cells
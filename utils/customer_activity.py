@@ -0,0 +1,111 @@
+"""
+Monthly activity of every customer, maintained by the ETL.
+
+The activity table holds, per customer and month, the number of sales,
+their net amount and the first and last day with a sale. RFM scoring and
+cohort retention (see queries/analytics_queries.py) read it instead of the
+sales facts, so they take time in proportion to the customers and months,
+not the sales. Like the sales cube it is rebuilt after every load, and
+micro-batches of new sales are added to the rows they fall in: every
+measure is additive or a minimum/maximum.
+"""
+import psycopg2
+from config import DB_CONFIG, SCHEMA_CONFIG
+from utils.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Number of RFM scores (NTILE buckets) per measure: 5 is the best
+RFM_SCORES = 5
+
+# RFM segment -> minimum recency and frequency score, checked in order; the
+# last segment takes every remaining customer
+RFM_SEGMENTS = [
+    ('Champions', 4, 4),
+    ('Loyal', 3, 3),
+    ('Promising', 4, 1),
+    ('At Risk', 1, 3),
+    ('Needs Attention', 2, 1),
+    ('Lost', 1, 1)
+]
+
+def _activity_insert_query(where: str = '', additive: bool = False) -> str:
+    """
+    Build the insert of the activity rows aggregated from the sales.
+
+    Args:
+        where: Condition on the sales (fs) to aggregate
+        additive: Add the sales to existing rows instead of failing on them
+
+    Returns:
+        SQL statement
+    """
+    conflict = ''
+    if additive:
+        conflict = """ON CONFLICT (customer_id, month_key) DO UPDATE SET
+        first_date_key = LEAST(activity.first_date_key, EXCLUDED.first_date_key),
+        last_date_key = GREATEST(activity.last_date_key, EXCLUDED.last_date_key),
+        transactions = activity.transactions + EXCLUDED.transactions,
+        net_amount = activity.net_amount + EXCLUDED.net_amount"""
+    return f"""
+    INSERT INTO {SCHEMA_CONFIG['fact_schema']}.customer_activity AS activity (
+        customer_id, month_key, first_date_key, last_date_key, transactions, net_amount
+    )
+    SELECT
+        c.customer_id,
+        fs.date_key / 100,
+        MIN(fs.date_key),
+        MAX(fs.date_key),
+        COUNT(*),
+        SUM(fs.net_amount)
+    FROM {SCHEMA_CONFIG['fact_schema']}.v_sales fs
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON fs.customer_key = c.customer_key
+    {f'WHERE {where}' if where else ''}
+    GROUP BY c.customer_id, fs.date_key / 100
+    {conflict}
+    """
+
+def add_to_customer_activity(cur, staging_table: str) -> int:
+    """
+    Add new sales to the activity of their customers.
+
+    Sales must be added once only: sales that replace loaded ones need a
+    rebuild (build_customer_activity).
+
+    Args:
+        cur: Cursor of the transaction that inserted the sales
+        staging_table: Staging table holding the sale_id of the new sales
+
+    Returns:
+        Number of activity rows updated or added
+    """
+    cur.execute(_activity_insert_query(
+        f"fs.sale_id IN (SELECT sale_id FROM {SCHEMA_CONFIG['staging_schema']}.{staging_table})",
+        additive=True
+    ))
+    return cur.rowcount
+
+def build_customer_activity() -> int:
+    """
+    Rebuild the customer activity from the sales facts.
+
+    The rows are replaced in one transaction, so readers see the old
+    activity, without waiting, until the new one is committed.
+
+    Returns:
+        Number of activity rows
+    """
+    logger.info("Building customer activity...")
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    # TRUNCATE would lock the activity queries out until the commit
+    cur.execute(f"DELETE FROM {SCHEMA_CONFIG['fact_schema']}.customer_activity")
+    cur.execute(_activity_insert_query())
+    rows = cur.rowcount
+    cur.execute(f"ANALYZE {SCHEMA_CONFIG['fact_schema']}.customer_activity")
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info(f"Customer activity built with {rows} rows.",
+                extra={'stage': 'customer_activity', 'rows': rows})
+    return rows
@@ -3,113 +3,92 @@ Data generator utility for creating synthetic sales data warehouse data.
 """
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import timedelta
 import random
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Sequence
 import os
 from config import RAW_DATA_DIR
+from utils.time_dimension import generate_calendar
+from utils.pipeline import Pipeline
+from utils.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
 
 # Constants for data generation
 NUM_PRODUCTS = 1000
 NUM_CUSTOMERS = 5000
 NUM_STORES = 50
 DAYS_OF_DATA = 365
+TIME_DIMENSION_START = '2023-01-01'
+NUM_TRANSACTIONS = 100000
 PRODUCT_CATEGORIES = ['Electronics', 'Clothing', 'Home & Garden', 'Sports', 'Books', 'Toys', 'Food', 'Beauty']
 PAYMENT_METHODS = ['Credit Card', 'Debit Card', 'Cash', 'Mobile Payment']
 STORE_TYPES = ['Mall', 'Standalone', 'Outlet', 'Supermarket']
 CUSTOMER_SEGMENTS = ['Regular', 'Premium', 'VIP', 'Wholesale']
 
-def generate_product_data() -> pd.DataFrame:
+def generate_product_data(num_products: int = NUM_PRODUCTS) -> pd.DataFrame:
     """Generate product dimension data."""
     data = {
-        'product_id': [f'P{i:04d}' for i in range(1, NUM_PRODUCTS + 1)],
-        'product_name': [f'Product {i}' for i in range(1, NUM_PRODUCTS + 1)],
-        'category': np.random.choice(PRODUCT_CATEGORIES, NUM_PRODUCTS),
-        'subcategory': [f'Subcategory {i}' for i in range(1, NUM_PRODUCTS + 1)],
-        'brand': [f'Brand {i % 50 + 1}' for i in range(NUM_PRODUCTS)],
-        'unit_price': np.random.uniform(10, 1000, NUM_PRODUCTS).round(2),
-        'cost': np.random.uniform(5, 500, NUM_PRODUCTS).round(2),
-        'created_date': pd.date_range(start='2020-01-01', periods=NUM_PRODUCTS, freq='D'),
-        'modified_date': pd.date_range(start='2020-01-01', periods=NUM_PRODUCTS, freq='D')
+        'product_id': [f'P{i:04d}' for i in range(1, num_products + 1)],
+        'product_name': [f'Product {i}' for i in range(1, num_products + 1)],
+        'category': np.random.choice(PRODUCT_CATEGORIES, num_products),
+        'subcategory': [f'Subcategory {i}' for i in range(1, num_products + 1)],
+        'brand': [f'Brand {i % 50 + 1}' for i in range(num_products)],
+        'unit_price': np.random.uniform(10, 1000, num_products).round(2),
+        'cost': np.random.uniform(5, 500, num_products).round(2),
+        'created_date': pd.date_range(start='2020-01-01', periods=num_products, freq='D'),
+        'modified_date': pd.date_range(start='2020-01-01', periods=num_products, freq='D')
     }
     return pd.DataFrame(data)
 
-def generate_customer_data() -> pd.DataFrame:
+def generate_customer_data(num_customers: int = NUM_CUSTOMERS) -> pd.DataFrame:
     """Generate customer dimension data."""
     data = {
-        'customer_id': [f'C{i:04d}' for i in range(1, NUM_CUSTOMERS + 1)],
-        'first_name': [f'First{i}' for i in range(1, NUM_CUSTOMERS + 1)],
-        'last_name': [f'Last{i}' for i in range(1, NUM_CUSTOMERS + 1)],
-        'email': [f'customer{i}@example.com' for i in range(1, NUM_CUSTOMERS + 1)],
-        'phone': [f'+1{random.randint(1000000000, 9999999999)}' for _ in range(NUM_CUSTOMERS)],
-        'address': [f'{random.randint(1, 9999)} Main St' for _ in range(NUM_CUSTOMERS)],
-        'city': [f'City{i % 100 + 1}' for i in range(NUM_CUSTOMERS)],
-        'state': [f'State{i % 50 + 1}' for i in range(NUM_CUSTOMERS)],
-        'country': ['USA'] * NUM_CUSTOMERS,
-        'postal_code': [f'{random.randint(10000, 99999)}' for _ in range(NUM_CUSTOMERS)],
-        'customer_segment': np.random.choice(CUSTOMER_SEGMENTS, NUM_CUSTOMERS),
-        'created_date': pd.date_range(start='2019-01-01', periods=NUM_CUSTOMERS, freq='D'),
-        'modified_date': pd.date_range(start='2019-01-01', periods=NUM_CUSTOMERS, freq='D')
+        'customer_id': [f'C{i:04d}' for i in range(1, num_customers + 1)],
+        'first_name': [f'First{i}' for i in range(1, num_customers + 1)],
+        'last_name': [f'Last{i}' for i in range(1, num_customers + 1)],
+        'email': [f'customer{i}@example.com' for i in range(1, num_customers + 1)],
+        'phone': [f'+1{random.randint(1000000000, 9999999999)}' for _ in range(num_customers)],
+        'address': [f'{random.randint(1, 9999)} Main St' for _ in range(num_customers)],
+        'city': [f'City{i % 100 + 1}' for i in range(num_customers)],
+        'state': [f'State{i % 50 + 1}' for i in range(num_customers)],
+        'country': ['USA'] * num_customers,
+        'postal_code': [f'{random.randint(10000, 99999)}' for _ in range(num_customers)],
+        'customer_segment': np.random.choice(CUSTOMER_SEGMENTS, num_customers),
+        'created_date': pd.date_range(start='2019-01-01', periods=num_customers, freq='D'),
+        'modified_date': pd.date_range(start='2019-01-01', periods=num_customers, freq='D')
     }
     return pd.DataFrame(data)
 
-def generate_time_dimension() -> pd.DataFrame:
-    """Generate time dimension data."""
-    start_date = datetime(2023, 1, 1)
-    dates = [start_date + timedelta(days=i) for i in range(DAYS_OF_DATA)]
-    
-    data = {
-        'date_id': [d.strftime('%Y%m%d') for d in dates],
-        'full_date': dates,
-        'day_of_week': [d.strftime('%A') for d in dates],
-        'day_of_month': [d.day for d in dates],
-        'day_of_year': [d.timetuple().tm_yday for d in dates],
-        'week_of_year': [d.isocalendar()[1] for d in dates],
-        'month': [d.month for d in dates],
-        'quarter': [(d.month-1)//3 + 1 for d in dates],
-        'year': [d.year for d in dates],
-        'is_holiday': [False] * len(dates),
-        'holiday_name': [''] * len(dates)
-    }
-    
-    # Add some holidays
-    holidays = {
-        '2023-01-01': 'New Year\'s Day',
-        '2023-12-25': 'Christmas',
-        '2023-07-04': 'Independence Day',
-        '2023-11-24': 'Thanksgiving'
-    }
-    
-    for date_str, holiday in holidays.items():
-        idx = dates.index(datetime.strptime(date_str, '%Y-%m-%d'))
-        data['is_holiday'][idx] = True
-        data['holiday_name'][idx] = holiday
-    
-    return pd.DataFrame(data)
+def generate_time_dimension(start_date: str = TIME_DIMENSION_START,
+                            days: int = DAYS_OF_DATA) -> pd.DataFrame:
+    """Generate time dimension data for `days` days from `start_date`."""
+    end_date = pd.Timestamp(start_date) + pd.Timedelta(days=days - 1)
+    return generate_calendar(start_date, end_date)
 
-def generate_store_data() -> pd.DataFrame:
+def generate_store_data(num_stores: int = NUM_STORES) -> pd.DataFrame:
     """Generate store dimension data."""
     data = {
-        'store_id': [f'S{i:03d}' for i in range(1, NUM_STORES + 1)],
-        'store_name': [f'Store {i}' for i in range(1, NUM_STORES + 1)],
-        'address': [f'{random.randint(1, 9999)} Store St' for _ in range(NUM_STORES)],
-        'city': [f'City{i % 50 + 1}' for i in range(NUM_STORES)],
-        'state': [f'State{i % 20 + 1}' for i in range(NUM_STORES)],
-        'country': ['USA'] * NUM_STORES,
-        'postal_code': [f'{random.randint(10000, 99999)}' for _ in range(NUM_STORES)],
-        'manager': [f'Manager {i}' for i in range(1, NUM_STORES + 1)],
-        'opening_date': pd.date_range(start='2018-01-01', periods=NUM_STORES, freq='D'),
-        'store_type': np.random.choice(STORE_TYPES, NUM_STORES),
-        'store_size': np.random.uniform(1000, 10000, NUM_STORES).round(2),
-        'created_date': pd.date_range(start='2018-01-01', periods=NUM_STORES, freq='D'),
-        'modified_date': pd.date_range(start='2018-01-01', periods=NUM_STORES, freq='D')
+        'store_id': [f'S{i:03d}' for i in range(1, num_stores + 1)],
+        'store_name': [f'Store {i}' for i in range(1, num_stores + 1)],
+        'address': [f'{random.randint(1, 9999)} Store St' for _ in range(num_stores)],
+        'city': [f'City{i % 50 + 1}' for i in range(num_stores)],
+        'state': [f'State{i % 20 + 1}' for i in range(num_stores)],
+        'country': ['USA'] * num_stores,
+        'postal_code': [f'{random.randint(10000, 99999)}' for _ in range(num_stores)],
+        'manager': [f'Manager {i}' for i in range(1, num_stores + 1)],
+        'opening_date': pd.date_range(start='2018-01-01', periods=num_stores, freq='D'),
+        'store_type': np.random.choice(STORE_TYPES, num_stores),
+        'store_size': np.random.uniform(1000, 10000, num_stores).round(2),
+        'created_date': pd.date_range(start='2018-01-01', periods=num_stores, freq='D'),
+        'modified_date': pd.date_range(start='2018-01-01', periods=num_stores, freq='D')
     }
     return pd.DataFrame(data)
 
 def generate_sales_data(products: pd.DataFrame, customers: pd.DataFrame, 
-                       stores: pd.DataFrame, time_dim: pd.DataFrame) -> pd.DataFrame:
+                       stores: pd.DataFrame, time_dim: pd.DataFrame,
+                       num_transactions: int = NUM_TRANSACTIONS) -> pd.DataFrame:
     """Generate sales fact data."""
-    num_transactions = 100000
     sales_data = []
     
     for _ in range(num_transactions):
@@ -172,28 +151,52 @@ def generate_inventory_data(products: pd.DataFrame, stores: pd.DataFrame,
     
     return pd.DataFrame(inventory_data)
 
-def generate_all_data():
-    """Generate all data warehouse tables and save to CSV files."""
-    print("Generating dimension tables...")
-    products = generate_product_data()
-    customers = generate_customer_data()
-    time_dim = generate_time_dimension()
-    stores = generate_store_data()
+def scaled(count: int, scale: float) -> int:
+    """Scale a row count, keeping at least one row."""
+    return max(1, int(round(count * scale)))
+
+def generate_all_data(scale: float = 1.0, output_dir: str = RAW_DATA_DIR,
+                      workers: Optional[int] = None) -> Pipeline:
+    """
+    Generate all data warehouse tables and save to CSV files.
+    
+    Every table is generated and written by its own tasks (see
+    utils/pipeline.py): the dimensions at the same time, then sales and
+    inventory, while the files of the finished tables are written.
+    
+    Args:
+        scale: Scale factor applied to the product, customer, store and
+            transaction counts (1.0 is the default data set)
+        output_dir: Directory the CSV files are written to
+        workers: Tasks run at once (defaults to PIPELINE_CONFIG['workers'])
+    
+    Returns:
+        The pipeline that ran, with its task timings (see Pipeline.report)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tables: Dict[str, pd.DataFrame] = {}
+    pipeline = Pipeline('generate', workers)
     
-    print("Generating fact tables...")
-    sales = generate_sales_data(products, customers, stores, time_dim)
-    inventory = generate_inventory_data(products, stores, time_dim)
+    def add_table(name: str, function, dependencies: Sequence[str] = (), **kwargs) -> None:
+        """Add the tasks generating a table from the tables it depends on and writing it."""
+        def generate():
+            tables[name] = function(*(tables[dependency] for dependency in dependencies), **kwargs)
+        pipeline.add(name, generate, dependencies)
+        pipeline.add(f'write_{name}', lambda: tables[name].to_csv(
+            os.path.join(output_dir, f'{name}.csv'), index=False), [name])
     
-    # Save to CSV files
-    print("Saving data to CSV files...")
-    products.to_csv(os.path.join(RAW_DATA_DIR, 'products.csv'), index=False)
-    customers.to_csv(os.path.join(RAW_DATA_DIR, 'customers.csv'), index=False)
-    time_dim.to_csv(os.path.join(RAW_DATA_DIR, 'time_dimension.csv'), index=False)
-    stores.to_csv(os.path.join(RAW_DATA_DIR, 'stores.csv'), index=False)
-    sales.to_csv(os.path.join(RAW_DATA_DIR, 'sales.csv'), index=False)
-    inventory.to_csv(os.path.join(RAW_DATA_DIR, 'inventory.csv'), index=False)
+    add_table('products', generate_product_data, num_products=scaled(NUM_PRODUCTS, scale))
+    add_table('customers', generate_customer_data, num_customers=scaled(NUM_CUSTOMERS, scale))
+    add_table('time_dimension', generate_time_dimension)
+    add_table('stores', generate_store_data, num_stores=scaled(NUM_STORES, scale))
+    add_table('sales', generate_sales_data, ['products', 'customers', 'stores', 'time_dimension'],
+              num_transactions=scaled(NUM_TRANSACTIONS, scale))
+    add_table('inventory', generate_inventory_data, ['products', 'stores', 'time_dimension'])
     
-    print("Data generation complete!")
+    logger.info("Generating data...")
+    pipeline.run()
+    logger.info("Data generation complete!")
+    return pipeline
 
 if __name__ == '__main__':
     generate_all_data() 
\ No newline at end of file
@@ -2,16 +2,15 @@
 Data management utilities for handling large datasets efficiently.
 """
 import os
-import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
 from pathlib import Path
-import logging
 from typing import Optional, Union
+from utils.logging_utils import setup_logger
+from utils.memory_profile import track_memory
+from utils.schema import read_source, source_table
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+logger = setup_logger(__name__)
 
 class DataManager:
     """Manages data files and their conversions."""
@@ -51,8 +50,10 @@ class DataManager:
         logger.info(f"Creating sample of {n_rows} rows from {input_file}")
         
         # Read and sample data
-        df = pd.read_csv(input_path)
-        sample_df = df.sample(n=min(n_rows, len(df)), random_state=random_state)
+        with track_memory(f"sample {input_file}") as memory:
+            df = read_source(input_path, source_table(input_file))
+            memory.frame(df)
+            sample_df = df.sample(n=min(n_rows, len(df)), random_state=random_state)
         
         # Save sample
         sample_df.to_csv(output_path, index=False)
@@ -81,9 +82,11 @@ class DataManager:
         logger.info(f"Converting {input_file} to Parquet format")
         
         # Read CSV and convert to Parquet
-        df = pd.read_csv(input_path)
-        table = pa.Table.from_pandas(df)
-        pq.write_table(table, output_path)
+        with track_memory(f"convert {input_file}") as memory:
+            df = read_source(input_path, source_table(input_file))
+            memory.frame(df)
+            table = pa.Table.from_pandas(df)
+            pq.write_table(table, output_path)
         
         logger.info(f"Parquet file saved to {output_file}")
         return str(output_path)
@@ -1,9 +1,242 @@
 """
 Database setup script for the sales data warehouse.
 """
+from typing import Optional
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from config import DB_CONFIG, SCHEMA_CONFIG
+from utils.logging_utils import setup_logger
+from utils.pipeline import Pipeline
+
+logger = setup_logger(__name__)
+
+# Staging tables mirror the structure of the source files, except that
+# dimension staging carries a row hash and fact staging holds dimension
+# surrogate keys, both computed during the load
+STAGING_TABLES = {
+    'stg_products': """
+        product_id VARCHAR(10),
+        product_name VARCHAR(100),
+        category VARCHAR(50),
+        subcategory VARCHAR(50),
+        brand VARCHAR(50),
+        unit_price DECIMAL(10,2),
+        cost DECIMAL(10,2),
+        created_date DATE,
+        modified_date DATE,
+        row_hash BIGINT
+    """,
+    'stg_customers': """
+        customer_id VARCHAR(10),
+        first_name VARCHAR(50),
+        last_name VARCHAR(50),
+        email VARCHAR(100),
+        phone VARCHAR(20),
+        address VARCHAR(100),
+        city VARCHAR(50),
+        state VARCHAR(50),
+        country VARCHAR(50),
+        postal_code VARCHAR(10),
+        customer_segment VARCHAR(20),
+        created_date DATE,
+        modified_date DATE,
+        row_hash BIGINT
+    """,
+    'stg_time_dimension': """
+        date_id VARCHAR(8),
+        full_date DATE,
+        day_of_week VARCHAR(10),
+        day_of_month INTEGER,
+        day_of_year INTEGER,
+        week_of_year INTEGER,
+        month INTEGER,
+        quarter INTEGER,
+        year INTEGER,
+        is_holiday BOOLEAN,
+        holiday_name VARCHAR(50),
+        fiscal_year INTEGER,
+        fiscal_quarter INTEGER
+    """,
+    'stg_stores': """
+        store_id VARCHAR(10),
+        store_name VARCHAR(100),
+        address VARCHAR(100),
+        city VARCHAR(50),
+        state VARCHAR(50),
+        country VARCHAR(50),
+        postal_code VARCHAR(10),
+        manager VARCHAR(100),
+        opening_date DATE,
+        store_type VARCHAR(20),
+        store_size DECIMAL(10,2),
+        created_date DATE,
+        modified_date DATE,
+        row_hash BIGINT
+    """,
+    'stg_sales': """
+        sale_id VARCHAR(10),
+        date_key INTEGER,
+        product_key INTEGER,
+        customer_key INTEGER,
+        store_key INTEGER,
+        quantity INTEGER,
+        unit_price DECIMAL(10,2),
+        total_amount DECIMAL(10,2),
+        discount_amount DECIMAL(10,2),
+        net_amount DECIMAL(10,2),
+        payment_method VARCHAR(20),
+        transaction_time TIMESTAMP
+    """,
+    'stg_inventory': """
+        inventory_id VARCHAR(10),
+        date_key INTEGER,
+        product_key INTEGER,
+        store_key INTEGER,
+        beginning_quantity INTEGER,
+        ending_quantity INTEGER,
+        units_received INTEGER,
+        units_sold INTEGER,
+        units_damaged INTEGER,
+        reorder_point INTEGER,
+        reorder_quantity INTEGER
+    """
+}
+
+# Columns of the dimension and fact tables the staging tables are merged
+# into; constraints referencing other tables are added when the tables are
+# created. Source columns NOT NULL here are required by validation (see
+# utils/schema.py).
+WAREHOUSE_TABLES = {
+    'dim_product': """
+        product_key SERIAL PRIMARY KEY,
+        product_id VARCHAR(10) NOT NULL,
+        product_name VARCHAR(100) NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        subcategory VARCHAR(50) NOT NULL,
+        brand VARCHAR(50) NOT NULL,
+        unit_price DECIMAL(10,2) NOT NULL,
+        cost DECIMAL(10,2) NOT NULL,
+        created_date DATE NOT NULL,
+        modified_date DATE NOT NULL,
+        row_hash BIGINT NOT NULL,
+        valid_from DATE NOT NULL,
+        valid_to DATE,
+        is_current BOOLEAN NOT NULL DEFAULT TRUE
+    """,
+    'dim_customer': """
+        customer_key SERIAL PRIMARY KEY,
+        customer_id VARCHAR(10) NOT NULL,
+        first_name VARCHAR(50) NOT NULL,
+        last_name VARCHAR(50) NOT NULL,
+        email VARCHAR(100) NOT NULL,
+        phone VARCHAR(20),
+        address VARCHAR(100) NOT NULL,
+        city VARCHAR(50) NOT NULL,
+        state VARCHAR(50) NOT NULL,
+        country VARCHAR(50) NOT NULL,
+        postal_code VARCHAR(10) NOT NULL,
+        customer_segment VARCHAR(20) NOT NULL,
+        created_date DATE NOT NULL,
+        modified_date DATE NOT NULL,
+        row_hash BIGINT NOT NULL,
+        valid_from DATE NOT NULL,
+        valid_to DATE,
+        is_current BOOLEAN NOT NULL DEFAULT TRUE
+    """,
+    'dim_time': """
+        date_key INTEGER PRIMARY KEY,
+        date_id VARCHAR(8) NOT NULL UNIQUE,
+        full_date DATE NOT NULL,
+        day_of_week VARCHAR(10) NOT NULL,
+        day_of_month INTEGER NOT NULL,
+        day_of_year INTEGER NOT NULL,
+        week_of_year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        quarter INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        is_holiday BOOLEAN NOT NULL,
+        holiday_name VARCHAR(50),
+        fiscal_year INTEGER,
+        fiscal_quarter INTEGER
+    """,
+    'dim_store': """
+        store_key SERIAL PRIMARY KEY,
+        store_id VARCHAR(10) NOT NULL,
+        store_name VARCHAR(100) NOT NULL,
+        address VARCHAR(100) NOT NULL,
+        city VARCHAR(50) NOT NULL,
+        state VARCHAR(50) NOT NULL,
+        country VARCHAR(50) NOT NULL,
+        postal_code VARCHAR(10) NOT NULL,
+        manager VARCHAR(100) NOT NULL,
+        opening_date DATE NOT NULL,
+        store_type VARCHAR(20) NOT NULL,
+        store_size DECIMAL(10,2) NOT NULL,
+        created_date DATE NOT NULL,
+        modified_date DATE NOT NULL,
+        row_hash BIGINT NOT NULL,
+        valid_from DATE NOT NULL,
+        valid_to DATE,
+        is_current BOOLEAN NOT NULL DEFAULT TRUE
+    """,
+    'fact_sales': """
+        sale_id VARCHAR(10) PRIMARY KEY,
+        date_key INTEGER NOT NULL,
+        product_key INTEGER NOT NULL,
+        customer_key INTEGER NOT NULL,
+        store_key INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price DECIMAL(10,2) NOT NULL,
+        total_amount DECIMAL(10,2) NOT NULL,
+        discount_amount DECIMAL(10,2) NOT NULL,
+        net_amount DECIMAL(10,2) NOT NULL,
+        payment_method VARCHAR(20) NOT NULL,
+        transaction_time TIMESTAMP NOT NULL
+    """,
+    'fact_inventory': """
+        inventory_id VARCHAR(10) PRIMARY KEY,
+        date_key INTEGER NOT NULL,
+        product_key INTEGER NOT NULL,
+        store_key INTEGER NOT NULL,
+        beginning_quantity INTEGER NOT NULL,
+        ending_quantity INTEGER NOT NULL,
+        units_received INTEGER NOT NULL,
+        units_sold INTEGER NOT NULL,
+        units_damaged INTEGER NOT NULL,
+        reorder_point INTEGER NOT NULL,
+        reorder_quantity INTEGER NOT NULL
+    """
+}
+
+# Fact tables in the compact layout (SCHEMA_CONFIG['compact_facts']): amounts
+# in integer cents, quantities as SMALLINT and the widest columns first
+COMPACT_FACT_TABLES = {
+    'fact_sales': """
+        transaction_time TIMESTAMP NOT NULL,
+        date_key INTEGER NOT NULL,
+        product_key INTEGER NOT NULL,
+        customer_key INTEGER NOT NULL,
+        store_key INTEGER NOT NULL,
+        unit_price_cents INTEGER NOT NULL,
+        discount_cents INTEGER NOT NULL,
+        quantity SMALLINT NOT NULL,
+        sale_id VARCHAR(10) PRIMARY KEY,
+        payment_method VARCHAR(20) NOT NULL
+    """,
+    'fact_inventory': """
+        date_key INTEGER NOT NULL,
+        product_key INTEGER NOT NULL,
+        store_key INTEGER NOT NULL,
+        beginning_quantity SMALLINT NOT NULL,
+        ending_quantity SMALLINT NOT NULL,
+        units_received SMALLINT NOT NULL,
+        units_sold SMALLINT NOT NULL,
+        units_damaged SMALLINT NOT NULL,
+        reorder_point SMALLINT NOT NULL,
+        reorder_quantity SMALLINT NOT NULL,
+        inventory_id VARCHAR(10) PRIMARY KEY
+    """
+}
 
 def create_database():
     """Create the database if it doesn't exist."""
@@ -22,9 +255,9 @@ def create_database():
     
     if not exists:
         cur.execute(f"CREATE DATABASE {DB_CONFIG['dbname']}")
-        print(f"Database {DB_CONFIG['dbname']} created successfully.")
+        logger.info(f"Database {DB_CONFIG['dbname']} created successfully.")
     else:
-        print(f"Database {DB_CONFIG['dbname']} already exists.")
+        logger.info(f"Database {DB_CONFIG['dbname']} already exists.")
     
     cur.close()
     conn.close()
@@ -48,251 +281,442 @@ def create_schemas():
     conn.commit()
     cur.close()
     conn.close()
-    print("Schemas created successfully.")
+    logger.info("Schemas created successfully.")
 
 def create_dimension_tables():
     """Create dimension tables in the data warehouse."""
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
     
+    # Product, customer and store dimensions are Type 2 slowly changing
+    # dimensions: each change adds a version and at most one is current
+    
     # Product Dimension
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['dim_schema']}.dim_product (
-        product_id VARCHAR(10) PRIMARY KEY,
-        product_name VARCHAR(100) NOT NULL,
-        category VARCHAR(50) NOT NULL,
-        subcategory VARCHAR(50) NOT NULL,
-        brand VARCHAR(50) NOT NULL,
-        unit_price DECIMAL(10,2) NOT NULL,
-        cost DECIMAL(10,2) NOT NULL,
-        created_date DATE NOT NULL,
-        modified_date DATE NOT NULL
+        {WAREHOUSE_TABLES['dim_product']}
     )
     """)
     
     # Customer Dimension
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['dim_schema']}.dim_customer (
-        customer_id VARCHAR(10) PRIMARY KEY,
-        first_name VARCHAR(50) NOT NULL,
-        last_name VARCHAR(50) NOT NULL,
-        email VARCHAR(100) NOT NULL,
-        phone VARCHAR(20),
-        address VARCHAR(100) NOT NULL,
-        city VARCHAR(50) NOT NULL,
-        state VARCHAR(50) NOT NULL,
-        country VARCHAR(50) NOT NULL,
-        postal_code VARCHAR(10) NOT NULL,
-        customer_segment VARCHAR(20) NOT NULL,
-        created_date DATE NOT NULL,
-        modified_date DATE NOT NULL
+        {WAREHOUSE_TABLES['dim_customer']}
     )
     """)
     
-    # Time Dimension
+    # Time Dimension (date_key is the date as a YYYYMMDD integer)
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['dim_schema']}.dim_time (
-        date_id VARCHAR(8) PRIMARY KEY,
-        full_date DATE NOT NULL,
-        day_of_week VARCHAR(10) NOT NULL,
-        day_of_month INTEGER NOT NULL,
-        day_of_year INTEGER NOT NULL,
-        week_of_year INTEGER NOT NULL,
-        month INTEGER NOT NULL,
-        quarter INTEGER NOT NULL,
-        year INTEGER NOT NULL,
-        is_holiday BOOLEAN NOT NULL,
-        holiday_name VARCHAR(50)
+        {WAREHOUSE_TABLES['dim_time']}
     )
     """)
     
+    # Fiscal periods were added later; upgrade existing time dimensions
+    cur.execute(f"""
+    ALTER TABLE {SCHEMA_CONFIG['dim_schema']}.dim_time
+        ADD COLUMN IF NOT EXISTS fiscal_year INTEGER,
+        ADD COLUMN IF NOT EXISTS fiscal_quarter INTEGER
+    """)
+    
     # Store Dimension
     cur.execute(f"""
     CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['dim_schema']}.dim_store (
-        store_id VARCHAR(10) PRIMARY KEY,
-        store_name VARCHAR(100) NOT NULL,
-        address VARCHAR(100) NOT NULL,
-        city VARCHAR(50) NOT NULL,
-        state VARCHAR(50) NOT NULL,
-        country VARCHAR(50) NOT NULL,
-        postal_code VARCHAR(10) NOT NULL,
-        manager VARCHAR(100) NOT NULL,
-        opening_date DATE NOT NULL,
-        store_type VARCHAR(20) NOT NULL,
-        store_size DECIMAL(10,2) NOT NULL,
-        created_date DATE NOT NULL,
-        modified_date DATE NOT NULL
+        {WAREHOUSE_TABLES['dim_store']}
     )
     """)
     
+    # One current version per natural key; also serves current-row lookups
+    for dimension, natural_key in [('dim_product', 'product_id'),
+                                   ('dim_customer', 'customer_id'),
+                                   ('dim_store', 'store_id')]:
+        cur.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_{dimension}_current
+        ON {SCHEMA_CONFIG['dim_schema']}.{dimension} ({natural_key})
+        WHERE is_current
+        """)
+    
     conn.commit()
     cur.close()
     conn.close()
-    print("Dimension tables created successfully.")
+    logger.info("Dimension tables created successfully.")
 
 def create_fact_tables():
-    """Create fact tables in the data warehouse."""
+    """
+    Create fact tables in the data warehouse.
+    
+    With SCHEMA_CONFIG['compact_facts'] the facts use the compact layout:
+    amounts are stored as integer cents, quantities as SMALLINT, derivable
+    amounts (total and net) are not stored, and columns are ordered widest
+    first to avoid alignment padding. Queries read the facts through the
+    views created by create_fact_views, which look the same in both layouts.
+    """
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
     
-    # Sales Fact
+    dimension_keys = f"""
+        FOREIGN KEY (date_key) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_time(date_key),
+        FOREIGN KEY (product_key) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_product(product_key),
+        FOREIGN KEY (store_key) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_store(store_key)"""
+    
+    if SCHEMA_CONFIG['compact_facts']:
+        # Sales Fact: total = quantity * unit price and net = total - discount
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.fact_sales (
+            {COMPACT_FACT_TABLES['fact_sales']},
+            FOREIGN KEY (customer_key) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_customer(customer_key),
+            {dimension_keys}
+        )
+        """)
+        
+        # Inventory Fact
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.fact_inventory (
+            {COMPACT_FACT_TABLES['fact_inventory']},
+            {dimension_keys}
+        )
+        """)
+    else:
+        # Sales Fact (dimensions are referenced by integer surrogate keys)
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.fact_sales (
+            {WAREHOUSE_TABLES['fact_sales']},
+            FOREIGN KEY (customer_key) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_customer(customer_key),
+            {dimension_keys}
+        )
+        """)
+        
+        # Inventory Fact
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.fact_inventory (
+            {WAREHOUSE_TABLES['fact_inventory']},
+            {dimension_keys}
+        )
+        """)
+    
+    # Sales by basket (a customer's purchases at one store on one day) in
+    # date order: serves date range filters and, with the product, the
+    # basket queries from the index alone
     cur.execute(f"""
-    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.fact_sales (
-        sale_id VARCHAR(10) PRIMARY KEY,
-        date_id VARCHAR(8) NOT NULL,
-        product_id VARCHAR(10) NOT NULL,
-        customer_id VARCHAR(10) NOT NULL,
-        store_id VARCHAR(10) NOT NULL,
-        quantity INTEGER NOT NULL,
-        unit_price DECIMAL(10,2) NOT NULL,
-        total_amount DECIMAL(10,2) NOT NULL,
-        discount_amount DECIMAL(10,2) NOT NULL,
-        net_amount DECIMAL(10,2) NOT NULL,
-        payment_method VARCHAR(20) NOT NULL,
-        transaction_time TIMESTAMP NOT NULL,
-        FOREIGN KEY (date_id) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_time(date_id),
-        FOREIGN KEY (product_id) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_product(product_id),
-        FOREIGN KEY (customer_id) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_customer(customer_id),
-        FOREIGN KEY (store_id) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_store(store_id)
+    CREATE INDEX IF NOT EXISTS ix_fact_sales_basket
+    ON {SCHEMA_CONFIG['fact_schema']}.fact_sales (date_key, customer_key, store_key)
+    INCLUDE (product_key)
+    """)
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("Fact tables created successfully.")
+    create_fact_views()
+
+def uses_compact_facts(cur) -> bool:
+    """Check whether the existing sales fact table has the compact layout."""
+    cur.execute("""
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = 'fact_sales' AND column_name = 'unit_price_cents'
     )
+    """, (SCHEMA_CONFIG['fact_schema'],))
+    return cur.fetchone()[0]
+
+def create_fact_views():
+    """
+    Create the views the analytics queries read the facts through.
+    
+    facts.v_sales has the columns of the standard sales fact table in either
+    layout; for compact facts it derives the amounts from the stored cents.
+    facts.sample_sales(percent) returns the same columns for a random sample.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    if uses_compact_facts(cur):
+        columns = """
+            sale_id, date_key, product_key, customer_key, store_key,
+            quantity::INTEGER AS quantity,
+            (unit_price_cents / 100.0)::DECIMAL(10,2) AS unit_price,
+            (quantity * unit_price_cents / 100.0)::DECIMAL(10,2) AS total_amount,
+            (discount_cents / 100.0)::DECIMAL(10,2) AS discount_amount,
+            ((quantity * unit_price_cents - discount_cents) / 100.0)::DECIMAL(10,2) AS net_amount,
+            payment_method, transaction_time"""
+    else:
+        columns = """
+            sale_id, date_key, product_key, customer_key, store_key, quantity,
+            unit_price, total_amount, discount_amount, net_amount,
+            payment_method, transaction_time"""
+    
+    cur.execute(f"DROP FUNCTION IF EXISTS {SCHEMA_CONFIG['fact_schema']}.sample_sales(FLOAT)")
+    cur.execute(f"DROP VIEW IF EXISTS {SCHEMA_CONFIG['fact_schema']}.v_sales")
+    cur.execute(f"""
+    CREATE VIEW {SCHEMA_CONFIG['fact_schema']}.v_sales AS
+    SELECT {columns}
+    FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales
     """)
     
-    # Inventory Fact
+    # Bernoulli sample of v_sales for approximate queries (percent of rows)
     cur.execute(f"""
-    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.fact_inventory (
-        inventory_id VARCHAR(10) PRIMARY KEY,
-        date_id VARCHAR(8) NOT NULL,
-        product_id VARCHAR(10) NOT NULL,
-        store_id VARCHAR(10) NOT NULL,
-        beginning_quantity INTEGER NOT NULL,
-        ending_quantity INTEGER NOT NULL,
-        units_received INTEGER NOT NULL,
-        units_sold INTEGER NOT NULL,
-        units_damaged INTEGER NOT NULL,
-        reorder_point INTEGER NOT NULL,
-        reorder_quantity INTEGER NOT NULL,
-        FOREIGN KEY (date_id) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_time(date_id),
-        FOREIGN KEY (product_id) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_product(product_id),
-        FOREIGN KEY (store_id) REFERENCES {SCHEMA_CONFIG['dim_schema']}.dim_store(store_id)
-    )
+    CREATE FUNCTION {SCHEMA_CONFIG['fact_schema']}.sample_sales(percent FLOAT)
+    RETURNS SETOF {SCHEMA_CONFIG['fact_schema']}.v_sales
+    LANGUAGE sql STABLE AS $$
+        SELECT {columns}
+        FROM {SCHEMA_CONFIG['fact_schema']}.fact_sales TABLESAMPLE BERNOULLI (percent)
+    $$
     """)
     
     conn.commit()
     cur.close()
     conn.close()
-    print("Fact tables created successfully.")
+    logger.info("Fact views created successfully.")
 
 def create_staging_tables():
-    """Create staging tables for ETL process."""
+    """
+    Create staging tables for ETL process.
+    
+    Staging tables are UNLOGGED: their contents are reloaded from the source
+    files on every run, so they skip WAL and are not replicated. They are
+    emptied after a crash.
+    """
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
     
-    # Staging tables mirror the structure of the source files
-    staging_tables = {
-        'stg_products': """
-            product_id VARCHAR(10),
-            product_name VARCHAR(100),
-            category VARCHAR(50),
-            subcategory VARCHAR(50),
-            brand VARCHAR(50),
-            unit_price DECIMAL(10,2),
-            cost DECIMAL(10,2),
-            created_date DATE,
-            modified_date DATE
-        """,
-        'stg_customers': """
-            customer_id VARCHAR(10),
-            first_name VARCHAR(50),
-            last_name VARCHAR(50),
-            email VARCHAR(100),
-            phone VARCHAR(20),
-            address VARCHAR(100),
-            city VARCHAR(50),
-            state VARCHAR(50),
-            country VARCHAR(50),
-            postal_code VARCHAR(10),
-            customer_segment VARCHAR(20),
-            created_date DATE,
-            modified_date DATE
-        """,
-        'stg_time_dimension': """
-            date_id VARCHAR(8),
-            full_date DATE,
-            day_of_week VARCHAR(10),
-            day_of_month INTEGER,
-            day_of_year INTEGER,
-            week_of_year INTEGER,
-            month INTEGER,
-            quarter INTEGER,
-            year INTEGER,
-            is_holiday BOOLEAN,
-            holiday_name VARCHAR(50)
-        """,
-        'stg_stores': """
-            store_id VARCHAR(10),
-            store_name VARCHAR(100),
-            address VARCHAR(100),
-            city VARCHAR(50),
-            state VARCHAR(50),
-            country VARCHAR(50),
-            postal_code VARCHAR(10),
-            manager VARCHAR(100),
-            opening_date DATE,
-            store_type VARCHAR(20),
-            store_size DECIMAL(10,2),
-            created_date DATE,
-            modified_date DATE
-        """,
-        'stg_sales': """
-            sale_id VARCHAR(10),
-            date_id VARCHAR(8),
-            product_id VARCHAR(10),
-            customer_id VARCHAR(10),
-            store_id VARCHAR(10),
-            quantity INTEGER,
-            unit_price DECIMAL(10,2),
-            total_amount DECIMAL(10,2),
-            discount_amount DECIMAL(10,2),
-            net_amount DECIMAL(10,2),
-            payment_method VARCHAR(20),
-            transaction_time TIMESTAMP
-        """,
-        'stg_inventory': """
-            inventory_id VARCHAR(10),
-            date_id VARCHAR(8),
-            product_id VARCHAR(10),
-            store_id VARCHAR(10),
-            beginning_quantity INTEGER,
-            ending_quantity INTEGER,
-            units_received INTEGER,
-            units_sold INTEGER,
-            units_damaged INTEGER,
-            reorder_point INTEGER,
-            reorder_quantity INTEGER
-        """
-    }
-    
-    for table_name, columns in staging_tables.items():
+    for table_name, columns in STAGING_TABLES.items():
         cur.execute(f"""
-        CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['staging_schema']}.{table_name} (
+        CREATE UNLOGGED TABLE IF NOT EXISTS {SCHEMA_CONFIG['staging_schema']}.{table_name} (
             {columns}
         )
         """)
     
+    # Convert staging tables created as logged tables by earlier versions
+    cur.execute("""
+    SELECT c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s AND c.relname = ANY(%s) AND c.relpersistence = 'p'
+    """, (SCHEMA_CONFIG['staging_schema'], list(STAGING_TABLES)))
+    for (table_name,) in cur.fetchall():
+        cur.execute(f"ALTER TABLE {SCHEMA_CONFIG['staging_schema']}.{table_name} SET UNLOGGED")
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("Staging tables created successfully.")
+
+# Staging table of the micro-batch sales ingestion (see utils/streaming.py),
+# kept apart from stg_sales so batch runs and the stream do not clear each
+# other's rows
+STREAM_STAGING_TABLE = 'stg_sales_stream'
+
+def create_stream_tables():
+    """Create the UNLOGGED staging table micro-batches of sales are copied into."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    cur.execute(f"""
+    CREATE UNLOGGED TABLE IF NOT EXISTS {SCHEMA_CONFIG['staging_schema']}.{STREAM_STAGING_TABLE} (
+        {STAGING_TABLES['stg_sales']}
+    )
+    """)
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("Stream staging table created successfully.")
+
+def drop_staging_tables():
+    """Drop the staging tables once their data has been merged."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    for table_name in STAGING_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {SCHEMA_CONFIG['staging_schema']}.{table_name}")
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("Staging tables dropped.")
+
+def create_etl_tables():
+    """Create the ETL run ledger used to checkpoint and resume runs."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    # One row per ETL run; runs left 'running' by a failure are resumed
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['schema_name']}.etl_runs (
+        run_id SERIAL PRIMARY KEY,
+        status VARCHAR(10) NOT NULL DEFAULT 'running',
+        started_at TIMESTAMP NOT NULL DEFAULT now(),
+        finished_at TIMESTAMP
+    )
+    """)
+    
+    # One row per stage of a run: a staged source file or a merge step
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['schema_name']}.etl_run_ledger (
+        run_id INTEGER NOT NULL REFERENCES {SCHEMA_CONFIG['schema_name']}.etl_runs(run_id),
+        stage VARCHAR(50) NOT NULL,
+        file_name VARCHAR(255),
+        checksum CHAR(64),
+        rows_read BIGINT NOT NULL DEFAULT 0,
+        rows_loaded BIGINT NOT NULL DEFAULT 0,
+        status VARCHAR(10) NOT NULL,
+        started_at TIMESTAMP NOT NULL DEFAULT now(),
+        finished_at TIMESTAMP,
+        PRIMARY KEY (run_id, stage)
+    )
+    """)
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("ETL ledger tables created successfully.")
+
+def create_sketch_tables():
+    """Create the table of distinct count sketches maintained by the ETL."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    # One HyperLogLog sketch per grouping and member (see utils/sketches.py)
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['schema_name']}.sketches (
+        sketch_name VARCHAR(50) NOT NULL,
+        member VARCHAR(100) NOT NULL,
+        precision SMALLINT NOT NULL,
+        registers BYTEA NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (sketch_name, member)
+    )
+    """)
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("Sketch tables created successfully.")
+
+def create_cube_tables():
+    """Create the pre-aggregated sales cube rebuilt by the ETL (see utils/cube.py)."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    # One row per cell of GROUP BY CUBE(date, store, category, segment);
+    # grouping_id has a bit set for every dimension rolled up in the cell
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.sales_cube (
+        grouping_id SMALLINT NOT NULL,
+        date_key INTEGER,
+        store_id VARCHAR(10),
+        category VARCHAR(50),
+        customer_segment VARCHAR(20),
+        transactions BIGINT NOT NULL,
+        quantity BIGINT NOT NULL,
+        total_amount DECIMAL(14,2) NOT NULL,
+        discount_amount DECIMAL(14,2) NOT NULL,
+        net_amount DECIMAL(14,2) NOT NULL
+    )
+    """)
+    
+    # Rolled-up dimensions are NULL, so the cell key needs COALESCE to be unique
+    cur.execute(f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_sales_cube_cell
+    ON {SCHEMA_CONFIG['fact_schema']}.sales_cube (
+        grouping_id, COALESCE(date_key, 0), COALESCE(store_id, ''),
+        COALESCE(category, ''), COALESCE(customer_segment, '')
+    )
+    """)
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("Cube tables created successfully.")
+
+def create_customer_activity_tables():
+    """Create the monthly customer activity rebuilt by the ETL (see utils/customer_activity.py)."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    # One row per customer and month (month_key is YYYYMM) with sales
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.customer_activity (
+        customer_id VARCHAR(10) NOT NULL,
+        month_key INTEGER NOT NULL,
+        first_date_key INTEGER NOT NULL,
+        last_date_key INTEGER NOT NULL,
+        transactions BIGINT NOT NULL,
+        net_amount DECIMAL(14,2) NOT NULL,
+        PRIMARY KEY (customer_id, month_key)
+    )
+    """)
+    
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info("Customer activity tables created successfully.")
+
+def create_inventory_tables():
+    """Create the current stock table maintained by the ETL (see utils/inventory.py)."""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    # Latest inventory snapshot per store and product (natural keys, so new
+    # dimension versions update the same row)
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SCHEMA_CONFIG['fact_schema']}.current_stock (
+        store_id VARCHAR(10) NOT NULL,
+        product_id VARCHAR(10) NOT NULL,
+        date_key INTEGER NOT NULL,
+        inventory_id VARCHAR(10) NOT NULL,
+        ending_quantity INTEGER NOT NULL,
+        reorder_point INTEGER NOT NULL,
+        reorder_quantity INTEGER NOT NULL,
+        PRIMARY KEY (store_id, product_id)
+    )
+    """)
+    
+    # Low stock alerts: only the rows below their reorder point are indexed,
+    # so the alert queries read a small index instead of the table
+    cur.execute(f"""
+    CREATE INDEX IF NOT EXISTS ix_current_stock_low
+    ON {SCHEMA_CONFIG['fact_schema']}.current_stock (store_id, product_id)
+    INCLUDE (ending_quantity, reorder_point, reorder_quantity, date_key)
+    WHERE ending_quantity < reorder_point
+    """)
+    
     conn.commit()
     cur.close()
     conn.close()
-    print("Staging tables created successfully.")
+    logger.info("Inventory tables created successfully.")
 
-def setup_database():
-    """Set up the complete database structure."""
-    print("Setting up database...")
-    create_database()
-    create_schemas()
-    create_dimension_tables()
-    create_fact_tables()
-    create_staging_tables()
-    print("Database setup completed successfully!")
+def setup_database(workers: Optional[int] = None) -> Pipeline:
+    """
+    Set up the complete database structure.
+    
+    Tables are created by the tasks of a pipeline (see utils/pipeline.py):
+    once the schemas exist, every group of tables is created at the same
+    time, except the fact tables, which refer to the dimension tables.
+    
+    Args:
+        workers: Tasks run at once (defaults to PIPELINE_CONFIG['workers'])
+    
+    Returns:
+        The pipeline that ran, with its task timings (see Pipeline.report)
+    """
+    logger.info("Setting up database...")
+    pipeline = Pipeline('setup', workers)
+    pipeline.add('database', create_database)
+    pipeline.add('schemas', create_schemas, ['database'])
+    pipeline.add('dimension_tables', create_dimension_tables, ['schemas'])
+    pipeline.add('fact_tables', create_fact_tables, ['dimension_tables'])
+    for name, create in [('staging_tables', create_staging_tables),
+                         ('etl_tables', create_etl_tables),
+                         ('sketch_tables', create_sketch_tables),
+                         ('cube_tables', create_cube_tables),
+                         ('customer_activity_tables', create_customer_activity_tables),
+                         ('inventory_tables', create_inventory_tables),
+                         ('stream_tables', create_stream_tables)]:
+        pipeline.add(name, create, ['schemas'])
+    pipeline.run()
+    logger.info("Database setup completed successfully!")
+    return pipeline
 
 if __name__ == '__main__':
     setup_database() 
\ No newline at end of file
@@ -1,15 +1,28 @@
 """
 Database utilities for the project.
 """
+import itertools
+import threading
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any, Optional
+from psycopg2.pool import PoolError
+from typing import Dict, Any, List, Optional, Tuple
 from contextlib import contextmanager
-from config import DB_CONFIG
+from config import DB_CONFIG, READ_REPLICAS, REPLICA_CONFIG, READ_POOL_CONFIG
 from utils.logging_utils import setup_logger
 
 logger = setup_logger(__name__)
 
+# Round-robin position over READ_REPLICAS and replicas left out until a given time
+_replica_turn = itertools.count()
+_replica_lock = threading.Lock()
+_skipped_replicas: Dict[Tuple[str, str], float] = {}
+
+# Pool serving get_read_db_connection (see set_read_pool)
+_read_pool: Optional['ReadConnectionPool'] = None
+_read_pool_lock = threading.Lock()
+
 @contextmanager
 def get_db_connection():
     """
@@ -29,6 +42,271 @@ def get_db_connection():
         if conn is not None:
             conn.close()
 
+def replication_lag(conn) -> float:
+    """
+    Return how many seconds a server is behind its primary.
+    
+    A standby streaming from its primary that has replayed everything it
+    received is not behind, even if the primary has been idle since its
+    last transaction. A standby without a streaming WAL receiver (it lost
+    its primary) falls further behind with every write and counts as
+    infinitely behind. A server that is not a standby has no lag.
+    """
+    with conn.cursor() as cur:
+        # pg_stat_wal_receiver hides the status from roles without
+        # pg_read_all_stats; its row alone then shows the receiver is running
+        cur.execute("""
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN NOT EXISTS (
+                SELECT 1 FROM pg_stat_wal_receiver
+                WHERE COALESCE(status, 'streaming') = 'streaming'
+            ) THEN 'Infinity'
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END::FLOAT
+        """)
+        lag = float(cur.fetchone()[0])
+    conn.rollback()
+    return lag
+
+def _connect_replica(replica: Dict[str, str]):
+    """Connect to a replica if it is reachable and not lagging, else return None."""
+    endpoint = (replica['host'], str(replica['port']))
+    with _replica_lock:
+        if _skipped_replicas.get(endpoint, 0) > time.monotonic():
+            return None
+    try:
+        conn = psycopg2.connect(**{**DB_CONFIG, **replica},
+                                connect_timeout=REPLICA_CONFIG['connect_timeout'])
+    except psycopg2.OperationalError as e:
+        logger.warning(f"Read replica {endpoint[0]}:{endpoint[1]} unreachable: {e}")
+        conn = None
+    else:
+        try:
+            lag = replication_lag(conn)
+        except psycopg2.Error as e:
+            logger.warning(f"Read replica {endpoint[0]}:{endpoint[1]} lag check failed: {e}")
+            lag = None
+        else:
+            if lag == float('inf'):
+                logger.warning(f"Read replica {endpoint[0]}:{endpoint[1]} is not streaming "
+                               f"from its primary")
+            elif lag > REPLICA_CONFIG['max_lag_seconds']:
+                logger.warning(f"Read replica {endpoint[0]}:{endpoint[1]} is {lag:.1f}s behind")
+        if lag is None or lag > REPLICA_CONFIG['max_lag_seconds']:
+            conn.close()
+            conn = None
+    if conn is None:
+        with _replica_lock:
+            _skipped_replicas[endpoint] = time.monotonic() + REPLICA_CONFIG['retry_after_seconds']
+    return conn
+
+def get_read_connection():
+    """
+    Connect to a server for read-only queries.
+    
+    Read replicas from READ_REPLICAS are tried in round-robin order; replicas
+    that are unreachable or more than REPLICA_CONFIG['max_lag_seconds']
+    behind are left out for a while. Without a usable replica the primary
+    is used. The connection is read-only.
+    
+    Returns:
+        psycopg2.connection: Database connection
+    """
+    conn = None
+    if READ_REPLICAS:
+        with _replica_lock:
+            start = next(_replica_turn) % len(READ_REPLICAS)
+        for offset in range(len(READ_REPLICAS)):
+            conn = _connect_replica(READ_REPLICAS[(start + offset) % len(READ_REPLICAS)])
+            if conn is not None:
+                break
+        else:
+            logger.warning("No read replica available, reading from the primary")
+    if conn is None:
+        conn = psycopg2.connect(**DB_CONFIG)
+    conn.set_session(readonly=True)
+    return conn
+
+class ReadConnectionPool:
+    """
+    A bounded pool of read-only connections that records how busy it is.
+    
+    At most `size` connections are open at once. A caller that finds every
+    connection in use waits for one up to `timeout` seconds, then gets a
+    PoolError. The statistics show whether the pool limits a workload: the
+    share of borrows that had to wait, the time spent waiting and the most
+    connections in use at once.
+    
+    A replica connection idle for longer than
+    REPLICA_CONFIG['retry_after_seconds'] has its lag checked again before
+    it is handed out, and is replaced if the replica fell behind.
+    """
+
+    def __init__(self, size: int, timeout: Optional[float] = None):
+        """
+        Create an empty pool; connections are opened when first needed.
+        
+        Args:
+            size: Maximum number of open connections
+            timeout: Seconds to wait for a free connection (None waits forever)
+        """
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1, got {size}")
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # Idle connections with the time they were returned
+        self._idle: List[Tuple[Any, float]] = []
+        self._in_use = 0
+        self._closed = False
+        self._stats = {'borrowed': 0, 'waited': 0, 'timeouts': 0, 'opened': 0, 'stale': 0,
+                       'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'peak_in_use': 0}
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the with block.
+        
+        The connection's transaction is rolled back when it is returned;
+        connections that were closed meanwhile, or whose replica is now too
+        far behind, are replaced.
+        
+        Yields:
+            psycopg2.connection: Read-only database connection
+        """
+        started = time.perf_counter()
+        waited = not self._slots.acquire(blocking=False)
+        if waited and not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['waited'] += 1
+                self._stats['timeouts'] += 1
+            raise PoolError(f"No pooled connection free within {self.timeout}s "
+                            f"({self.size} in use)")
+        wait = time.perf_counter() - started
+        with self._lock:
+            conn, idle_since = self._idle.pop() if self._idle else (None, None)
+            self._in_use += 1
+            self._stats['borrowed'] += 1
+            self._stats['waited'] += int(waited)
+            self._stats['wait_seconds'] += wait
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait)
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._in_use)
+        try:
+            if (conn is not None and not conn.closed and READ_REPLICAS
+                    and time.monotonic() - idle_since > REPLICA_CONFIG['retry_after_seconds']
+                    and self._lagging(conn)):
+                conn.close()
+                with self._lock:
+                    self._stats['stale'] += 1
+            if conn is None or conn.closed:
+                conn = get_read_connection()
+                with self._lock:
+                    self._stats['opened'] += 1
+            yield conn
+        finally:
+            if conn is not None and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+            with self._lock:
+                self._in_use -= 1
+                keep = conn is not None and not conn.closed and not self._closed
+                if keep:
+                    self._idle.append((conn, time.monotonic()))
+            if conn is not None and not keep:
+                conn.close()
+            self._slots.release()
+
+    @staticmethod
+    def _lagging(conn) -> bool:
+        """Check whether a pooled connection is broken or too far behind the primary."""
+        try:
+            lag = replication_lag(conn)
+        except psycopg2.Error as e:
+            logger.warning(f"Pooled read connection failed its lag check: {e}")
+            return True
+        if lag > REPLICA_CONFIG['max_lag_seconds']:
+            logger.warning(f"Pooled read connection to {conn.info.host}:{conn.info.port} "
+                           f"is {lag:.1f}s behind; replacing it")
+            return True
+        return False
+
+    def statistics(self) -> Dict[str, Any]:
+        """
+        Return the usage of the pool since it was created.
+        
+        Returns:
+            Pool size, connections in use and open, borrows, borrows that
+            waited or timed out, connections replaced for lag, total and
+            longest wait and peak use
+        """
+        with self._lock:
+            return {'size': self.size, 'in_use': self._in_use,
+                    'open': self._in_use + len(self._idle), **self._stats}
+
+    def close(self) -> None:
+        """Close the idle connections; borrowed ones are closed when returned."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._closed = True
+        for conn, _ in idle:
+            conn.close()
+
+def set_read_pool(pool: Optional[ReadConnectionPool]) -> Optional[ReadConnectionPool]:
+    """
+    Serve get_read_db_connection from a pool, or connect per use with None.
+    
+    Args:
+        pool: Connection pool, or None
+    
+    Returns:
+        The pool used before
+    """
+    global _read_pool
+    with _read_pool_lock:
+        previous, _read_pool = _read_pool, pool
+    return previous
+
+def _current_read_pool() -> Optional[ReadConnectionPool]:
+    """Return the read pool, creating it when READ_POOL_CONFIG asks for one."""
+    global _read_pool
+    with _read_pool_lock:
+        if _read_pool is None and READ_POOL_CONFIG['size'] > 0:
+            _read_pool = ReadConnectionPool(READ_POOL_CONFIG['size'], READ_POOL_CONFIG['timeout'])
+        return _read_pool
+
+@contextmanager
+def get_read_db_connection():
+    """
+    Context manager for read-only connections (see get_read_connection).
+    
+    With a read pool (READ_POOL_CONFIG['size'] > 0 or set_read_pool) the
+    connection is borrowed from it; pooled connections stay on the server
+    they were opened on, so replica lag is only checked when connecting.
+    
+    Yields:
+        psycopg2.connection: Database connection
+    """
+    pool = _current_read_pool()
+    if pool is not None:
+        with pool.connection() as conn:
+            yield conn
+        return
+    conn = None
+    try:
+        conn = get_read_connection()
+        yield conn
+    except psycopg2.Error as e:
+        logger.error(f"Database connection error: {e}")
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
 def execute_query(query: str, params: Optional[Dict[str, Any]] = None) -> list:
     """
     Execute a query and return results.
@@ -0,0 +1,147 @@
+"""
+Disposable local PostgreSQL server for tests and benchmarks.
+"""
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from typing import Dict, Optional
+
+def find_pg_bin() -> Optional[str]:
+    """
+    Locate the directory containing initdb and pg_ctl.
+
+    Checks the PG_BIN environment variable, the PATH, `pg_config --bindir`
+    and the usual Debian/Ubuntu install locations.
+
+    Returns:
+        The binary directory, or None if PostgreSQL is not installed
+    """
+    candidates = []
+    if os.getenv('PG_BIN'):
+        candidates.append(os.getenv('PG_BIN'))
+    initdb = shutil.which('initdb')
+    if initdb:
+        candidates.append(os.path.dirname(initdb))
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        try:
+            candidates.append(subprocess.check_output([pg_config, '--bindir'], text=True).strip())
+        except subprocess.CalledProcessError:
+            pass
+    candidates.extend(sorted(glob.glob('/usr/lib/postgresql/*/bin'), reverse=True))
+
+    for bin_dir in candidates:
+        if os.path.exists(os.path.join(bin_dir, 'initdb')):
+            return bin_dir
+    return None
+
+def _free_port() -> int:
+    """Ask the OS for an unused TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+class EphemeralPostgres:
+    """
+    A throwaway PostgreSQL cluster in a temporary directory on a random port.
+
+    Given a running primary, the cluster is a streaming replica of it.
+    """
+
+    def __init__(self, bin_dir: Optional[str] = None, user: str = 'postgres',
+                 durable: bool = False, primary: Optional['EphemeralPostgres'] = None):
+        """
+        Initialize the server settings.
+
+        Args:
+            bin_dir: Directory with the PostgreSQL binaries (found automatically if omitted)
+            user: Superuser name created by initdb
+            durable: Keep fsync and synchronous commit on (off by default, the
+                data is thrown away anyway)
+            primary: Running server to start this one as a streaming replica of
+        """
+        self.bin_dir = bin_dir or (primary.bin_dir if primary else find_pg_bin())
+        self.user = primary.user if primary else user
+        self.durable = durable
+        self.primary = primary
+        self.base_dir: Optional[str] = None
+        self.port: Optional[int] = None
+
+    @property
+    def data_dir(self) -> str:
+        return os.path.join(self.base_dir, 'data')
+
+    @property
+    def config(self) -> Dict[str, str]:
+        """Connection settings in the same shape as config.DB_CONFIG."""
+        return {
+            'dbname': 'postgres',
+            'user': self.user,
+            'password': '',
+            'host': 'localhost',
+            'port': str(self.port)
+        }
+
+    def _run(self, program: str, *args: str) -> None:
+        """Run a PostgreSQL binary, raising RuntimeError with its output on failure."""
+        result = subprocess.run([os.path.join(self.bin_dir, program), *args],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{program} failed: {result.stdout.strip()}")
+
+    def start(self) -> Dict[str, str]:
+        """
+        Create and start the cluster (as a hot standby if it has a primary).
+
+        Returns:
+            Connection settings for the running server
+
+        Raises:
+            RuntimeError: If PostgreSQL is not installed or the server cannot start
+        """
+        if self.bin_dir is None:
+            raise RuntimeError("PostgreSQL binaries not found (set PG_BIN)")
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            raise RuntimeError("PostgreSQL refuses to run as root")
+
+        self.base_dir = tempfile.mkdtemp(prefix='warehouse-pg-')
+        self.port = _free_port()
+        if self.primary is None:
+            self._run('initdb', '-D', self.data_dir, '-U', self.user, '--auth=trust',
+                      '-E', 'UTF8', '--no-sync')
+        else:
+            # Copy the primary and configure streaming replication from it (-R)
+            self._run('pg_basebackup', '-D', self.data_dir, '-h', 'localhost',
+                      '-p', str(self.primary.port), '-U', self.user, '-R',
+                      '-X', 'stream', '-c', 'fast', '--no-sync')
+
+        options = [f'-p {self.port}', f'-k {self.base_dir}', "-c listen_addresses=localhost"]
+        if not self.durable:
+            options += ['-c fsync=off', '-c synchronous_commit=off', '-c full_page_writes=off']
+        try:
+            self._run('pg_ctl', '-D', self.data_dir, '-o', ' '.join(options),
+                      '-l', os.path.join(self.base_dir, 'server.log'), '-w', 'start')
+        except RuntimeError:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+            raise
+        return self.config
+
+    def stop(self) -> None:
+        """Stop the server and delete its data directory."""
+        if self.base_dir is None:
+            return
+        try:
+            self._run('pg_ctl', '-D', self.data_dir, '-m', 'immediate', '-w', 'stop')
+        finally:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+            self.base_dir = None
+
+    def __enter__(self) -> 'EphemeralPostgres':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,154 @@
+"""
+ETL run ledger: records the stages of each run so a failed run can resume.
+"""
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+from config import SCHEMA_CONFIG
+
+def file_checksum(path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Compute the SHA-256 checksum of a file.
+
+    Args:
+        path: Path to the file
+        block_size: Bytes read per block
+
+    Returns:
+        Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RunLedger:
+    """
+    Stage ledger of one ETL run.
+
+    Stages are staged source files (named after their staging table) and
+    merge steps. Methods that take a cursor write through the caller's
+    transaction, so a checkpoint commits together with the data it covers.
+    Stages may run in concurrent threads (see utils/pipeline.py): the run
+    connection is only used while holding the ledger's lock.
+    """
+
+    def __init__(self, conn, run_id: int, resumed: bool = False):
+        """Initialize the ledger for an existing run."""
+        self.conn = conn
+        self.run_id = run_id
+        self.resumed = resumed
+        self.lock = threading.Lock()
+        self.runs_table = f"{SCHEMA_CONFIG['schema_name']}.etl_runs"
+        self.ledger_table = f"{SCHEMA_CONFIG['schema_name']}.etl_run_ledger"
+
+    @classmethod
+    def open(cls, conn, resume: bool = True) -> 'RunLedger':
+        """
+        Resume the latest unfinished run or start a new one.
+
+        Args:
+            conn: Database connection used for run-level bookkeeping
+            resume: Resume an unfinished run if there is one
+
+        Returns:
+            Ledger of the run
+        """
+        runs_table = f"{SCHEMA_CONFIG['schema_name']}.etl_runs"
+        with conn.cursor() as cur:
+            if resume:
+                cur.execute(f"""
+                SELECT run_id FROM {runs_table}
+                WHERE status = 'running'
+                ORDER BY run_id DESC
+                LIMIT 1
+                """)
+                row = cur.fetchone()
+                if row:
+                    conn.commit()
+                    return cls(conn, row[0], resumed=True)
+            else:
+                cur.execute(f"UPDATE {runs_table} SET status = 'abandoned' WHERE status = 'running'")
+            cur.execute(f"INSERT INTO {runs_table} DEFAULT VALUES RETURNING run_id")
+            run_id = cur.fetchone()[0]
+        conn.commit()
+        return cls(conn, run_id)
+
+    def stage(self, stage: str) -> Optional[Dict[str, Any]]:
+        """Return the ledger entry of a stage in this run, if any."""
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute(f"""
+            SELECT file_name, checksum, rows_read, rows_loaded, status
+            FROM {self.ledger_table}
+            WHERE run_id = %s AND stage = %s
+            """, (self.run_id, stage))
+            row = cur.fetchone()
+            self.conn.commit()
+        if row is None:
+            return None
+        return dict(zip(['file_name', 'checksum', 'rows_read', 'rows_loaded', 'status'], row))
+
+    def is_completed(self, stage: str, checksum: Optional[str] = None) -> bool:
+        """Check whether a stage completed in this run (for the same input file)."""
+        entry = self.stage(stage)
+        return (entry is not None and entry['status'] in ('completed', 'skipped')
+                and (checksum is None or entry['checksum'] == checksum))
+
+    def previous_checksum(self, stage: str) -> Optional[str]:
+        """Return the input checksum of a stage in the last completed run."""
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute(f"""
+            SELECT l.checksum
+            FROM {self.ledger_table} l
+            JOIN {self.runs_table} r ON r.run_id = l.run_id
+            WHERE r.status = 'completed' AND l.stage = %s
+              AND l.status IN ('completed', 'skipped')
+            ORDER BY r.run_id DESC
+            LIMIT 1
+            """, (stage,))
+            row = cur.fetchone()
+            self.conn.commit()
+        return row[0] if row else None
+
+    def begin(self, cur, stage: str, file_name: Optional[str] = None,
+              checksum: Optional[str] = None) -> None:
+        """Record the start of a stage, resetting any earlier attempt in this run."""
+        cur.execute(f"""
+        INSERT INTO {self.ledger_table} (run_id, stage, file_name, checksum, status)
+        VALUES (%s, %s, %s, %s, 'running')
+        ON CONFLICT (run_id, stage) DO UPDATE SET
+            file_name = EXCLUDED.file_name,
+            checksum = EXCLUDED.checksum,
+            rows_read = 0,
+            rows_loaded = 0,
+            status = 'running',
+            started_at = now(),
+            finished_at = NULL
+        """, (self.run_id, stage, file_name, checksum))
+
+    def checkpoint(self, cur, stage: str, rows_read: int, rows_loaded: int) -> None:
+        """Record progress of a running stage."""
+        cur.execute(f"""
+        UPDATE {self.ledger_table}
+        SET rows_read = %s, rows_loaded = %s
+        WHERE run_id = %s AND stage = %s
+        """, (rows_read, rows_loaded, self.run_id, stage))
+
+    def complete(self, cur, stage: str, status: str = 'completed') -> None:
+        """Mark a stage as completed (or skipped)."""
+        cur.execute(f"""
+        UPDATE {self.ledger_table}
+        SET status = %s, finished_at = now()
+        WHERE run_id = %s AND stage = %s
+        """, (status, self.run_id, stage))
+
+    def finish(self) -> None:
+        """Mark the run as completed."""
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute(f"""
+            UPDATE {self.runs_table}
+            SET status = 'completed', finished_at = now()
+            WHERE run_id = %s
+            """, (self.run_id,))
+            self.conn.commit()
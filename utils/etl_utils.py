@@ -1,96 +1,450 @@
 """
 ETL utilities for the sales data warehouse.
 """
+import io
+import time
+from functools import partial
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
-from config import DB_CONFIG, SCHEMA_CONFIG, RAW_DATA_DIR
+from config import DB_CONFIG, SCHEMA_CONFIG, RAW_DATA_DIR, ETL_CONFIG, CALENDAR_CONFIG
+from utils.db_setup import (create_staging_tables, drop_staging_tables, create_etl_tables,
+                            create_sketch_tables, create_cube_tables,
+                            create_customer_activity_tables, create_inventory_tables,
+                            uses_compact_facts,
+                            STREAM_STAGING_TABLE)
+from utils.etl_ledger import RunLedger, file_checksum
+from utils.key_cache import DIMENSION_KEYS, get_key_cache
+from utils.cube import build_sales_cube, add_to_sales_cube
+from utils.customer_activity import build_customer_activity, add_to_customer_activity
+from utils.inventory import update_current_stock, compact_inventory_snapshots
+from utils.sketches import update_customer_sketches
+from utils.time_dimension import extend_time_dimension
+from utils.validation import validate_chunk, rejects_path, write_rejects
+from utils.schema import source_dtypes, downcast
+from utils.memory_profile import track_memory
+from utils.pipeline import Pipeline
+from utils.logging_utils import setup_logger, ProgressLogger
 
-def load_csv_to_staging(csv_file: str, staging_table: str) -> None:
+logger = setup_logger(__name__)
+
+# Source file -> staging table, in load order
+DIMENSION_FILES = [
+    ('products.csv', 'stg_products'),
+    ('customers.csv', 'stg_customers'),
+    ('time_dimension.csv', 'stg_time_dimension'),
+    ('stores.csv', 'stg_stores')
+]
+FACT_FILES = [
+    ('sales.csv', 'stg_sales'),
+    ('inventory.csv', 'stg_inventory')
+]
+
+# Fact staging table -> natural key columns resolved to surrogate keys while staging
+FACT_DIMENSION_KEYS = {
+    'stg_sales': {
+        'date_id': 'dim_time',
+        'product_id': 'dim_product',
+        'customer_id': 'dim_customer',
+        'store_id': 'dim_store'
+    },
+    'stg_inventory': {
+        'date_id': 'dim_time',
+        'product_id': 'dim_product',
+        'store_id': 'dim_store'
+    }
+}
+
+# Type 2 slowly changing dimensions: staging table, natural key, attribute
+# columns, and the attributes whose changes open a new version
+SCD2_DIMENSIONS = {
+    'dim_product': {
+        'staging_table': 'stg_products',
+        'natural_key': 'product_id',
+        'columns': ['product_name', 'category', 'subcategory', 'brand', 'unit_price', 'cost',
+                    'created_date', 'modified_date'],
+        'tracked': ['product_name', 'category', 'subcategory', 'brand', 'unit_price', 'cost']
+    },
+    'dim_customer': {
+        'staging_table': 'stg_customers',
+        'natural_key': 'customer_id',
+        'columns': ['first_name', 'last_name', 'email', 'phone', 'address', 'city', 'state',
+                    'country', 'postal_code', 'customer_segment', 'created_date', 'modified_date'],
+        'tracked': ['first_name', 'last_name', 'email', 'phone', 'address', 'city', 'state',
+                    'country', 'postal_code', 'customer_segment']
+    },
+    'dim_store': {
+        'staging_table': 'stg_stores',
+        'natural_key': 'store_id',
+        'columns': ['store_name', 'address', 'city', 'state', 'country', 'postal_code', 'manager',
+                    'opening_date', 'store_type', 'store_size', 'created_date', 'modified_date'],
+        'tracked': ['store_name', 'address', 'city', 'state', 'country', 'postal_code', 'manager',
+                    'opening_date', 'store_type', 'store_size']
+    }
+}
+
+# Staging table -> tracked columns hashed into row_hash while staging
+ROW_HASH_COLUMNS = {spec['staging_table']: spec['tracked'] for spec in SCD2_DIMENSIONS.values()}
+
+# Dimension staging table -> (natural key, column ordering versions newest first)
+DEDUP_KEYS = {spec['staging_table']: (spec['natural_key'], 'modified_date')
+              for spec in SCD2_DIMENSIONS.values()}
+DEDUP_KEYS['stg_time_dimension'] = ('date_id', None)
+
+# Dimension table -> staging table it is loaded from
+DIMENSION_TABLES = {dimension: spec['staging_table'] for dimension, spec in SCD2_DIMENSIONS.items()}
+DIMENSION_TABLES['dim_time'] = 'stg_time_dimension'
+
+def deduplicate_staging(cur, staging_table: str) -> int:
+    """
+    Keep only the latest staged row per natural key.
+
+    Rows are ranked per key by the version column (latest first, later rows
+    of the file winning ties) and every row but the first is deleted, so the
+    window only sorts the key and version columns rather than whole rows.
+
+    Args:
+        cur: Open database cursor
+        staging_table: Name of the dimension staging table (a key of DEDUP_KEYS)
+
+    Returns:
+        Number of duplicate rows removed
+    """
+    natural_key, version_column = DEDUP_KEYS[staging_table]
+    order_by = f"{version_column} DESC, ctid DESC" if version_column else "ctid DESC"
+    table = f"{SCHEMA_CONFIG['staging_schema']}.{staging_table}"
+    cur.execute(f"""
+    DELETE FROM {table} s
+    USING (
+        SELECT ctid FROM (
+            SELECT ctid, ROW_NUMBER() OVER (PARTITION BY {natural_key} ORDER BY {order_by}) AS version
+            FROM {table}
+        ) ranked
+        WHERE version > 1
+    ) duplicates
+    WHERE s.ctid = duplicates.ctid
+    """)
+    if cur.rowcount:
+        logger.info(f"Removed {cur.rowcount} duplicate rows from {staging_table}")
+    return cur.rowcount
+
+def compute_row_hash(df: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """
+    Compute a 64-bit hash of the given columns for every row.
+
+    Values are hashed as text (dates as YYYY-MM-DD) so the hash does not
+    depend on the dtypes pandas inferred for the file.
+
+    Args:
+        df: Source rows
+        columns: Columns to include in the hash
+
+    Returns:
+        Series of signed 64-bit hashes aligned with df
+    """
+    normalized = pd.DataFrame({
+        column: (df[column].dt.strftime('%Y-%m-%d')
+                 if pd.api.types.is_datetime64_any_dtype(df[column])
+                 else df[column].astype(str))
+        for column in columns
+    })
+    hashes = pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+    return pd.Series(hashes.view('int64'), index=df.index)
+
+def resolve_surrogate_keys(df: pd.DataFrame, staging_table: str, conn) -> pd.DataFrame:
+    """
+    Replace natural dimension keys in a fact extract with surrogate keys.
+
+    The per-dimension key caches are refreshed incrementally before mapping,
+    so only dimension rows added since the previous load are read.
+
+    Args:
+        df: Fact rows as read from the source file
+        staging_table: Name of the fact staging table
+        conn: Open database connection
+
+    Returns:
+        DataFrame with each natural key column replaced by its surrogate key column
+    """
+    for column, dimension in FACT_DIMENSION_KEYS[staging_table].items():
+        cache = get_key_cache(dimension)
+        cache.refresh(conn)
+        keys = cache.map(df[column])
+        missing = keys.isna()
+        if missing.any():
+            unknown = df.loc[missing, column].astype(str).unique()[:5]
+            raise ValueError(
+                f"{missing.sum()} rows in {staging_table} reference unknown "
+                f"{column} values in {dimension}: {', '.join(unknown)}"
+            )
+        surrogate_key = DIMENSION_KEYS[dimension][1]
+        df[column] = keys.astype('int32')
+        df = df.rename(columns={column: surrogate_key})
+    return df
+
+def _copy_to_staging(cur, df: pd.DataFrame, staging_table: str) -> None:
+    """COPY a DataFrame into a staging table (missing values become NULL)."""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY {SCHEMA_CONFIG['staging_schema']}.{staging_table} ({', '.join(df.columns)}) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+def _staged_row_count(cur, staging_table: str) -> int:
+    """Count the rows currently in a staging table."""
+    cur.execute(f"SELECT COUNT(*) FROM {SCHEMA_CONFIG['staging_schema']}.{staging_table}")
+    return cur.fetchone()[0]
+
+def load_csv_to_staging(csv_file: str, staging_table: str,
+                        data_dir: str = RAW_DATA_DIR,
+                        ledger: Optional[RunLedger] = None,
+                        checksum: Optional[str] = None,
+                        chunk_size: Optional[int] = None,
+                        validate: Optional[bool] = None) -> int:
     """
     Load data from CSV file to staging table.
     
+    The file is read and committed in chunks. With a ledger, every commit
+    also records how far the file was read, and a load interrupted in an
+    earlier attempt of the same run continues after the last committed chunk.
+    
+    Each chunk is validated before it is staged. Invalid rows are written to
+    a reject file with their reasons instead of failing the load.
+    
     Args:
-        csv_file: Name of the CSV file in raw data directory
+        csv_file: Name of the CSV file in the data directory
         staging_table: Name of the staging table
-    """
-    print(f"Loading {csv_file} to staging table {staging_table}...")
+        data_dir: Directory containing the CSV file (defaults to the raw data directory)
+        ledger: Run ledger to checkpoint progress in (optional)
+        checksum: Checksum of the file (computed when a ledger is given and it is omitted)
+        chunk_size: Rows per chunk (defaults to ETL_CONFIG['chunk_size'])
+        validate: Validate and quarantine rows (defaults to ETL_CONFIG['validate'])
     
-    # Read CSV file
-    df = pd.read_csv(os.path.join(RAW_DATA_DIR, csv_file))
+    Returns:
+        Number of rows in the staging table after the load
+    """
+    logger.info(f"Loading {csv_file} to staging table {staging_table}...")
+    path = os.path.join(data_dir, csv_file)
+    chunk_size = chunk_size or ETL_CONFIG['chunk_size']
+    if validate is None:
+        validate = ETL_CONFIG['validate']
     
     # Connect to database
     conn = psycopg2.connect(**DB_CONFIG)
     cur = conn.cursor()
     
+    # Resume after the last committed chunk if staging still holds it
+    rows_read = rows_loaded = 0
+    if ledger is not None:
+        checksum = checksum or file_checksum(path)
+        entry = ledger.stage(staging_table)
+        if (entry is not None and entry['status'] == 'running'
+                and entry['checksum'] == checksum and entry['rows_read'] > 0
+                and _staged_row_count(cur, staging_table) == entry['rows_loaded']):
+            rows_read, rows_loaded = entry['rows_read'], entry['rows_loaded']
+            logger.info(f"Resuming {csv_file} after {rows_read} rows")
+        else:
+            ledger.begin(cur, staging_table, csv_file, checksum)
+    
+    rejects_file = rejects_path(
+        csv_file,
+        ETL_CONFIG['rejects_dir'] or os.path.join(os.path.dirname(os.path.abspath(data_dir)), 'rejects'),
+        ledger.run_id if ledger is not None else None
+    )
+    
     # Clear existing data in staging table
-    cur.execute(f"TRUNCATE TABLE {SCHEMA_CONFIG['staging_schema']}.{staging_table}")
+    if rows_read == 0:
+        cur.execute(f"TRUNCATE TABLE {SCHEMA_CONFIG['staging_schema']}.{staging_table}")
+        if os.path.exists(rejects_file):
+            os.remove(rejects_file)
+    conn.commit()
     
-    # Convert DataFrame to list of tuples for bulk insert
-    data = [tuple(x) for x in df.values]
-    columns = df.columns.tolist()
+    # Fact rows must fit the compact layout if the fact tables use it
+    compact = staging_table in FACT_DIMENSION_KEYS and uses_compact_facts(cur)
     
-    # Create the INSERT query
-    insert_query = f"""
-    INSERT INTO {SCHEMA_CONFIG['staging_schema']}.{staging_table} 
-    ({', '.join(columns)})
-    VALUES %s
-    """
+    warnings: Dict[str, int] = {}
+    progress = ProgressLogger(logger, staging_table)
+    with track_memory(staging_table) as memory:
+        chunks = pd.read_csv(path, chunksize=chunk_size, dtype=source_dtypes(staging_table),
+                             skiprows=range(1, rows_read + 1) if rows_read else None)
+        for df in chunks:
+            df.index = pd.RangeIndex(rows_read, rows_read + len(df))
+            memory.frame(df)
+            rows_read += len(df)
+            
+            # New fact dates extend the time dimension instead of becoming orphans
+            if 'date_id' in FACT_DIMENSION_KEYS.get(staging_table, {}) and ETL_CONFIG['extend_time_dimension']:
+                extend_time_dimension(conn, df['date_id'])
+            
+            # Quarantine invalid rows instead of failing the load in Postgres
+            if validate:
+                df, rejects, chunk_warnings = validate_chunk(
+                    df, staging_table, conn, FACT_DIMENSION_KEYS.get(staging_table), compact
+                )
+                if len(rejects):
+                    write_rejects(rejects, rejects_file)
+                for reason, count in chunk_warnings.items():
+                    warnings[reason] = warnings.get(reason, 0) + count
+            
+            # Integer measures as int32 once they are known to fit
+            df = downcast(df, staging_table)
+            
+            # Hash tracked attributes for change detection
+            if staging_table in ROW_HASH_COLUMNS:
+                df['row_hash'] = compute_row_hash(df, ROW_HASH_COLUMNS[staging_table])
+            
+            # Fact rows reference dimensions by surrogate key
+            if staging_table in FACT_DIMENSION_KEYS:
+                df = resolve_surrogate_keys(df, staging_table, conn)
+            
+            _copy_to_staging(cur, df, staging_table)
+            rows_loaded += len(df)
+            if ledger is not None:
+                ledger.checkpoint(cur, staging_table, rows_read, rows_loaded)
+            conn.commit()
+            progress.update(len(df))
     
-    # Execute bulk insert
-    execute_values(cur, insert_query, data)
+    # Fresh statistics for the merge queries that read this table
+    cur.execute(f"ANALYZE {SCHEMA_CONFIG['staging_schema']}.{staging_table}")
+    if ledger is not None:
+        ledger.complete(cur, staging_table)
     
     conn.commit()
     cur.close()
     conn.close()
-    print(f"Successfully loaded {len(data)} rows to {staging_table}")
+    logger.info(f"Successfully loaded {rows_loaded} rows to {staging_table}",
+                extra={'stage': staging_table, 'rows': rows_loaded})
+    for reason, count in warnings.items():
+        logger.warning(f"{count} rows in {csv_file}: {reason}",
+                       extra={'stage': staging_table, 'rows': count})
+    if rows_read > rows_loaded:
+        logger.warning(f"Rejected {rows_read - rows_loaded} rows of {csv_file}, see {rejects_file}",
+                       extra={'stage': staging_table, 'rows': rows_read - rows_loaded})
+    return rows_loaded
 
-def load_dimension_tables() -> None:
-    """Load data from staging to dimension tables."""
-    print("Loading dimension tables...")
+def stage_source_file(ledger: RunLedger, csv_file: str, staging_table: str,
+                      data_dir: str = RAW_DATA_DIR, force: bool = False) -> None:
+    """
+    Stage a source file unless this run or the last completed run already did.
     
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
+    Args:
+        ledger: Ledger of the current run
+        csv_file: Name of the CSV file in the data directory
+        staging_table: Name of the staging table
+        data_dir: Directory containing the CSV file
+        force: Reload the file even if it is unchanged since the last completed run
+    """
+    checksum = file_checksum(os.path.join(data_dir, csv_file))
     
-    # Load Product Dimension
+    # Already staged earlier in this (resumed) run
+    entry = ledger.stage(staging_table)
+    if ledger.is_completed(staging_table, checksum):
+        conn = psycopg2.connect(**DB_CONFIG)
+        with conn.cursor() as cur:
+            staged = _staged_row_count(cur, staging_table)
+        conn.close()
+        if staged == entry['rows_loaded']:
+            logger.info(f"Skipping {csv_file}: already staged in run {ledger.run_id}")
+            return
+    
+    # Unchanged since the last completed run: stage nothing so the merge is a no-op
+    if not force and entry is None and ledger.previous_checksum(staging_table) == checksum:
+        conn = psycopg2.connect(**DB_CONFIG)
+        with conn.cursor() as cur:
+            cur.execute(f"TRUNCATE TABLE {SCHEMA_CONFIG['staging_schema']}.{staging_table}")
+            ledger.begin(cur, staging_table, csv_file, checksum)
+            ledger.complete(cur, staging_table, status='skipped')
+        conn.commit()
+        conn.close()
+        logger.info(f"Skipping {csv_file}: unchanged since the last completed run")
+        return
+    
+    load_csv_to_staging(csv_file, staging_table, data_dir, ledger, checksum)
+
+def run_stage(ledger: RunLedger, stage: str, step) -> None:
+    """Run a merge step unless it already completed in this run."""
+    if ledger.is_completed(stage):
+        logger.info(f"Skipping {stage}: already completed in run {ledger.run_id}")
+        return
+    with ledger.lock, ledger.conn.cursor() as cur:
+        ledger.begin(cur, stage)
+        ledger.conn.commit()
+    started = time.monotonic()
+    with track_memory(stage):
+        step()
+    with ledger.lock, ledger.conn.cursor() as cur:
+        ledger.complete(cur, stage)
+        ledger.conn.commit()
+    elapsed = time.monotonic() - started
+    logger.info(f"Stage {stage} completed in {elapsed:.1f}s",
+                extra={'stage': stage, 'run_id': ledger.run_id, 'elapsed_seconds': round(elapsed, 3)})
+
+def _load_scd2_dimension(cur, dimension: str) -> None:
+    """
+    Merge one staged dimension as a Type 2 slowly changing dimension.
+
+    Staging must hold at most one row per natural key (see deduplicate_staging).
+    Current rows whose row hash differs from the staged row are closed and a
+    new current version is inserted; unchanged rows are not touched.
+
+    Args:
+        cur: Open database cursor
+        dimension: Name of the dimension table (a key of SCD2_DIMENSIONS)
+    """
+    spec = SCD2_DIMENSIONS[dimension]
+    natural_key = spec['natural_key']
+    columns = ', '.join([natural_key] + spec['columns'])
+    staged_columns = ', '.join(f's.{column}' for column in [natural_key] + spec['columns'])
+    dim_table = f"{SCHEMA_CONFIG['dim_schema']}.{dimension}"
+    staging_table = f"{SCHEMA_CONFIG['staging_schema']}.{spec['staging_table']}"
+    
+    # Close current versions whose attributes changed
     cur.execute(f"""
-    INSERT INTO {SCHEMA_CONFIG['dim_schema']}.dim_product
-    SELECT DISTINCT * FROM {SCHEMA_CONFIG['staging_schema']}.stg_products
-    ON CONFLICT (product_id) DO UPDATE SET
-        product_name = EXCLUDED.product_name,
-        category = EXCLUDED.category,
-        subcategory = EXCLUDED.subcategory,
-        brand = EXCLUDED.brand,
-        unit_price = EXCLUDED.unit_price,
-        cost = EXCLUDED.cost,
-        modified_date = EXCLUDED.modified_date
+    UPDATE {dim_table} d SET
+        valid_to = s.modified_date,
+        is_current = FALSE
+    FROM {staging_table} s
+    WHERE d.{natural_key} = s.{natural_key}
+      AND d.is_current
+      AND d.row_hash <> s.row_hash
     """)
+    closed = cur.rowcount
     
-    # Load Customer Dimension
+    # Insert new members and new versions of changed members
     cur.execute(f"""
-    INSERT INTO {SCHEMA_CONFIG['dim_schema']}.dim_customer
-    SELECT DISTINCT * FROM {SCHEMA_CONFIG['staging_schema']}.stg_customers
-    ON CONFLICT (customer_id) DO UPDATE SET
-        first_name = EXCLUDED.first_name,
-        last_name = EXCLUDED.last_name,
-        email = EXCLUDED.email,
-        phone = EXCLUDED.phone,
-        address = EXCLUDED.address,
-        city = EXCLUDED.city,
-        state = EXCLUDED.state,
-        country = EXCLUDED.country,
-        postal_code = EXCLUDED.postal_code,
-        customer_segment = EXCLUDED.customer_segment,
-        modified_date = EXCLUDED.modified_date
+    INSERT INTO {dim_table} ({columns}, row_hash, valid_from, valid_to, is_current)
+    SELECT {staged_columns}, s.row_hash, s.modified_date, NULL::DATE, TRUE
+    FROM {staging_table} s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {dim_table} d
+        WHERE d.{natural_key} = s.{natural_key} AND d.is_current
+    )
     """)
-    
-    # Load Time Dimension
+    inserted = cur.rowcount
+    logger.info(f"{dimension}: {inserted} versions inserted, {closed} versions closed")
+
+def _load_time_dimension(cur) -> None:
+    """Merge the staged time dimension (dates are never versioned)."""
     cur.execute(f"""
-    INSERT INTO {SCHEMA_CONFIG['dim_schema']}.dim_time
-    SELECT DISTINCT * FROM {SCHEMA_CONFIG['staging_schema']}.stg_time_dimension
-    ON CONFLICT (date_id) DO UPDATE SET
+    INSERT INTO {SCHEMA_CONFIG['dim_schema']}.dim_time (
+        date_key, date_id, full_date, day_of_week, day_of_month, day_of_year,
+        week_of_year, month, quarter, year, is_holiday, holiday_name,
+        fiscal_year, fiscal_quarter
+    )
+    SELECT
+        date_id::INTEGER, date_id, full_date, day_of_week, day_of_month, day_of_year,
+        week_of_year, month, quarter, year, is_holiday, holiday_name,
+        -- Source files without fiscal periods get them from the configured fiscal year
+        COALESCE(fiscal_year, year + CASE WHEN %(fiscal_start)s > 1
+                                          AND month >= %(fiscal_start)s THEN 1 ELSE 0 END),
+        COALESCE(fiscal_quarter, (month - %(fiscal_start)s + 12) %% 12 / 3 + 1)
+    FROM {SCHEMA_CONFIG['staging_schema']}.stg_time_dimension
+    ON CONFLICT (date_key) DO UPDATE SET
+        date_id = EXCLUDED.date_id,
         full_date = EXCLUDED.full_date,
         day_of_week = EXCLUDED.day_of_week,
         day_of_month = EXCLUDED.day_of_month,
@@ -100,98 +454,405 @@ def load_dimension_tables() -> None:
         quarter = EXCLUDED.quarter,
         year = EXCLUDED.year,
         is_holiday = EXCLUDED.is_holiday,
-        holiday_name = EXCLUDED.holiday_name
-    """)
+        holiday_name = EXCLUDED.holiday_name,
+        fiscal_year = EXCLUDED.fiscal_year,
+        fiscal_quarter = EXCLUDED.fiscal_quarter
+    """, {'fiscal_start': CALENDAR_CONFIG['fiscal_year_start_month']})
+
+def load_dimension_table(dimension: str) -> None:
+    """
+    Load one dimension table from its staging table.
     
-    # Load Store Dimension
-    cur.execute(f"""
-    INSERT INTO {SCHEMA_CONFIG['dim_schema']}.dim_store
-    SELECT DISTINCT * FROM {SCHEMA_CONFIG['staging_schema']}.stg_stores
-    ON CONFLICT (store_id) DO UPDATE SET
-        store_name = EXCLUDED.store_name,
-        address = EXCLUDED.address,
-        city = EXCLUDED.city,
-        state = EXCLUDED.state,
-        country = EXCLUDED.country,
-        postal_code = EXCLUDED.postal_code,
-        manager = EXCLUDED.manager,
-        opening_date = EXCLUDED.opening_date,
-        store_type = EXCLUDED.store_type,
-        store_size = EXCLUDED.store_size,
-        modified_date = EXCLUDED.modified_date
-    """)
+    Dimensions do not refer to each other, so they can be loaded at the same
+    time (see run_etl).
+    
+    Args:
+        dimension: Name of the dimension table (a key of DIMENSION_TABLES)
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    # One row per natural key, so the merge below is conflict-free
+    deduplicate_staging(cur, DIMENSION_TABLES[dimension])
+    
+    # Product, customer and store dimensions keep their history
+    if dimension in SCD2_DIMENSIONS:
+        _load_scd2_dimension(cur, dimension)
+    else:
+        _load_time_dimension(cur)
     
     conn.commit()
     cur.close()
     conn.close()
-    print("Dimension tables loaded successfully.")
 
-def load_fact_tables() -> None:
-    """Load data from staging to fact tables."""
-    print("Loading fact tables...")
+def load_dimension_tables() -> None:
+    """Load data from staging to dimension tables."""
+    logger.info("Loading dimension tables...")
+    for dimension in DIMENSION_TABLES:
+        load_dimension_table(dimension)
+    logger.info("Dimension tables loaded successfully.")
+
+# Fact table -> staging table, business key and measure/attribute columns
+FACT_TABLES = {
+    'fact_sales': {
+        'staging_table': 'stg_sales',
+        'key': 'sale_id',
+        'columns': ['date_key', 'product_key', 'customer_key', 'store_key', 'quantity',
+                    'unit_price', 'total_amount', 'discount_amount', 'net_amount',
+                    'payment_method', 'transaction_time'],
+        # Compact layout: amounts in cents, total and net derived by facts.v_sales
+        'compact_columns': ['transaction_time', 'date_key', 'product_key', 'customer_key',
+                            'store_key', 'unit_price_cents', 'discount_cents', 'quantity',
+                            'payment_method'],
+        'expressions': {
+            'unit_price_cents': 'ROUND(unit_price * 100)::INTEGER',
+            'discount_cents': 'ROUND(discount_amount * 100)::INTEGER'
+        }
+    },
+    'fact_inventory': {
+        'staging_table': 'stg_inventory',
+        'key': 'inventory_id',
+        'columns': ['date_key', 'product_key', 'store_key', 'beginning_quantity',
+                    'ending_quantity', 'units_received', 'units_sold', 'units_damaged',
+                    'reorder_point', 'reorder_quantity']
+    }
+}
+
+def _fact_merge_query(fact_table: str, batched: bool = False, compact: bool = False,
+                      staging_table: Optional[str] = None, insert_only: bool = False) -> str:
+    """
+    Build the upsert of a fact table from its staging table.
     
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
+    Args:
+        fact_table: Name of the fact table (a key of FACT_TABLES)
+        batched: Restrict the merge to a key range given as %(low)s/%(high)s
+            (%(high)s may be NULL for the last range)
+        compact: Build the upsert for the compact fact layout
+        staging_table: Staging table to read (defaults to the fact table's)
+        insert_only: Keep existing rows instead of updating them and return
+            the keys of the inserted rows
     
-    # Load Sales Fact
-    cur.execute(f"""
-    INSERT INTO {SCHEMA_CONFIG['fact_schema']}.fact_sales
-    SELECT * FROM {SCHEMA_CONFIG['staging_schema']}.stg_sales
-    ON CONFLICT (sale_id) DO UPDATE SET
-        date_id = EXCLUDED.date_id,
-        product_id = EXCLUDED.product_id,
-        customer_id = EXCLUDED.customer_id,
-        store_id = EXCLUDED.store_id,
-        quantity = EXCLUDED.quantity,
-        unit_price = EXCLUDED.unit_price,
-        total_amount = EXCLUDED.total_amount,
-        discount_amount = EXCLUDED.discount_amount,
-        net_amount = EXCLUDED.net_amount,
-        payment_method = EXCLUDED.payment_method,
-        transaction_time = EXCLUDED.transaction_time
-    """)
+    Returns:
+        SQL statement
+    """
+    spec = FACT_TABLES[fact_table]
+    staging_table = staging_table or spec['staging_table']
+    key = spec['key']
+    measures = spec['compact_columns'] if compact and 'compact_columns' in spec else spec['columns']
+    columns = [key] + measures
+    values = [spec.get('expressions', {}).get(column, column) for column in columns]
+    updates = ',\n        '.join(f"{column} = EXCLUDED.{column}" for column in measures)
+    where = ''
+    if batched:
+        where = f"WHERE {key} >= %(low)s AND (%(high)s IS NULL OR {key} < %(high)s)"
+    conflict = (f"DO NOTHING\n    RETURNING {key}" if insert_only
+                else f"DO UPDATE SET\n        {updates}")
+    return f"""
+    INSERT INTO {SCHEMA_CONFIG['fact_schema']}.{fact_table} ({', '.join(columns)})
+    SELECT {', '.join(values)} FROM {SCHEMA_CONFIG['staging_schema']}.{staging_table}
+    {where}
+    ON CONFLICT ({key}) {conflict}
+    """
+
+def _batch_bounds(cur, staging_table: str, key: str, batch_size: int) -> List[str]:
+    """
+    Split a staging table into key ranges of about batch_size rows.
+    
+    Returns:
+        Sorted lower bounds; each range ends before the next bound
+    """
+    table = f"{SCHEMA_CONFIG['staging_schema']}.{staging_table}"
     
-    # Load Inventory Fact
+    # The per-batch range scans use this index (dropped with the staging table)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS ix_{staging_table}_{key} ON {table} ({key})")
     cur.execute(f"""
-    INSERT INTO {SCHEMA_CONFIG['fact_schema']}.fact_inventory
-    SELECT * FROM {SCHEMA_CONFIG['staging_schema']}.stg_inventory
-    ON CONFLICT (inventory_id) DO UPDATE SET
-        date_id = EXCLUDED.date_id,
-        product_id = EXCLUDED.product_id,
-        store_id = EXCLUDED.store_id,
-        beginning_quantity = EXCLUDED.beginning_quantity,
-        ending_quantity = EXCLUDED.ending_quantity,
-        units_received = EXCLUDED.units_received,
-        units_sold = EXCLUDED.units_sold,
-        units_damaged = EXCLUDED.units_damaged,
-        reorder_point = EXCLUDED.reorder_point,
-        reorder_quantity = EXCLUDED.reorder_quantity
-    """)
+    SELECT {key} FROM (
+        SELECT {key}, ROW_NUMBER() OVER (ORDER BY {key}) AS position
+        FROM {table}
+    ) ordered
+    WHERE position %% %s = 1
+    ORDER BY {key}
+    """, (batch_size,))
+    return [row[0] for row in cur.fetchall()]
+
+def merge_fact_table(conn, fact_table: str, batch_size: int = 0,
+                     pause_seconds: float = 0.0) -> int:
+    """
+    Merge a staged fact table into its fact table.
     
+    With a batch size, staging is merged in key ranges of about that many
+    rows with a commit after each range, so locks are held and WAL is
+    generated in small increments while readers keep running.
+    
+    Args:
+        conn: Open database connection
+        fact_table: Name of the fact table (a key of FACT_TABLES)
+        batch_size: Rows per batch (0 merges everything in one statement)
+        pause_seconds: Pause after each batch to throttle the load
+    
+    Returns:
+        Number of rows merged
+    """
+    spec = FACT_TABLES[fact_table]
+    cur = conn.cursor()
+    compact = uses_compact_facts(cur)
+    
+    if not batch_size:
+        cur.execute(_fact_merge_query(fact_table, compact=compact))
+        merged = cur.rowcount
+        conn.commit()
+        cur.close()
+        return merged
+    
+    bounds = _batch_bounds(cur, spec['staging_table'], spec['key'], batch_size)
     conn.commit()
+    query = _fact_merge_query(fact_table, batched=True, compact=compact)
+    merged = 0
+    progress = ProgressLogger(logger, fact_table)
+    for batch, low in enumerate(bounds, start=1):
+        high = bounds[batch] if batch < len(bounds) else None
+        cur.execute(query, {'low': low, 'high': high})
+        merged += cur.rowcount
+        conn.commit()
+        progress.update(cur.rowcount)
+        if pause_seconds and batch < len(bounds):
+            time.sleep(pause_seconds)
     cur.close()
+    return merged
+
+def load_fact_table(fact_table: str, batch_size: Optional[int] = None,
+                    pause_seconds: Optional[float] = None) -> int:
+    """
+    Load one fact table from its staging table.
+    
+    Args:
+        fact_table: Name of the fact table (a key of FACT_TABLES)
+        batch_size: Rows merged per transaction (defaults to
+            ETL_CONFIG['fact_batch_size']; 0 merges the table in one statement)
+        pause_seconds: Pause between batches (defaults to ETL_CONFIG['batch_pause_seconds'])
+    
+    Returns:
+        Number of rows merged
+    """
+    if batch_size is None:
+        batch_size = ETL_CONFIG['fact_batch_size']
+    if pause_seconds is None:
+        pause_seconds = ETL_CONFIG['batch_pause_seconds']
+    
+    conn = psycopg2.connect(**DB_CONFIG)
+    merged = merge_fact_table(conn, fact_table, batch_size, pause_seconds)
     conn.close()
-    print("Fact tables loaded successfully.")
+    logger.info(f"{fact_table}: {merged} rows merged", extra={'stage': fact_table, 'rows': merged})
+    return merged
 
-def run_etl():
-    """Run the complete ETL process."""
-    print("Starting ETL process...")
+def load_fact_tables(batch_size: Optional[int] = None,
+                     pause_seconds: Optional[float] = None) -> None:
+    """
+    Load data from staging to fact tables.
+    
+    Args:
+        batch_size: Rows merged per transaction (defaults to
+            ETL_CONFIG['fact_batch_size']; 0 merges each table in one statement)
+        pause_seconds: Pause between batches (defaults to ETL_CONFIG['batch_pause_seconds'])
+    """
+    logger.info("Loading fact tables...")
+    
+    # Load Sales Fact, then Inventory Fact
+    for fact_table in FACT_TABLES:
+        load_fact_table(fact_table, batch_size, pause_seconds)
+    
+    logger.info("Fact tables loaded successfully.")
+
+def analyze_fact_table(fact_table: str) -> None:
+    """
+    Refresh the planner statistics of a fact table after a merge.
+    
+    The aggregates built after the merge then plan with the new row counts
+    instead of waiting for autovacuum.
+    
+    Args:
+        fact_table: Name of the fact table (a key of FACT_TABLES)
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute(f"ANALYZE {SCHEMA_CONFIG['fact_schema']}.{fact_table}")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+def ingest_sales(df: pd.DataFrame, rejects_file: Optional[str] = None,
+                 validate: Optional[bool] = None) -> Dict[str, int]:
+    """
+    Insert a micro-batch of new sales rows into the sales facts.
+    
+    The rows are validated and keyed like a chunk of a sales file, copied
+    into the stream staging table and inserted with ON CONFLICT DO NOTHING,
+    so sales that are already loaded are left unchanged and a batch can be
+    ingested again safely. The new sales are added to the sales cube and the
+    customer activity in the same transaction, then to the distinct
+    customer sketches.
+    
+    Args:
+        df: Rows with the columns of sales.csv
+        rejects_file: File invalid rows are appended to (optional)
+        validate: Validate and quarantine rows (defaults to ETL_CONFIG['validate'])
+    
+    Returns:
+        Number of rows received, rejected and new, and of cube cells updated
+    """
+    if validate is None:
+        validate = ETL_CONFIG['validate']
+    stats = {'rows': len(df), 'rejected': 0, 'new': 0, 'cells': 0}
+    staging = f"{SCHEMA_CONFIG['staging_schema']}.{STREAM_STAGING_TABLE}"
+    
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if ETL_CONFIG['extend_time_dimension']:
+            extend_time_dimension(conn, df['date_id'])
+        cur = conn.cursor()
+        compact = uses_compact_facts(cur)
+        if validate:
+            df, rejects, _ = validate_chunk(df, 'stg_sales', conn, FACT_DIMENSION_KEYS['stg_sales'],
+                                            compact)
+            stats['rejected'] = len(rejects)
+            if len(rejects) and rejects_file:
+                write_rejects(rejects, rejects_file)
+        
+        # A sale delivered twice within the batch is inserted (and counted) once
+        df = df.drop_duplicates('sale_id', keep='last')
+        df = downcast(df, 'stg_sales')
+        df = resolve_surrogate_keys(df, 'stg_sales', conn)
+        
+        cur.execute(f"TRUNCATE TABLE {staging}")
+        _copy_to_staging(cur, df, STREAM_STAGING_TABLE)
+        
+        # Insert the sales and keep only the new ones in staging
+        insert = _fact_merge_query('fact_sales', compact=compact,
+                                   staging_table=STREAM_STAGING_TABLE, insert_only=True)
+        cur.execute(f"""
+        WITH inserted AS ({insert})
+        DELETE FROM {staging} s
+        WHERE NOT EXISTS (SELECT 1 FROM inserted WHERE inserted.sale_id = s.sale_id)
+        """)
+        stats['new'] = len(df) - cur.rowcount
+        if stats['new']:
+            stats['cells'] = add_to_sales_cube(cur, STREAM_STAGING_TABLE)
+            add_to_customer_activity(cur, STREAM_STAGING_TABLE)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    
+    if stats['new']:
+        update_customer_sketches(staging_table=STREAM_STAGING_TABLE)
+    return stats
+
+def run_etl(data_dir: str = RAW_DATA_DIR, keep_staging: Optional[bool] = None,
+            resume: bool = True, force: bool = False, dimensions: bool = True,
+            facts: bool = True,
+            workers: Optional[int] = None) -> Pipeline:
+    """
+    Run the complete ETL process.
+    
+    The ETL is a task graph (see utils/pipeline.py): every source file is
+    staged and every dimension and fact table merged by its own task, which
+    starts as soon as the tasks it needs have completed. The dimensions load
+    at the same time, each fact file is staged once the dimensions it refers
+    to are loaded, and the aggregates of a fact table are built once it is
+    merged and analyzed.
+    
+    Every stage is recorded in the run ledger. If a previous run failed, it
+    is resumed: completed stages are skipped and a partially staged file
+    continues after its last committed chunk. Source files unchanged since
+    the last completed run are not reloaded.
+    
+    Args:
+        data_dir: Directory containing the source CSV files
+        keep_staging: Keep the staging tables after a successful run
+            (defaults to ETL_CONFIG['keep_staging'])
+        resume: Resume the last unfinished run instead of starting over
+        force: Reload every source file even if unchanged
+        dimensions: Load the dimension files
+        facts: Load the fact files, then update the sketches, the cube, the
+            customer activity and the current stock
+            (a sharded load runs the dimensions once and the facts once per
+            shard, see utils/shards.py)
+        workers: Tasks run at once (defaults to PIPELINE_CONFIG['workers'])
+    
+    Returns:
+        The pipeline that ran, with its task timings (see Pipeline.report)
+    """
+    logger.info("Starting ETL process...")
+    
+    # Staging tables are dropped after each successful run unless kept
+    create_staging_tables()
+    create_etl_tables()
+    create_sketch_tables()
+    create_cube_tables()
+    create_customer_activity_tables()
+    create_inventory_tables()
+    
+    conn = psycopg2.connect(**DB_CONFIG)
+    ledger = RunLedger.open(conn, resume)
+    if ledger.resumed:
+        logger.info(f"Resuming ETL run {ledger.run_id}")
+    
+    pipeline = Pipeline('etl', workers)
+    
+    def stage(name: str, step, dependencies=()) -> str:
+        """Add a merge step recorded in the ledger as a task."""
+        return pipeline.add(name, partial(run_stage, ledger, name, step), dependencies)
+    
+    if dimensions:
+        # Load dimension data to staging, then each dimension table
+        for csv_file, staging_table in DIMENSION_FILES:
+            pipeline.add(staging_table, partial(stage_source_file, ledger, csv_file,
+                                                staging_table, data_dir, force))
+        for dimension, staging_table in DIMENSION_TABLES.items():
+            stage(dimension, partial(load_dimension_table, dimension), [staging_table])
     
-    # Load data to staging
-    load_csv_to_staging('products.csv', 'stg_products')
-    load_csv_to_staging('customers.csv', 'stg_customers')
-    load_csv_to_staging('time_dimension.csv', 'stg_time_dimension')
-    load_csv_to_staging('stores.csv', 'stg_stores')
-    load_csv_to_staging('sales.csv', 'stg_sales')
-    load_csv_to_staging('inventory.csv', 'stg_inventory')
+    if facts:
+        # Load fact data to staging (needs the keys of the dimensions it refers to)
+        for csv_file, staging_table in FACT_FILES:
+            pipeline.add(staging_table,
+                         partial(stage_source_file, ledger, csv_file, staging_table, data_dir, force),
+                         [dimension for dimension in FACT_DIMENSION_KEYS[staging_table].values()
+                          if dimension in pipeline])
+        
+        # Load fact tables and refresh their statistics for the aggregates
+        for fact_table, spec in FACT_TABLES.items():
+            stage(fact_table, partial(load_fact_table, fact_table), [spec['staging_table']])
+            stage(f'analyze_{fact_table}', partial(analyze_fact_table, fact_table), [fact_table])
+        
+        # Add the staged sales to the distinct customer sketches
+        stage('sketches', update_customer_sketches, ['analyze_fact_sales'])
+        
+        # Rebuild the pre-aggregated sales cube
+        stage('cube', build_sales_cube, ['analyze_fact_sales'])
+        
+        # Rebuild the monthly customer activity
+        stage('customer_activity', build_customer_activity, ['analyze_fact_sales'])
+        
+        # Move the current stock to the staged inventory snapshots
+        stage('current_stock', update_current_stock, ['analyze_fact_inventory'])
+        
+        # Compact old weekly inventory snapshots into monthly ones
+        if ETL_CONFIG['inventory_compact_after_days'] > 0:
+            stage('compact_inventory', compact_inventory_snapshots, ['current_stock'])
     
-    # Load dimension tables
-    load_dimension_tables()
+    try:
+        pipeline.run()
+        ledger.finish()
+    finally:
+        conn.close()
     
-    # Load fact tables
-    load_fact_tables()
+    if keep_staging is None:
+        keep_staging = ETL_CONFIG['keep_staging']
+    if not keep_staging:
+        drop_staging_tables()
     
-    print("ETL process completed successfully!")
+    logger.info("ETL process completed successfully!")
+    return pipeline
 
 if __name__ == '__main__':
     run_etl() 
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Current stock and snapshot compaction of the inventory facts.
+
+The inventory facts hold a snapshot per store, product and week, so the
+stock on hand is the ending quantity of the latest snapshot, not a sum over
+the history. The current stock table keeps that snapshot per store and
+product; the ETL updates it from the staged inventory rows, so a load costs
+time in proportion to the new snapshots, and the low stock queries (see
+queries/analytics_queries.py) read its partial index of the rows below their
+reorder point.
+
+Old weekly snapshots can be compacted into one snapshot per month: the last
+snapshot of the month, with the beginning quantity of the first one and the
+units received, sold and damaged of all of them. Month end stock and the
+unit totals are unchanged, while the table shrinks about four times.
+"""
+from datetime import date, timedelta
+from typing import Optional
+import psycopg2
+from config import DB_CONFIG, SCHEMA_CONFIG, ETL_CONFIG
+from utils.db_setup import uses_compact_facts
+from utils.logging_utils import setup_logger
+from utils.schema import INTEGER_RANGES
+
+logger = setup_logger(__name__)
+
+def _current_stock_query(source: str) -> str:
+    """
+    Build the upsert of the latest snapshot per store and product of a table.
+
+    Rows already holding a later snapshot are kept.
+
+    Args:
+        source: Table with the inventory rows (fact or staging table)
+
+    Returns:
+        SQL statement
+    """
+    return f"""
+    INSERT INTO {SCHEMA_CONFIG['fact_schema']}.current_stock AS stock (
+        store_id, product_id, date_key, inventory_id,
+        ending_quantity, reorder_point, reorder_quantity
+    )
+    SELECT DISTINCT ON (s.store_id, p.product_id)
+        s.store_id,
+        p.product_id,
+        i.date_key,
+        i.inventory_id,
+        i.ending_quantity,
+        i.reorder_point,
+        i.reorder_quantity
+    FROM {source} i
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store s ON i.store_key = s.store_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_product p ON i.product_key = p.product_key
+    ORDER BY s.store_id, p.product_id, i.date_key DESC, i.inventory_id DESC
+    ON CONFLICT (store_id, product_id) DO UPDATE SET
+        date_key = EXCLUDED.date_key,
+        inventory_id = EXCLUDED.inventory_id,
+        ending_quantity = EXCLUDED.ending_quantity,
+        reorder_point = EXCLUDED.reorder_point,
+        reorder_quantity = EXCLUDED.reorder_quantity
+    WHERE (EXCLUDED.date_key, EXCLUDED.inventory_id) >= (stock.date_key, stock.inventory_id)
+    """
+
+def update_current_stock(full: bool = False, staging_table: str = 'stg_inventory') -> int:
+    """
+    Update the current stock from the staged inventory snapshots.
+
+    The table is rebuilt from the inventory fact table instead when it is
+    empty or when a full rebuild is requested.
+
+    Args:
+        full: Rebuild the current stock from the fact table
+        staging_table: Staging table holding the inventory rows to add
+
+    Returns:
+        Number of current stock rows updated or added
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {SCHEMA_CONFIG['fact_schema']}.current_stock)")
+    full = full or cur.fetchone()[0]
+    if full:
+        cur.execute(f"TRUNCATE TABLE {SCHEMA_CONFIG['fact_schema']}.current_stock")
+    source = (f"{SCHEMA_CONFIG['fact_schema']}.fact_inventory" if full
+              else f"{SCHEMA_CONFIG['staging_schema']}.{staging_table}")
+    logger.info(f"Updating current stock from {source}...")
+    cur.execute(_current_stock_query(source))
+    rows = cur.rowcount
+    cur.execute(f"ANALYZE {SCHEMA_CONFIG['fact_schema']}.current_stock")
+    conn.commit()
+    cur.close()
+    conn.close()
+    logger.info(f"Current stock updated with {rows} rows.",
+                extra={'stage': 'current_stock', 'rows': rows})
+    return rows
+
+def compaction_cutoff(latest_date_key: int, older_than_days: int) -> int:
+    """
+    Return the first date key left uncompacted.
+
+    Whole months only are compacted: the cutoff is the first day of the
+    month older_than_days before the latest snapshot.
+
+    Args:
+        latest_date_key: Date key (YYYYMMDD) of the latest snapshot
+        older_than_days: Age in days of the snapshots to compact
+
+    Returns:
+        Date key (YYYYMMDD)
+    """
+    latest = date(latest_date_key // 10000, latest_date_key // 100 % 100, latest_date_key % 100)
+    cutoff = latest - timedelta(days=older_than_days)
+    return cutoff.year * 10000 + cutoff.month * 100 + 1
+
+def compact_inventory_snapshots(older_than_days: Optional[int] = None) -> int:
+    """
+    Compact the inventory snapshots of old months into one per month.
+
+    Months already compacted are left as they are, so the compaction can
+    run after every load. Reloading a source file brings the weekly
+    snapshots of compacted months back until the next compaction. Under
+    the compact layout, months whose unit totals would not fit the
+    SMALLINT columns keep their weekly snapshots.
+
+    Args:
+        older_than_days: Age in days, relative to the latest snapshot, of
+            the snapshots to compact (defaults to
+            ETL_CONFIG['inventory_compact_after_days'], 0 meaning never)
+
+    Returns:
+        Number of snapshots removed
+    """
+    if older_than_days is None:
+        older_than_days = ETL_CONFIG['inventory_compact_after_days']
+    if older_than_days <= 0:
+        return 0
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT MAX(date_key) FROM {SCHEMA_CONFIG['fact_schema']}.fact_inventory")
+        latest = cur.fetchone()[0]
+        if latest is None:
+            return 0
+        cutoff = compaction_cutoff(latest, older_than_days)
+        logger.info(f"Compacting inventory snapshots before {cutoff}...")
+
+        # Compact facts hold the units in SMALLINT columns: months whose
+        # totals would not fit keep their weekly snapshots
+        fits = ''
+        if uses_compact_facts(cur):
+            fits = ''.join(f"\n            AND SUM({column}) <= {INTEGER_RANGES['SMALLINT'][1]}"
+                           for column in ('units_received', 'units_sold', 'units_damaged'))
+
+        # The last snapshot of every month takes the totals of the month and the
+        # others are deleted, in one statement
+        cur.execute(f"""
+        WITH monthly AS (
+            SELECT
+                store_key,
+                product_key,
+                date_key / 100 AS month_key,
+                (ARRAY_AGG(inventory_id ORDER BY date_key DESC, inventory_id DESC))[1] AS keep_id,
+                (ARRAY_AGG(beginning_quantity ORDER BY date_key, inventory_id))[1] AS beginning_quantity,
+                SUM(units_received) AS units_received,
+                SUM(units_sold) AS units_sold,
+                SUM(units_damaged) AS units_damaged
+            FROM {SCHEMA_CONFIG['fact_schema']}.fact_inventory
+            WHERE date_key < %(cutoff)s
+            GROUP BY store_key, product_key, date_key / 100
+            HAVING COUNT(*) > 1{fits}
+        ),
+        kept AS (
+            UPDATE {SCHEMA_CONFIG['fact_schema']}.fact_inventory fi SET
+                beginning_quantity = m.beginning_quantity,
+                units_received = m.units_received,
+                units_sold = m.units_sold,
+                units_damaged = m.units_damaged
+            FROM monthly m
+            WHERE fi.inventory_id = m.keep_id
+        )
+        DELETE FROM {SCHEMA_CONFIG['fact_schema']}.fact_inventory fi
+        USING monthly m
+        WHERE fi.store_key = m.store_key
+            AND fi.product_key = m.product_key
+            AND fi.date_key / 100 = m.month_key
+            AND fi.date_key < %(cutoff)s
+            AND fi.inventory_id <> m.keep_id
+        """, {'cutoff': cutoff})
+        removed = cur.rowcount
+        cur.execute(f"ANALYZE {SCHEMA_CONFIG['fact_schema']}.fact_inventory")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    logger.info(f"Compacted inventory snapshots before {cutoff}: {removed} removed.",
+                extra={'stage': 'compact_inventory', 'rows': removed})
+    return removed
@@ -0,0 +1,114 @@
+"""
+Natural to surrogate key lookup cache for the sales data warehouse.
+"""
+import threading
+import pandas as pd
+from typing import Dict, Optional, Tuple
+from config import SCHEMA_CONFIG
+
+# Dimension table -> (natural key column, surrogate key column)
+DIMENSION_KEYS: Dict[str, Tuple[str, str]] = {
+    'dim_product': ('product_id', 'product_key'),
+    'dim_customer': ('customer_id', 'customer_key'),
+    'dim_store': ('store_id', 'store_key'),
+    'dim_time': ('date_id', 'date_key')
+}
+
+# Type 2 dimensions: facts always reference the current version
+VERSIONED_DIMENSIONS = {'dim_product', 'dim_customer', 'dim_store'}
+
+class DimensionKeyCache:
+    """In-memory natural key -> surrogate key map for one dimension table."""
+
+    def __init__(self, dimension: str):
+        """Initialize an empty cache for the given dimension table."""
+        self.dimension = dimension
+        self.natural_key, self.surrogate_key = DIMENSION_KEYS[dimension]
+        self._keys: Dict[str, int] = {}
+        self._max_key: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, natural_key) -> bool:
+        return str(natural_key) in self._keys
+
+    def refresh(self, conn, full: bool = False) -> int:
+        """
+        Pull new dimension keys from the database.
+
+        Surrogate keys only ever grow, so an incremental refresh reads just the
+        rows added since the previous refresh. For versioned dimensions a new
+        version replaces the cached key of its natural key.
+
+        Args:
+            conn: Open database connection
+            full: Discard the cache and reload every key
+
+        Returns:
+            Number of keys read
+        """
+        # Refreshes run one at a time, so one cannot drop the keys another added
+        with self._lock:
+            # Every refresh fills a new map: lookups in other threads keep
+            # reading the previous one, never a map being changed
+            keys = {} if full else dict(self._keys)
+            max_key = None if full else self._max_key
+
+            query = f"""
+            SELECT {self.natural_key}, {self.surrogate_key}
+            FROM {SCHEMA_CONFIG['dim_schema']}.{self.dimension}
+            """
+            conditions = []
+            params = None
+            if self.dimension in VERSIONED_DIMENSIONS:
+                conditions.append("is_current")
+            if max_key is not None:
+                conditions.append(f"{self.surrogate_key} > %s")
+                params = (max_key,)
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += f" ORDER BY {self.surrogate_key}"
+
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+
+            for natural_key, surrogate_key in rows:
+                keys[natural_key] = surrogate_key
+            if rows:
+                max_key = rows[-1][1]
+            self._keys, self._max_key = keys, max_key
+        return len(rows)
+
+    def lookup(self, natural_key) -> Optional[int]:
+        """Return the surrogate key for a natural key, or None if unknown."""
+        return self._keys.get(str(natural_key))
+
+    def map(self, values: pd.Series) -> pd.Series:
+        """
+        Map a column of natural keys to surrogate keys.
+
+        Args:
+            values: Natural keys (any dtype; compared as strings)
+
+        Returns:
+            Float series of surrogate keys with NaN where the key is unknown
+        """
+        return values.astype(str).map(self._keys)
+
+_caches: Dict[str, DimensionKeyCache] = {}
+_caches_lock = threading.Lock()
+
+def get_key_cache(dimension: str) -> DimensionKeyCache:
+    """Return the shared key cache for a dimension table."""
+    with _caches_lock:
+        if dimension not in _caches:
+            _caches[dimension] = DimensionKeyCache(dimension)
+        return _caches[dimension]
+
+def clear_key_caches() -> None:
+    """Drop all cached keys, e.g. after the warehouse database was recreated."""
+    with _caches_lock:
+        _caches.clear()
@@ -1,35 +1,169 @@
 """
 Logging utilities for the project.
+
+Loggers set up here hand their records to an in-memory queue. A background
+listener thread formats the records and writes them to the console and to
+LOG_CONFIG['file'], so a slow terminal or disk never stalls the ETL. The
+listener starts with the first record, so importing a module that sets up
+a logger opens no file and starts no thread. With
+LOG_CONFIG['json'] every record is written as one JSON object per line,
+including the structured fields passed as `extra` (stage, rows, ...).
+ProgressLogger rate-limits the progress messages of per-chunk loops.
 """
+import atexit
+import json
 import logging
-from typing import Optional
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
 from config import LOG_CONFIG
 
+# Record attributes written as fields of JSON records when passed as `extra`
+STRUCTURED_FIELDS = ('stage', 'table', 'run_id', 'rows', 'rows_per_second', 'elapsed_seconds',
+                     'frame_bytes', 'peak_rss_bytes', 'latency_seconds')
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queues records, starting the listener with the first one."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Put a record on the queue, starting the listener if it is not running."""
+        if _listener is None:
+            start_logging()
+        super().enqueue(record)
+
+# Every logger puts its records on this queue; the listener drains it
+_queue: queue.SimpleQueue = queue.SimpleQueue()
+_queue_handler = _LazyQueueHandler(_queue)
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format a record with its structured fields."""
+        entry: Dict[str, Any] = {
+            'timestamp': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        return json.dumps(entry, default=str)
+
+def _output_handlers() -> List[logging.Handler]:
+    """Create the console and file handlers the listener writes to."""
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stderr)]
+    if LOG_CONFIG['file']:
+        # Opened here: a file that cannot be written would stop the listener thread
+        try:
+            handlers.append(logging.FileHandler(LOG_CONFIG['file'], encoding='utf-8'))
+        except OSError as e:
+            print(f"Cannot write log file {LOG_CONFIG['file']}: {e}", file=sys.stderr)
+    if LOG_CONFIG['json']:
+        formatter = JsonFormatter(datefmt=LOG_CONFIG['datefmt'])
+    else:
+        formatter = logging.Formatter(fmt=LOG_CONFIG['format'], datefmt=LOG_CONFIG['datefmt'])
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def start_logging() -> None:
+    """Start the background listener that writes queued records (once)."""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = logging.handlers.QueueListener(_queue, *_output_handlers())
+            _listener.start()
+
+def stop_logging() -> None:
+    """Write the queued records and stop the listener; it restarts with the next record."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+atexit.register(stop_logging)
+
 def setup_logger(name: str, level: Optional[str] = None) -> logging.Logger:
     """
     Set up a logger with the specified name and level.
-    
+
     Args:
         name: The name of the logger
         level: Optional logging level (defaults to LOG_CONFIG['level'])
-    
+
     Returns:
         logging.Logger: Configured logger instance
     """
     logger = logging.getLogger(name)
-    
+
     # Set level
     log_level = level or LOG_CONFIG['level']
     logger.setLevel(getattr(logging, log_level))
-    
-    # Create console handler if no handlers exist
-    if not logger.handlers:
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            fmt=LOG_CONFIG['format'],
-            datefmt=LOG_CONFIG['datefmt']
+
+    # Records go through the queue only, not to handlers of the root logger too
+    if _queue_handler not in logger.handlers:
+        logger.addHandler(_queue_handler)
+    logger.propagate = False
+
+    return logger
+
+class ProgressLogger:
+    """
+    Logs the progress of a loop at most once per interval.
+
+    Calls to update are cheap, so loops can report every chunk; a message
+    with the rows processed so far and the rate is logged only when
+    LOG_CONFIG['progress_interval'] seconds have passed since the last one.
+    """
+
+    def __init__(self, logger: logging.Logger, stage: str, total: Optional[int] = None,
+                 interval: Optional[float] = None):
+        """
+        Initialize the progress of a stage.
+
+        Args:
+            logger: Logger to write to
+            stage: Name of the stage, logged with every message
+            total: Number of rows expected (optional)
+            interval: Minimum seconds between messages (defaults to
+                LOG_CONFIG['progress_interval'])
+        """
+        self.logger = logger
+        self.stage = stage
+        self.total = total
+        self.interval = LOG_CONFIG['progress_interval'] if interval is None else interval
+        self.rows = 0
+        self.started = self._logged = time.monotonic()
+
+    def update(self, rows: int) -> None:
+        """Add processed rows and log the progress if the interval has passed."""
+        self.rows += rows
+        now = time.monotonic()
+        if now - self._logged >= self.interval:
+            self._logged = now
+            self._log(now, 'processed')
+
+    def done(self) -> None:
+        """Log the final row count and rate of the stage."""
+        self._log(time.monotonic(), 'done')
+
+    def _log(self, now: float, state: str) -> None:
+        """Log the rows processed so far."""
+        elapsed = now - self.started
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        of_total = f"/{self.total}" if self.total else ''
+        self.logger.info(
+            f"{self.stage}: {state} {self.rows}{of_total} rows ({rate:,.0f} rows/s)",
+            extra={'stage': self.stage, 'rows': self.rows,
+                   'rows_per_second': round(rate, 1), 'elapsed_seconds': round(elapsed, 3)}
         )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-    
-    return logger 
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+Memory instrumentation for the pandas code paths.
+
+track_memory wraps a stage of the ETL or of the file conversions. When
+profiling is enabled (ETL_CONFIG['profile_memory']) it logs the size of the
+largest DataFrame the stage reported and the peak resident set size of the
+process during the stage. The peak is sampled while the stage runs, together
+with the process high-water mark if the stage raised it, and never reset, so
+stages running at once (see utils/pipeline.py) do not disturb each other's
+measurements. The process is shared, though: a stage's peak includes the
+memory of the stages running alongside it, so profile with one pipeline
+worker (PIPELINE_WORKERS=1) to attribute memory to single stages. Without
+/proc the peak since the process started is reported.
+"""
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import pandas as pd
+from config import ETL_CONFIG
+from utils.logging_utils import setup_logger
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = setup_logger(__name__)
+
+# Seconds between the RSS samples taken while a stage runs
+SAMPLE_INTERVAL = 0.05
+
+def frame_memory(df: pd.DataFrame) -> int:
+    """Return the bytes used by a DataFrame, including the strings it holds."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def _status_bytes(field: str) -> Optional[int]:
+    """Read a memory field (in kB) of /proc/self/status."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def current_rss() -> Optional[int]:
+    """Return the resident set size of the process in bytes, if known."""
+    return _status_bytes('VmRSS')
+
+def peak_rss() -> Optional[int]:
+    """Return the peak resident set size of the process in bytes, if known."""
+    peak = _status_bytes('VmHWM')
+    if peak is None and resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == 'darwin' else 1024
+    return peak
+
+class _RssSampler:
+    """Samples the resident set size in a background thread, keeping the largest."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        """Start sampling (a no-op where the RSS cannot be read)."""
+        self.interval = interval
+        self.high_water_mark = _status_bytes('VmHWM')
+        self.peak = current_rss()
+        self._stopped = threading.Event()
+        self._thread = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+            self._thread.start()
+
+    def _sample(self) -> None:
+        """Keep the current RSS if it is the largest so far."""
+        rss = current_rss()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    def _run(self) -> None:
+        """Sample until stopped."""
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def stop(self) -> Optional[int]:
+        """
+        Stop sampling.
+
+        Returns:
+            The peak RSS during the sampling in bytes (None without /proc)
+        """
+        if self._thread is None:
+            return None
+        self._stopped.set()
+        self._thread.join()
+        self._sample()
+        # A high-water mark raised since the start was reached while sampling
+        high_water_mark = _status_bytes('VmHWM')
+        if (high_water_mark is not None and self.high_water_mark is not None
+                and high_water_mark > self.high_water_mark):
+            self.peak = max(self.peak, high_water_mark)
+        return self.peak
+
+def _megabytes(size: Optional[int]) -> str:
+    """Format a size in bytes as megabytes."""
+    return 'unknown' if size is None else f'{size / 2 ** 20:.1f} MB'
+
+class StageMemory:
+    """Collects the DataFrame sizes of one stage."""
+
+    def __init__(self, stage: str, enabled: bool):
+        """Initialize the measurements of a stage."""
+        self.stage = stage
+        self.enabled = enabled
+        self.frame_bytes = 0
+        self.frames = 0
+
+    def frame(self, df: pd.DataFrame) -> None:
+        """Record the size of a DataFrame held by the stage (no-op when disabled)."""
+        if self.enabled:
+            self.frame_bytes = max(self.frame_bytes, frame_memory(df))
+            self.frames += 1
+
+@contextmanager
+def track_memory(stage: str, enabled: Optional[bool] = None) -> Iterator[StageMemory]:
+    """
+    Measure the memory used by a stage.
+
+    Args:
+        stage: Name of the stage, logged with the measurements
+        enabled: Measure and log (defaults to ETL_CONFIG['profile_memory'])
+
+    Yields:
+        StageMemory to report the stage's DataFrames to
+    """
+    memory = StageMemory(stage, ETL_CONFIG['profile_memory'] if enabled is None else enabled)
+    if not memory.enabled:
+        yield memory
+        return
+    sampler = _RssSampler()
+    try:
+        yield memory
+    finally:
+        peak = sampler.stop()
+        sampled = peak is not None
+        if not sampled:
+            peak = peak_rss()
+        frames = f", largest of {memory.frames} DataFrames {_megabytes(memory.frame_bytes)}" if memory.frames else ''
+        logger.info(
+            f"{stage}: peak RSS {_megabytes(peak)}{'' if sampled else ' (since start)'}{frames}",
+            extra={'stage': stage, 'peak_rss_bytes': peak, 'frame_bytes': memory.frame_bytes}
+        )
@@ -0,0 +1,211 @@
+"""
+Task graph executor for the setup, generation and ETL pipelines.
+
+A pipeline is a set of named tasks, each with the tasks it depends on. Tasks
+whose dependencies have completed run at once on a pool of worker threads
+(PIPELINE_CONFIG['workers'] at most), so independent work such as the four
+dimensions overlaps and the pipeline takes about as long as its longest
+dependency chain. Tasks are mostly database statements and file I/O, which
+release the GIL; the CPU-bound part of staging runs in pandas.
+
+A task failing with a transient database error (a lost connection, a
+deadlock or serialization failure) is retried after a growing delay. Any
+other error, or a task out of retries, stops the pipeline: running tasks
+finish, no new ones start, and the error is raised. The ETL tasks record
+themselves in the run ledger, so the next run resumes after them.
+
+After a run, report() gives every task's start and duration and the
+critical path: the dependency chain with the longest total duration, which
+bounds the run time however many workers there are.
+"""
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import psycopg2
+from config import PIPELINE_CONFIG
+from utils.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# Errors worth retrying: lost connections, deadlocks and serialization
+# failures (psycopg2.extensions.TransactionRollbackError is an OperationalError)
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+class Pipeline:
+    """Named tasks with dependencies, run concurrently in dependency order."""
+
+    def __init__(self, name: str, workers: Optional[int] = None,
+                 retries: Optional[int] = None, retry_delay: Optional[float] = None):
+        """
+        Initialize an empty pipeline.
+
+        Args:
+            name: Name of the pipeline, used in log messages
+            workers: Tasks run at once (defaults to PIPELINE_CONFIG['workers'])
+            retries: Retries of a task failing with a transient error
+                (defaults to PIPELINE_CONFIG['retries'])
+            retry_delay: Seconds before the first retry, doubled for every
+                further one (defaults to PIPELINE_CONFIG['retry_delay_seconds'])
+        """
+        self.name = name
+        self.workers = max(1, PIPELINE_CONFIG['workers'] if workers is None else workers)
+        self.retries = PIPELINE_CONFIG['retries'] if retries is None else retries
+        self.retry_delay = (PIPELINE_CONFIG['retry_delay_seconds'] if retry_delay is None
+                            else retry_delay)
+        self.tasks: Dict[str, Callable[[], Any]] = {}
+        self.dependencies: Dict[str, List[str]] = {}
+        self.timings: Dict[str, Dict[str, Any]] = {}
+        self.seconds = 0.0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tasks
+
+    def add(self, name: str, function: Callable[[], Any],
+            dependencies: Iterable[str] = ()) -> str:
+        """
+        Add a task.
+
+        Dependencies must be added first, so the graph has no cycles.
+
+        Args:
+            name: Unique task name
+            function: Function called without arguments to run the task
+            dependencies: Names of the tasks that must complete first
+
+        Returns:
+            Task name
+        """
+        if name in self.tasks:
+            raise ValueError(f"Task {name} is already in pipeline {self.name}")
+        dependencies = list(dependencies)
+        unknown = [dependency for dependency in dependencies if dependency not in self.tasks]
+        if unknown:
+            raise ValueError(f"Task {name} depends on unknown tasks: {', '.join(unknown)}")
+        self.tasks[name] = function
+        self.dependencies[name] = dependencies
+        return name
+
+    def _attempt(self, name: str, started: float) -> None:
+        """Run a task, retrying transient errors, and record its timing."""
+        timing = self.timings[name]
+        timing['start'] = time.monotonic() - started
+        for attempt in range(self.retries + 1):
+            timing['attempts'] = attempt + 1
+            try:
+                self.tasks[name]()
+                break
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"Task {name} failed ({e}); retrying in {delay:.1f}s",
+                               extra={'stage': name})
+                time.sleep(delay)
+            finally:
+                timing['seconds'] = time.monotonic() - started - timing['start']
+        timing['status'] = 'completed'
+
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Run every task once its dependencies have completed.
+
+        Tasks run with the context (e.g. the shard scope of SCHEMA_CONFIG)
+        of the calling thread.
+
+        Returns:
+            Timing per task: start (seconds after the pipeline started),
+            seconds, attempts and status ('completed', 'failed' or 'not run')
+        """
+        self.timings = {name: {'start': None, 'seconds': 0.0, 'attempts': 0, 'status': 'not run'}
+                        for name in self.tasks}
+        logger.info(f"Running pipeline {self.name}: {len(self.tasks)} tasks, "
+                    f"{self.workers} workers")
+        started = time.monotonic()
+        waiting = list(self.tasks)
+        completed = set()
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while waiting or running:
+                # Start ready tasks in the order they were added, none after a failure
+                for name in list(waiting) if error is None else []:
+                    if len(running) == self.workers:
+                        break
+                    if all(dependency in completed for dependency in self.dependencies[name]):
+                        waiting.remove(name)
+                        context = contextvars.copy_context()
+                        running[pool.submit(context.run, self._attempt, name, started)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        completed.add(name)
+                    except Exception as e:
+                        self.timings[name]['status'] = 'failed'
+                        logger.error(f"Task {name} of pipeline {self.name} failed: {e}",
+                                     extra={'stage': name})
+                        error = error or e
+        self.seconds = time.monotonic() - started
+        if error is not None:
+            raise error
+        path = self.critical_path()
+        logger.info(f"Pipeline {self.name} completed in {self.seconds:.1f}s "
+                    f"(critical path {sum(self.timings[name]['seconds'] for name in path):.1f}s, "
+                    f"{sum(timing['seconds'] for timing in self.timings.values()):.1f}s of work)",
+                    extra={'stage': self.name, 'elapsed_seconds': round(self.seconds, 3)})
+        return self.timings
+
+    def critical_path(self) -> List[str]:
+        """
+        Return the dependency chain with the longest total duration.
+
+        Returns:
+            Task names, first to last (empty before a run)
+        """
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        # Tasks are added after their dependencies, so this is a topological order
+        for name in self.tasks:
+            before = max(self.dependencies[name], key=lambda dependency: finish[dependency],
+                         default=None)
+            previous[name] = before
+            finish[name] = (finish[before] if before else 0.0) + self.timings.get(
+                name, {}).get('seconds', 0.0)
+        if not finish or not self.timings:
+            return []
+        path = []
+        name = max(finish, key=finish.get)
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1]
+
+    def report(self) -> str:
+        """
+        Format the timings of the last run with the critical path.
+
+        Returns:
+            Report text: one line per task in start order, critical path
+            tasks marked with *
+        """
+        path = self.critical_path()
+        work = sum(timing['seconds'] for timing in self.timings.values())
+        lines = [
+            f"Pipeline {self.name}: {len(self.tasks)} tasks in {self.seconds:.2f}s "
+            f"with {self.workers} workers ({work:.2f}s of work, critical path "
+            f"{sum(self.timings[name]['seconds'] for name in path):.2f}s)",
+            f"  {'task':<28} {'start':>8} {'seconds':>8} {'attempts':>8}  status"
+        ]
+        order = sorted(self.tasks, key=lambda name: (self.timings[name]['start'] is None,
+                                                      self.timings[name]['start'] or 0.0))
+        for name in order:
+            timing = self.timings[name]
+            start = '' if timing['start'] is None else f"{timing['start']:.2f}"
+            lines.append(f"{'*' if name in path else ' '} {name:<28} {start:>8} "
+                         f"{timing['seconds']:>8.2f} {timing['attempts']:>8}  {timing['status']}")
+        lines.append(f"Critical path: {' -> '.join(path)}")
+        return '\n'.join(lines)
@@ -0,0 +1,187 @@
+"""
+Column types of the source files, derived from the staging table DDL.
+
+The staging tables in utils/db_setup.py define the type of every source
+column. This registry turns them into pandas dtypes so that source files are
+read compactly instead of with default inference: repeated text values
+(categories, segments, payment methods and the dimension keys of fact rows)
+become categoricals, integers become int32 and, where the values are not
+sent on as text, dates become datetime64. The warehouse tables the staging
+tables are merged into define which source columns are required and which
+the compact fact layout narrows.
+"""
+import re
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from utils.db_setup import COMPACT_FACT_TABLES, STAGING_TABLES, WAREHOUSE_TABLES
+
+# Source file -> staging table it is loaded into
+SOURCE_TABLES = {
+    'products.csv': 'stg_products',
+    'customers.csv': 'stg_customers',
+    'time_dimension.csv': 'stg_time_dimension',
+    'stores.csv': 'stg_stores',
+    'sales.csv': 'stg_sales',
+    'inventory.csv': 'stg_inventory'
+}
+
+# Staging table -> warehouse table its rows are merged into
+TARGET_TABLES = {
+    'stg_products': 'dim_product',
+    'stg_customers': 'dim_customer',
+    'stg_time_dimension': 'dim_time',
+    'stg_stores': 'dim_store',
+    'stg_sales': 'fact_sales',
+    'stg_inventory': 'fact_inventory'
+}
+
+# Range of the integer types
+INTEGER_RANGES = {
+    'SMALLINT': (-2 ** 15, 2 ** 15 - 1),
+    'INTEGER': (-2 ** 31, 2 ** 31 - 1),
+    'BIGINT': (-2 ** 63, 2 ** 63 - 1)
+}
+
+# Natural key columns of the source files, always read as text
+KEY_COLUMNS = ('product_id', 'customer_id', 'store_id', 'sale_id', 'inventory_id', 'date_id')
+
+# Dimension keys repeated across the rows of fact files (date_id is kept as
+# text: it is unique per time dimension row and parsed into dates)
+FACT_KEY_COLUMNS = ('product_id', 'customer_id', 'store_id')
+
+# Text columns with few distinct values
+CATEGORICAL_COLUMNS = ('category', 'subcategory', 'brand', 'customer_segment', 'city', 'state',
+                       'country', 'store_type', 'day_of_week', 'holiday_name', 'payment_method')
+
+_COLUMN_TYPE = re.compile(
+    r'^\s*(\w+)\s+(VARCHAR|SMALLINT|INTEGER|BIGINT|DECIMAL|DATE|TIMESTAMP|BOOLEAN)'
+    r'(?:\((\d+)(?:,\s*(\d+))?\))?',
+    re.IGNORECASE | re.MULTILINE
+)
+
+_REQUIRED_COLUMN = re.compile(
+    r'^\s*(\w+)\s+\w+(?:\([\d,\s]+\))?[^,\n]*\b(?:NOT NULL|PRIMARY KEY)\b',
+    re.IGNORECASE | re.MULTILINE
+)
+
+def _parse_column_types(ddl: str) -> Dict[str, Tuple[str, Optional[int], Optional[int]]]:
+    """Read column name -> (type, length or precision, scale) from column definitions."""
+    return {
+        name: (sql_type.upper(), int(size) if size else None, int(scale) if scale else None)
+        for name, sql_type, size, scale in _COLUMN_TYPE.findall(ddl)
+    }
+
+def column_types(staging_table: str) -> Dict[str, Tuple[str, Optional[int], Optional[int]]]:
+    """
+    Read the column types of a staging table from its DDL.
+
+    Args:
+        staging_table: Name of the staging table
+
+    Returns:
+        Column name -> (type, length or precision, scale)
+    """
+    return _parse_column_types(STAGING_TABLES[staging_table])
+
+def required_columns(staging_table: str) -> List[str]:
+    """
+    Return the staging columns the warehouse table requires a value for.
+
+    Args:
+        staging_table: Name of the staging table
+
+    Returns:
+        Columns that are NOT NULL or the primary key in the warehouse table
+    """
+    required = set(_REQUIRED_COLUMN.findall(WAREHOUSE_TABLES[TARGET_TABLES[staging_table]]))
+    return [column for column in column_types(staging_table) if column in required]
+
+def compact_ranges(staging_table: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Return the staging columns narrowed by the compact fact layout.
+
+    Args:
+        staging_table: Name of the staging table
+
+    Returns:
+        Column -> (lowest, highest) value of its compact integer type
+    """
+    compact = COMPACT_FACT_TABLES.get(TARGET_TABLES[staging_table])
+    if compact is None:
+        return {}
+    staged = column_types(staging_table)
+    return {
+        column: INTEGER_RANGES[sql_type]
+        for column, (sql_type, _, _) in _parse_column_types(compact).items()
+        if sql_type in INTEGER_RANGES and column in staged and sql_type != staged[column][0]
+    }
+
+def source_table(file_name: str) -> Optional[str]:
+    """Return the staging table of a source file (or of a sample of it)."""
+    name = file_name[len('sample_'):] if file_name.startswith('sample_') else file_name
+    return SOURCE_TABLES.get(name)
+
+def source_dtypes(staging_table: str) -> Dict[str, object]:
+    """
+    Return the dtypes to read a source file with.
+
+    Text columns are read as strings so values such as '+1...' phone
+    numbers and zero-padded codes are not parsed as numbers; repeated text
+    values are read as categoricals. Numeric columns are left to inference
+    so that malformed values reach validation instead of failing the read
+    (see downcast).
+    """
+    dtypes: Dict[str, object] = {name: str for name, (sql_type, _, _)
+                                 in column_types(staging_table).items() if sql_type == 'VARCHAR'}
+    dtypes.update({key: str for key in KEY_COLUMNS})
+    dtypes.update({name: 'category' for name in CATEGORICAL_COLUMNS if name in dtypes})
+    if staging_table in ('stg_sales', 'stg_inventory'):
+        dtypes.update({key: 'category' for key in FACT_KEY_COLUMNS})
+    return dtypes
+
+def downcast(df: pd.DataFrame, staging_table: str, parse_dates: bool = False) -> pd.DataFrame:
+    """
+    Convert the numeric columns of source rows to compact dtypes.
+
+    INTEGER columns without missing values become int32 (BIGINT columns,
+    DECIMAL amounts and columns with missing or malformed values are left
+    as read); with parse_dates, DATE and TIMESTAMP columns become datetime64.
+    Values keep their text form, so row hashes and staged values do not
+    change.
+
+    Args:
+        df: Source rows (converted in place)
+        staging_table: Name of the staging table the rows belong to
+        parse_dates: Convert date and timestamp columns
+
+    Returns:
+        The converted DataFrame
+    """
+    for column, (sql_type, _, _) in column_types(staging_table).items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if (sql_type == 'INTEGER' and pd.api.types.is_integer_dtype(values)
+                and not values.isna().any()
+                and (values.empty or (values.min() >= -2 ** 31 and values.max() < 2 ** 31))):
+            df[column] = values.astype('int32')
+        elif parse_dates and sql_type in ('DATE', 'TIMESTAMP') and not pd.api.types.is_datetime64_any_dtype(values):
+            df[column] = pd.to_datetime(values, errors='coerce')
+    return df
+
+def read_source(path: str, staging_table: Optional[str], **kwargs) -> pd.DataFrame:
+    """
+    Read a whole source file with the registry dtypes.
+
+    Args:
+        path: CSV file
+        staging_table: Staging table of the file (None: default inference)
+        **kwargs: Further arguments of pandas.read_csv
+
+    Returns:
+        DataFrame with compact dtypes and parsed dates
+    """
+    if staging_table is None:
+        return pd.read_csv(path, **kwargs)
+    df = pd.read_csv(path, dtype=source_dtypes(staging_table), **kwargs)
+    return downcast(df, staging_table, parse_dates=True)
@@ -0,0 +1,234 @@
+"""
+Sharding of the fact data across schemas.
+
+Every shard has its own staging, fact and ETL ledger schemas, named after
+the SCHEMA_CONFIG ones with the shard name as suffix (facts_east,
+staging_east, sales_dw_east), while the conformed dimensions are shared.
+Code runs against a shard inside shard_scope(shard), which overrides the
+schema names for the current thread only, so the table and query builders
+need no shard argument.
+
+A sharded data directory holds the dimension files at its top level and the
+fact files of every shard in a subdirectory named after the shard (see
+partition_fact_files). The ETL loads the dimensions once, then the facts of
+all shards in parallel worker processes, each with its own run ledger, so a
+failed shard is resumed without reloading the others.
+"""
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from multiprocessing import get_context
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import pandas as pd
+from config import (DB_CONFIG, SCHEMA_CONFIG, ETL_CONFIG, PIPELINE_CONFIG, SHARDS, SHARD_CONFIG,
+                    RAW_DATA_DIR)
+from utils.db_setup import (create_schemas, create_fact_tables, create_staging_tables,
+                            create_etl_tables, create_sketch_tables, create_cube_tables,
+                            create_customer_activity_tables, create_inventory_tables,
+                            create_stream_tables)
+from utils.etl_utils import DIMENSION_FILES, FACT_FILES, run_etl
+from utils.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# SCHEMA_CONFIG entries that every shard has its own copy of
+SHARDED_SCHEMAS = ('schema_name', 'staging_schema', 'fact_schema')
+
+_SHARD_NAME = re.compile(r'[a-z][a-z0-9_]*')
+
+def shard_names(shards: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Return the shards to work on.
+
+    Args:
+        shards: Shard names (defaults to SHARDS)
+
+    Returns:
+        Shard names, checked to be usable in schema names
+    """
+    names = list(SHARDS if shards is None else shards)
+    for name in names:
+        if not _SHARD_NAME.fullmatch(name):
+            raise ValueError(f"Invalid shard name {name!r}: use lower case letters, digits and _")
+    return names
+
+def shard_schemas(shard: str) -> Dict[str, str]:
+    """Return the schema names of a shard (the SCHEMA_CONFIG entries it overrides)."""
+    shard_names([shard])
+    return {key: f"{SCHEMA_CONFIG[key]}_{shard}" for key in SHARDED_SCHEMAS}
+
+@contextmanager
+def shard_scope(shard: str) -> Iterator[Dict[str, Any]]:
+    """
+    Point SCHEMA_CONFIG at the schemas of a shard within the with block.
+
+    The override applies to the current thread only.
+
+    Yields:
+        SCHEMA_CONFIG
+    """
+    with SCHEMA_CONFIG.scoped(**shard_schemas(shard)) as config:
+        yield config
+
+def setup_shards(shards: Optional[Sequence[str]] = None) -> None:
+    """
+    Create the schemas and tables of every shard.
+
+    The dimension tables the fact tables refer to must exist already.
+
+    Args:
+        shards: Shard names (defaults to SHARDS)
+    """
+    for shard in shard_names(shards):
+        with shard_scope(shard):
+            create_schemas()
+            create_fact_tables()
+            create_staging_tables()
+            create_etl_tables()
+            create_sketch_tables()
+            create_cube_tables()
+            create_customer_activity_tables()
+            create_inventory_tables()
+            create_stream_tables()
+        logger.info(f"Shard {shard} set up.")
+
+def shard_of(values: pd.Series, shards: Sequence[str]) -> pd.Series:
+    """
+    Assign values of the partition column to shards.
+
+    Values are hashed, so a value always goes to the same shard for a
+    given list of shards.
+
+    Args:
+        values: Partition column values
+        shards: Shard names
+
+    Returns:
+        Shard name per value
+    """
+    hashes = pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+    return pd.Series(pd.Categorical.from_codes(hashes % len(shards), categories=list(shards)),
+                     index=values.index)
+
+def partition_fact_files(source_dir: str, output_dir: str,
+                         shards: Optional[Sequence[str]] = None,
+                         column: Optional[str] = None) -> Dict[str, int]:
+    """
+    Split the fact files of a data directory into a sharded data directory.
+
+    The dimension files are copied to output_dir and the rows of every fact
+    file are written to output_dir/<shard>/ according to the shard of their
+    partition column. Partitioning on the store keeps every store in one
+    shard, so per-store figures never need to be merged across shards. Fact
+    files without the partition column (inventory has no customer_id) are
+    partitioned on store_id, which every fact file has.
+
+    Args:
+        source_dir: Directory with the source CSV files
+        output_dir: Sharded data directory (may be source_dir)
+        shards: Shard names (defaults to SHARDS)
+        column: Partition column (defaults to SHARD_CONFIG['partition_column'])
+
+    Returns:
+        Number of fact rows per shard
+    """
+    shards = shard_names(shards)
+    if not shards:
+        raise ValueError("No shards configured: set WAREHOUSE_SHARDS or pass shards")
+    column = column or SHARD_CONFIG['partition_column']
+    rows = {shard: 0 for shard in shards}
+    for shard in shards:
+        os.makedirs(os.path.join(output_dir, shard), exist_ok=True)
+
+    if os.path.abspath(source_dir) != os.path.abspath(output_dir):
+        for file_name, _ in DIMENSION_FILES:
+            shutil.copyfile(os.path.join(source_dir, file_name), os.path.join(output_dir, file_name))
+
+    for file_name, _ in FACT_FILES:
+        path = os.path.join(source_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        outputs = {shard: os.path.join(output_dir, shard, file_name) for shard in shards}
+        for output in outputs.values():
+            if os.path.exists(output):
+                os.remove(output)
+        # Rows are passed on as read, so the shard files hash like the source
+        for chunk in pd.read_csv(path, dtype=str, keep_default_na=False,
+                                 chunksize=ETL_CONFIG['chunk_size']):
+            assigned = shard_of(chunk[column if column in chunk.columns else 'store_id'], shards)
+            for shard, part in chunk.groupby(assigned, observed=False):
+                output = outputs[shard]
+                part.to_csv(output, mode='a', header=not os.path.exists(output), index=False)
+                rows[shard] += len(part)
+        # Shards without rows still get a file with the header
+        for output in outputs.values():
+            if not os.path.exists(output):
+                pd.read_csv(path, nrows=0).to_csv(output, index=False)
+        logger.info(f"Partitioned {file_name} into {len(shards)} shards")
+    return rows
+
+def _init_worker(db_config: Dict[str, Any], schema_config: Dict[str, Any],
+                 etl_config: Dict[str, Any], pipeline_config: Dict[str, Any]) -> None:
+    """Apply the settings of the parent process in a shard worker process."""
+    DB_CONFIG.update(db_config)
+    SCHEMA_CONFIG.update(schema_config)
+    ETL_CONFIG.update(etl_config)
+    PIPELINE_CONFIG.update(pipeline_config)
+
+def _load_shard(shard: str, data_dir: str, keep_staging: Optional[bool],
+                resume: bool, force: bool) -> str:
+    """Load the fact files of one shard (run in a worker process)."""
+    with shard_scope(shard):
+        run_etl(os.path.join(data_dir, shard), keep_staging, resume, force, dimensions=False)
+    return shard
+
+def run_sharded_etl(data_dir: str = RAW_DATA_DIR, shards: Optional[Sequence[str]] = None,
+                    workers: Optional[int] = None, keep_staging: Optional[bool] = None,
+                    resume: bool = True, force: bool = False) -> None:
+    """
+    Load a sharded data directory: the dimensions once, then every shard in parallel.
+
+    Shards are loaded in separate processes, so staging (which is CPU bound
+    in pandas) scales with the number of shards. All shards are attempted
+    even if one fails; the first error is raised once they have finished.
+
+    Args:
+        data_dir: Sharded data directory (see partition_fact_files)
+        shards: Shard names (defaults to SHARDS)
+        workers: Shards loaded at once (defaults to SHARD_CONFIG['workers'],
+            0 meaning all of them)
+        keep_staging: Keep the staging tables after a successful run
+        resume: Resume the last unfinished run of every shard
+        force: Reload every source file even if unchanged
+    """
+    shards = shard_names(shards)
+    if not shards:
+        raise ValueError("No shards configured: set WAREHOUSE_SHARDS or pass shards")
+    workers = workers if workers is not None else SHARD_CONFIG['workers']
+    workers = min(workers or len(shards), len(shards))
+
+    # Fact rows of every shard resolve their keys against the shared dimensions
+    run_etl(data_dir, keep_staging, resume, force, facts=False)
+
+    logger.info(f"Loading {len(shards)} shards with {workers} workers...")
+    errors = []
+    # Spawned workers do not inherit the parent's threads (e.g. the log listener)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(dict(DB_CONFIG), dict(SCHEMA_CONFIG), dict(ETL_CONFIG),
+                                       dict(PIPELINE_CONFIG))) as pool:
+        futures = {pool.submit(_load_shard, shard, data_dir, keep_staging, resume, force): shard
+                   for shard in shards}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                future.result()
+                logger.info(f"Shard {shard} loaded.")
+            except Exception as e:
+                logger.error(f"Loading shard {shard} failed: {e}")
+                errors.append(e)
+    if errors:
+        raise errors[0]
+    logger.info("Sharded ETL completed successfully!")
@@ -0,0 +1,206 @@
+"""
+HyperLogLog sketches of distinct customers, maintained by the ETL.
+
+Each sketch estimates the number of distinct customers of one member of a
+grouping (a store, a customer segment, or all sales). Sketches only ever
+take the maximum of their registers, so adding the same sales twice does
+not change them: the ETL can add every staged sale, including updates of
+sales loaded before.
+"""
+import numpy as np
+import pandas as pd
+import psycopg2
+from typing import Dict, Optional
+from config import DB_CONFIG, SCHEMA_CONFIG, ETL_CONFIG
+from utils.logging_utils import setup_logger, ProgressLogger
+
+logger = setup_logger(__name__)
+
+DEFAULT_PRECISION = 14
+
+# Sketch name -> column of the sales rows whose values are the sketch members
+# (None: one sketch over all sales)
+CUSTOMER_SKETCHES = {
+    'customers_by_store': 'store_id',
+    'customers_by_segment': 'customer_segment',
+    'customers': None
+}
+
+# Member of the sketches over all sales
+ALL_MEMBERS = 'all'
+
+def hash_values(values: pd.Series) -> np.ndarray:
+    """Hash values to unsigned 64-bit integers (stable across processes)."""
+    return pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+def _leading_zeros(x: np.ndarray) -> np.ndarray:
+    """Count the leading zero bits of unsigned 64-bit integers."""
+    x = x.copy()
+    zeros = np.zeros(x.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        top_empty = (x >> np.uint64(64 - shift)) == 0
+        zeros[top_empty] += shift
+        x[top_empty] <<= np.uint64(shift)
+    zeros[x == 0] = 64
+    return zeros
+
+def register_updates(hashes: np.ndarray, precision: int):
+    """
+    Split hashes into register indexes and ranks.
+
+    Returns:
+        Tuple of the register index and the rank (position of the first set
+        bit after the index bits) of every hash
+    """
+    index = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+    remainder = hashes << np.uint64(precision)
+    rank = np.minimum(_leading_zeros(remainder) + 1, 64 - precision + 1).astype(np.uint8)
+    return index, rank
+
+class HyperLogLog:
+    """A HyperLogLog distinct count sketch with 2^precision one-byte registers."""
+
+    def __init__(self, precision: int = DEFAULT_PRECISION, registers: Optional[np.ndarray] = None):
+        """Initialize an empty sketch, or one with the given registers."""
+        self.precision = precision
+        self.registers = (registers if registers is not None
+                          else np.zeros(1 << precision, dtype=np.uint8))
+
+    @property
+    def relative_error(self) -> float:
+        """Standard error of the estimate relative to the true count."""
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def add(self, values: pd.Series) -> None:
+        """Add values to the sketch."""
+        index, rank = register_updates(hash_values(values), self.precision)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        """Merge another sketch of the same precision into this one."""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> float:
+        """Estimate the number of distinct values added."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty = int(np.count_nonzero(self.registers == 0))
+        # Small cardinalities: linear counting over the empty registers
+        if raw <= 2.5 * m and empty:
+            return m * np.log(m / empty)
+        return float(raw)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the registers."""
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, precision: int) -> 'HyperLogLog':
+        """Deserialize registers written by to_bytes."""
+        return cls(precision, np.frombuffer(data, dtype=np.uint8).copy())
+
+def _sales_rows_query(source: str) -> str:
+    """Query the customer, store and segment of every sale in a source table."""
+    return f"""
+    SELECT st.store_id, c.customer_segment, c.customer_id
+    FROM {source} f
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_store st ON st.store_key = f.store_key
+    JOIN {SCHEMA_CONFIG['dim_schema']}.dim_customer c ON c.customer_key = f.customer_key
+    """
+
+def load_sketches(conn, sketch_name: str) -> Dict[str, HyperLogLog]:
+    """
+    Load the stored sketches of one grouping.
+
+    Args:
+        conn: Open database connection
+        sketch_name: Name of the sketch (a key of CUSTOMER_SKETCHES)
+
+    Returns:
+        Sketch per member
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        SELECT member, precision, registers
+        FROM {SCHEMA_CONFIG['schema_name']}.sketches
+        WHERE sketch_name = %s
+        """, (sketch_name,))
+        return {member: HyperLogLog.from_bytes(bytes(registers), precision)
+                for member, precision, registers in cur.fetchall()}
+
+def update_customer_sketches(full: bool = False, precision: int = DEFAULT_PRECISION,
+                             staging_table: str = 'stg_sales') -> int:
+    """
+    Add staged sales to the distinct customer sketches.
+
+    The sketches are rebuilt from the sales fact table instead when they
+    do not exist yet or when a full rebuild is requested.
+
+    Args:
+        full: Rebuild the sketches from the fact table
+        precision: Register bits of new sketches
+        staging_table: Staging table holding the sales to add
+
+    Returns:
+        Number of sales rows added
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM {SCHEMA_CONFIG['schema_name']}.sketches")
+    full = full or cur.fetchone()[0] == 0
+    cur.close()
+    source = (f"{SCHEMA_CONFIG['fact_schema']}.fact_sales" if full
+              else f"{SCHEMA_CONFIG['staging_schema']}.{staging_table}")
+    logger.info(f"Updating customer sketches from {source}...")
+
+    # Registers of every member, one row per member and sketch
+    registers: Dict[str, Dict[str, np.ndarray]] = {name: {} for name in CUSTOMER_SKETCHES}
+    rows = 0
+    progress = ProgressLogger(logger, 'sketches')
+    with conn.cursor(name='sketch_rows') as stream:
+        stream.itersize = ETL_CONFIG['chunk_size']
+        stream.execute(_sales_rows_query(source))
+        while True:
+            batch = stream.fetchmany(ETL_CONFIG['chunk_size'])
+            if not batch:
+                break
+            df = pd.DataFrame(batch, columns=['store_id', 'customer_segment', 'customer_id'])
+            rows += len(df)
+            progress.update(len(df))
+            index, rank = register_updates(hash_values(df['customer_id']), precision)
+            for name, column in CUSTOMER_SKETCHES.items():
+                codes, members = (pd.factorize(df[column]) if column
+                                  else (np.zeros(len(df), dtype=np.intp), [ALL_MEMBERS]))
+                block = np.zeros((len(members), 1 << precision), dtype=np.uint8)
+                np.maximum.at(block, (codes, index), rank)
+                for member, member_registers in zip(members, block):
+                    member = str(member)
+                    if member in registers[name]:
+                        np.maximum(registers[name][member], member_registers,
+                                   out=registers[name][member])
+                    else:
+                        registers[name][member] = member_registers
+
+    # Merge with the stored sketches
+    with conn.cursor() as cur:
+        for name, members in registers.items():
+            stored = {} if full else load_sketches(conn, name)
+            for member, member_registers in members.items():
+                sketch = HyperLogLog(precision, member_registers)
+                if member in stored and stored[member].precision == precision:
+                    sketch.merge(stored[member])
+                cur.execute(f"""
+                INSERT INTO {SCHEMA_CONFIG['schema_name']}.sketches
+                    (sketch_name, member, precision, registers, updated_at)
+                VALUES (%s, %s, %s, %s, now())
+                ON CONFLICT (sketch_name, member) DO UPDATE SET
+                    precision = EXCLUDED.precision,
+                    registers = EXCLUDED.registers,
+                    updated_at = EXCLUDED.updated_at
+                """, (name, member, precision, psycopg2.Binary(sketch.to_bytes())))
+    conn.commit()
+    conn.close()
+    logger.info(f"Customer sketches updated from {rows} sales rows.",
+                extra={'stage': 'sketches', 'rows': rows})
+    return rows
@@ -0,0 +1,201 @@
+"""
+Micro-batch ingestion of new sales.
+
+New sales arrive as small CSV files with the columns of sales.csv in a
+landing directory, or as CSV lines (header first) on standard input. Rows
+are collected into micro-batches that are merged once they hold
+STREAM_CONFIG['max_batch_rows'] rows or their first row has waited
+STREAM_CONFIG['max_batch_seconds'], which bounds the time between a sale
+arriving and the reports showing it.
+
+Each micro-batch is merged by etl_utils.ingest_sales: sales already loaded
+are left alone, so a file delivered twice does no harm, and the sales cube
+and the distinct customer sketches are updated with the new sales only.
+Corrections of loaded sales go through the batch ETL.
+
+Files must appear complete: write them under another name (e.g. .tmp) and
+rename them to .csv. Merged files are moved to the processed subdirectory
+of the landing directory, files that cannot be read to the failed one.
+"""
+import io
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, TextIO, Tuple
+import pandas as pd
+from config import DATA_DIR, ETL_CONFIG, STREAM_CONFIG
+from utils.db_setup import create_stream_tables
+from utils.etl_utils import ingest_sales
+from utils.logging_utils import setup_logger
+from utils.schema import source_dtypes
+from utils.validation import rejects_path
+
+logger = setup_logger(__name__)
+
+def read_sales(source) -> pd.DataFrame:
+    """Read sales rows from a CSV file or text buffer with the registry dtypes."""
+    return pd.read_csv(source, dtype=source_dtypes('stg_sales'))
+
+class LandingDirectory:
+    """CSV files of new sales dropped into a directory."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Watch a landing directory.
+
+        Args:
+            path: Directory (defaults to STREAM_CONFIG['landing_dir'])
+        """
+        self.path = path or STREAM_CONFIG['landing_dir']
+        self.processed_dir = os.path.join(self.path, 'processed')
+        self.failed_dir = os.path.join(self.path, 'failed')
+        self.exhausted = False
+        self._taken = set()
+        for directory in (self.path, self.processed_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def poll(self) -> List[Tuple[pd.DataFrame, Optional[str]]]:
+        """Read the files that appeared since the last poll, oldest first."""
+        names = [name for name in os.listdir(self.path)
+                 if name.endswith('.csv') and name not in self._taken]
+        paths = sorted((os.path.join(self.path, name) for name in names), key=os.path.getmtime)
+        batches = []
+        for path in paths:
+            try:
+                df = read_sales(path)
+            except (ValueError, pd.errors.ParserError) as e:
+                logger.error(f"Cannot read {path}, moved to {self.failed_dir}: {e}")
+                shutil.move(path, os.path.join(self.failed_dir, os.path.basename(path)))
+                continue
+            self._taken.add(os.path.basename(path))
+            batches.append((df, path))
+        return batches
+
+    def done(self, paths: List[str]) -> None:
+        """Move merged files out of the landing directory."""
+        for path in paths:
+            shutil.move(path, os.path.join(self.processed_dir, os.path.basename(path)))
+            self._taken.discard(os.path.basename(path))
+
+class LineStream:
+    """CSV lines of new sales read from a text stream such as standard input."""
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        """
+        Read a stream in a background thread, so polling never blocks.
+
+        Args:
+            stream: Text stream whose first line is the CSV header (defaults to stdin)
+        """
+        self.stream = stream or sys.stdin
+        self._lines: queue.SimpleQueue = queue.SimpleQueue()
+        self._header: Optional[str] = None
+        self._ended = threading.Event()
+        threading.Thread(target=self._read, name='sales-stream-reader', daemon=True).start()
+
+    def _read(self) -> None:
+        """Queue the lines of the stream until it ends."""
+        for line in self.stream:
+            if line.strip():
+                self._lines.put(line if line.endswith('\n') else line + '\n')
+        self._ended.set()
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether the stream ended and every line was polled."""
+        return self._ended.is_set() and self._lines.empty()
+
+    def poll(self) -> List[Tuple[pd.DataFrame, Optional[str]]]:
+        """Parse the lines received since the last poll."""
+        lines = []
+        while True:
+            try:
+                lines.append(self._lines.get_nowait())
+            except queue.Empty:
+                break
+        if self._header is None and lines:
+            self._header = lines.pop(0)
+        if not lines:
+            return []
+        return [(read_sales(io.StringIO(self._header + ''.join(lines))), None)]
+
+    def done(self, paths: List[str]) -> None:
+        """Nothing to clean up: lines are consumed when polled."""
+
+def _merge(frames: List[pd.DataFrame], max_rows: int, first_arrival: float,
+           totals: Dict[str, int]) -> None:
+    """Merge the pending rows in batches of at most max_rows rows."""
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    rejects_file = rejects_path('sales_stream.csv',
+                                ETL_CONFIG['rejects_dir'] or os.path.join(DATA_DIR, 'rejects'))
+    for start in range(0, len(df), max_rows):
+        started = time.monotonic()
+        stats = ingest_sales(df.iloc[start:start + max_rows], rejects_file)
+        now = time.monotonic()
+        totals['batches'] += 1
+        for key in ('rows', 'rejected', 'new'):
+            totals[key] += stats[key]
+        logger.info(
+            f"Micro-batch {totals['batches']}: {stats['new']} new sales of {stats['rows']} rows "
+            f"({stats['rejected']} rejected) merged in {now - started:.2f}s, "
+            f"{now - first_arrival:.2f}s after arrival",
+            extra={'stage': 'stream', 'rows': stats['new'],
+                   'elapsed_seconds': round(now - started, 3),
+                   'latency_seconds': round(now - first_arrival, 3)}
+        )
+
+def run_ingest(source=None, max_batch_rows: Optional[int] = None,
+               max_batch_seconds: Optional[float] = None, poll_seconds: Optional[float] = None,
+               once: bool = False, stop: Optional[threading.Event] = None) -> Dict[str, int]:
+    """
+    Ingest micro-batches of new sales until the input ends.
+
+    Args:
+        source: LandingDirectory or LineStream (defaults to the landing
+            directory STREAM_CONFIG['landing_dir'])
+        max_batch_rows: Rows that trigger a merge (defaults to STREAM_CONFIG)
+        max_batch_seconds: Seconds a row waits at most before a merge (defaults to STREAM_CONFIG)
+        poll_seconds: Seconds between checks for new input (defaults to STREAM_CONFIG)
+        once: Merge the input already there and return instead of waiting for more
+        stop: Event that ends the ingestion after merging the pending rows
+
+    Returns:
+        Number of micro-batches and of rows received, rejected and new
+    """
+    source = source or LandingDirectory()
+    max_rows = max_batch_rows or STREAM_CONFIG['max_batch_rows']
+    max_seconds = STREAM_CONFIG['max_batch_seconds'] if max_batch_seconds is None else max_batch_seconds
+    poll_seconds = STREAM_CONFIG['poll_seconds'] if poll_seconds is None else poll_seconds
+    create_stream_tables()
+
+    totals = {'batches': 0, 'rows': 0, 'rejected': 0, 'new': 0}
+    frames: List[pd.DataFrame] = []
+    files: List[str] = []
+    first_arrival: Optional[float] = None
+    logger.info("Ingesting new sales...")
+    while True:
+        for df, path in source.poll():
+            if len(df):
+                frames.append(df)
+                first_arrival = first_arrival or time.monotonic()
+            if path:
+                files.append(path)
+
+        finished = once or source.exhausted or (stop is not None and stop.is_set())
+        pending = sum(len(df) for df in frames)
+        waited = time.monotonic() - first_arrival if first_arrival else 0.0
+        if (frames or files) and (finished or pending >= max_rows or waited >= max_seconds):
+            if frames:
+                _merge(frames, max_rows, first_arrival, totals)
+            source.done(files)
+            frames, files, first_arrival = [], [], None
+        if finished:
+            break
+        time.sleep(poll_seconds)
+
+    logger.info(f"Ingested {totals['new']} new sales in {totals['batches']} micro-batches",
+                extra={'stage': 'stream', 'rows': totals['new']})
+    return totals
@@ -0,0 +1,226 @@
+"""
+Calendar builder for the time dimension.
+
+Builds time dimension rows for any date range with vectorized pandas
+operations, marks holidays from a pluggable holiday calendar and assigns
+fiscal periods. The ETL uses it to extend dim_time when fact rows reference
+dates the dimension does not have yet.
+"""
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+from typing import Dict, List, NamedTuple, Optional, Union
+from config import SCHEMA_CONFIG, CALENDAR_CONFIG
+from utils.key_cache import get_key_cache
+from utils.logging_utils import setup_logger
+
+logger = setup_logger(__name__)
+
+DateLike = Union[str, pd.Timestamp]
+
+# Columns of the time dimension source file and staging table, in order
+TIME_DIMENSION_COLUMNS = ['date_id', 'full_date', 'day_of_week', 'day_of_month', 'day_of_year',
+                          'week_of_year', 'month', 'quarter', 'year', 'is_holiday',
+                          'holiday_name', 'fiscal_year', 'fiscal_quarter']
+
+class FixedHoliday(NamedTuple):
+    """A holiday on the same date every year."""
+    name: str
+    month: int
+    day: int
+
+class WeekdayHoliday(NamedTuple):
+    """A holiday on the n-th weekday of a month (n = -1 for the last one)."""
+    name: str
+    month: int
+    weekday: int  # Monday = 0
+    n: int
+
+class HolidayCalendar:
+    """A set of yearly holiday rules."""
+
+    def __init__(self, rules: List[Union[FixedHoliday, WeekdayHoliday]]):
+        """Initialize the calendar with its holiday rules."""
+        self.rules = rules
+
+    def holidays(self, years: np.ndarray) -> pd.Series:
+        """
+        Compute the holidays of the given years.
+
+        Args:
+            years: Calendar years
+
+        Returns:
+            Holiday names indexed by date
+        """
+        years = np.unique(years)
+        frames = []
+        for rule in self.rules:
+            if isinstance(rule, FixedHoliday):
+                dates = pd.to_datetime(pd.DataFrame({'year': years, 'month': rule.month,
+                                                     'day': rule.day}), errors='coerce')
+            else:
+                if rule.n > 0:
+                    first = pd.to_datetime(pd.DataFrame({'year': years, 'month': rule.month,
+                                                         'day': 1}))
+                    offset = (rule.weekday - first.dt.weekday) % 7 + 7 * (rule.n - 1)
+                    dates = first + pd.to_timedelta(offset, unit='D')
+                else:
+                    last = (pd.to_datetime(pd.DataFrame({'year': years, 'month': rule.month,
+                                                         'day': 1}))
+                            + pd.offsets.MonthEnd(0))
+                    offset = (last.dt.weekday - rule.weekday) % 7 + 7 * (-rule.n - 1)
+                    dates = last - pd.to_timedelta(offset, unit='D')
+            frames.append(pd.Series(rule.name, index=pd.DatetimeIndex(dates.dropna())))
+        if not frames:
+            return pd.Series(dtype=object)
+        holidays = pd.concat(frames)
+        # Two rules on one day: keep the first
+        return holidays[~holidays.index.duplicated()].sort_index()
+
+US_HOLIDAYS = HolidayCalendar([
+    FixedHoliday("New Year's Day", 1, 1),
+    FixedHoliday('Independence Day', 7, 4),
+    WeekdayHoliday('Thanksgiving', 11, 3, 4),
+    FixedHoliday('Christmas', 12, 25)
+])
+
+US_FEDERAL_HOLIDAYS = HolidayCalendar(US_HOLIDAYS.rules + [
+    WeekdayHoliday('Martin Luther King Jr. Day', 1, 0, 3),
+    WeekdayHoliday("Presidents' Day", 2, 0, 3),
+    WeekdayHoliday('Memorial Day', 5, 0, -1),
+    FixedHoliday('Juneteenth', 6, 19),
+    WeekdayHoliday('Labor Day', 9, 0, 1),
+    WeekdayHoliday('Columbus Day', 10, 0, 2),
+    FixedHoliday('Veterans Day', 11, 11)
+])
+
+HOLIDAY_CALENDARS: Dict[str, HolidayCalendar] = {
+    'us': US_HOLIDAYS,
+    'us_federal': US_FEDERAL_HOLIDAYS,
+    'none': HolidayCalendar([])
+}
+
+def fiscal_periods(year: pd.Series, month: pd.Series,
+                   start_month: Optional[int] = None) -> pd.DataFrame:
+    """
+    Assign fiscal years and quarters.
+
+    A fiscal year is named after the calendar year it ends in, so with a
+    fiscal year starting in October, October 2023 is in fiscal year 2024.
+
+    Args:
+        year: Calendar years
+        month: Calendar months
+        start_month: First month of the fiscal year (defaults to
+            CALENDAR_CONFIG['fiscal_year_start_month'])
+
+    Returns:
+        DataFrame with fiscal_year and fiscal_quarter columns
+    """
+    start_month = start_month or CALENDAR_CONFIG['fiscal_year_start_month']
+    shifted = (month - start_month) % 12
+    return pd.DataFrame({
+        'fiscal_year': year + ((start_month > 1) & (month >= start_month)).astype(int),
+        'fiscal_quarter': shifted // 3 + 1
+    })
+
+def build_time_dimension(dates: pd.DatetimeIndex,
+                         holidays: Optional[HolidayCalendar] = None,
+                         fiscal_start_month: Optional[int] = None) -> pd.DataFrame:
+    """
+    Build time dimension rows for the given dates.
+
+    Args:
+        dates: Dates to build rows for
+        holidays: Holiday calendar (defaults to CALENDAR_CONFIG['holiday_calendar'])
+        fiscal_start_month: First month of the fiscal year
+
+    Returns:
+        DataFrame with the TIME_DIMENSION_COLUMNS
+    """
+    dates = pd.DatetimeIndex(dates).normalize()
+    if holidays is None:
+        holidays = HOLIDAY_CALENDARS[CALENDAR_CONFIG['holiday_calendar']]
+    holiday_names = holidays.holidays(dates.year.to_numpy()).reindex(dates)
+
+    df = pd.DataFrame({
+        'date_id': dates.strftime('%Y%m%d'),
+        'full_date': dates,
+        'day_of_week': dates.day_name(),
+        'day_of_month': dates.day,
+        'day_of_year': dates.dayofyear,
+        'week_of_year': dates.isocalendar().week.to_numpy().astype(int),
+        'month': dates.month,
+        'quarter': dates.quarter,
+        'year': dates.year,
+        'is_holiday': holiday_names.notna().to_numpy(),
+        'holiday_name': holiday_names.fillna('').to_numpy()
+    })
+    fiscal = fiscal_periods(df['year'], df['month'], fiscal_start_month)
+    df['fiscal_year'] = fiscal['fiscal_year']
+    df['fiscal_quarter'] = fiscal['fiscal_quarter']
+    return df
+
+def generate_calendar(start_date: DateLike, end_date: DateLike,
+                      holidays: Optional[HolidayCalendar] = None,
+                      fiscal_start_month: Optional[int] = None) -> pd.DataFrame:
+    """
+    Build time dimension rows for every day of a date range.
+
+    Args:
+        start_date: First date
+        end_date: Last date (inclusive)
+        holidays: Holiday calendar
+        fiscal_start_month: First month of the fiscal year
+
+    Returns:
+        DataFrame with the TIME_DIMENSION_COLUMNS
+    """
+    return build_time_dimension(pd.date_range(start_date, end_date, freq='D'),
+                                holidays, fiscal_start_month)
+
+def extend_time_dimension(conn, date_ids: pd.Series) -> int:
+    """
+    Add dates referenced by fact rows that dim_time does not have yet.
+
+    Well-formed date ids (YYYYMMDD) missing from the dim_time key cache are
+    built with the configured calendar and inserted; the key cache is then
+    reloaded. Malformed ids are left for validation to reject.
+
+    Args:
+        conn: Open database connection (the insert is committed)
+        date_ids: Date ids referenced by a chunk of fact rows
+
+    Returns:
+        Number of dates added
+    """
+    cache = get_key_cache('dim_time')
+    cache.refresh(conn)
+    candidates = pd.Series(date_ids.dropna().astype(str).unique())
+    candidates = candidates[candidates.str.fullmatch(r'\d{8}') & cache.map(candidates).isna()]
+    dates = pd.to_datetime(candidates, format='%Y%m%d', errors='coerce').dropna()
+    if dates.empty:
+        return 0
+
+    rows = build_time_dimension(pd.DatetimeIndex(dates)).astype(object)
+    rows.loc[rows['holiday_name'] == '', 'holiday_name'] = None
+    values = [
+        (int(row.date_id),) + tuple(getattr(row, column) for column in TIME_DIMENSION_COLUMNS)
+        for row in rows.itertuples(index=False)
+    ]
+    with conn.cursor() as cur:
+        inserted = execute_values(cur, f"""
+        INSERT INTO {SCHEMA_CONFIG['dim_schema']}.dim_time (date_key, {', '.join(TIME_DIMENSION_COLUMNS)})
+        VALUES %s
+        ON CONFLICT (date_key) DO NOTHING
+        RETURNING date_key
+        """, values, fetch=True)
+        added = len(inserted)
+    conn.commit()
+
+    # Dates can be older than the cached keys, so an incremental refresh is not enough
+    cache.refresh(conn, full=True)
+    if added:
+        logger.info(f"Extended dim_time with {added} dates ({dates.min():%Y-%m-%d} to {dates.max():%Y-%m-%d})")
+    return added
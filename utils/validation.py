@@ -0,0 +1,207 @@
+"""
+Validation of source rows before they are staged.
+
+Every chunk read from a source file is checked column-wise: values must fit
+the staging column types, columns the warehouse tables require must be
+present, natural keys must be well formed, measures must be in range and
+consistent (and, for the compact fact layout, fit its narrower types), and
+fact rows must reference known dimension members. Rows failing an error
+check are quarantined to a reject file with the reasons; rows failing only
+a warning check are loaded and counted.
+"""
+import os
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Tuple
+from utils.key_cache import get_key_cache
+from utils.schema import column_types, compact_ranges, required_columns
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Natural key formats of the source files
+KEY_PATTERNS = {
+    'product_id': r'P\d+',
+    'customer_id': r'C\d+',
+    'store_id': r'S\d+',
+    'sale_id': r'T\d+',
+    'inventory_id': r'I\d+',
+    'date_id': r'\d{8}'
+}
+
+PHONE_PATTERN = r'\+1\d{10}'
+
+# Allowed difference between a stored amount and the amount derived from other columns
+AMOUNT_TOLERANCE = 0.01
+
+DATE_FORMAT = '%Y-%m-%d'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _matches(values: pd.Series, pattern: str) -> pd.Series:
+    """Check which values match a pattern completely (missing values do not)."""
+    return values.astype('string').str.fullmatch(pattern).fillna(False).astype(bool)
+
+def _differs(values: pd.Series, expected: pd.Series) -> pd.Series:
+    """Check which amounts differ from the expected amounts by more than the tolerance."""
+    return (values - expected).abs() > AMOUNT_TOLERANCE + 1e-9
+
+def _negative(*columns: str) -> Callable[[pd.DataFrame], pd.Series]:
+    """Build a check for negative values in any of the columns."""
+    return lambda t: np.logical_or.reduce([t[column] < 0 for column in columns])
+
+# Staging table -> (reason, severity, check returning the rows that fail).
+# Checks see typed values; missing values and values that failed the type
+# checks are NaN/NaT and pass every comparison here (they are rejected by the
+# type and required column checks).
+RULES: Dict[str, List[Tuple[str, str, Callable[[pd.DataFrame], pd.Series]]]] = {
+    'stg_products': [
+        ('unit_price is not positive', ERROR, lambda t: t['unit_price'] <= 0),
+        ('cost is negative', ERROR, _negative('cost')),
+        ('cost exceeds unit_price', WARNING, lambda t: t['cost'] > t['unit_price'])
+    ],
+    'stg_customers': [
+        ('phone is not in +1XXXXXXXXXX format', WARNING,
+         lambda t: ~_matches(t['phone'], PHONE_PATTERN)),
+        ('email is not an address', WARNING, lambda t: ~_matches(t['email'], r'[^@\s]+@[^@\s]+'))
+    ],
+    'stg_time_dimension': [
+        ('full_date does not match date_id', ERROR,
+         lambda t: t['full_date'].notna() & (t['full_date'].dt.strftime('%Y%m%d') != t['date_id'])),
+        ('month out of range', ERROR, lambda t: (t['month'] < 1) | (t['month'] > 12)),
+        ('quarter out of range', ERROR, lambda t: (t['quarter'] < 1) | (t['quarter'] > 4))
+    ],
+    'stg_stores': [
+        ('store_size is not positive', ERROR, lambda t: t['store_size'] <= 0)
+    ],
+    'stg_sales': [
+        ('quantity is not positive', ERROR, lambda t: t['quantity'] <= 0),
+        ('negative amount', ERROR,
+         _negative('unit_price', 'total_amount', 'discount_amount', 'net_amount')),
+        ('discount_amount exceeds total_amount', ERROR,
+         lambda t: t['discount_amount'] > t['total_amount'] + AMOUNT_TOLERANCE),
+        ('total_amount != quantity * unit_price', ERROR,
+         lambda t: _differs(t['total_amount'], t['quantity'] * t['unit_price'])),
+        ('net_amount != total_amount - discount_amount', ERROR,
+         lambda t: _differs(t['net_amount'], t['total_amount'] - t['discount_amount']))
+    ],
+    'stg_inventory': [
+        ('negative stock movement', ERROR,
+         _negative('beginning_quantity', 'units_received', 'units_sold', 'units_damaged')),
+        ('ending_quantity does not balance', ERROR,
+         lambda t: t['ending_quantity'] != (t['beginning_quantity'] + t['units_received']
+                                            - t['units_sold'] - t['units_damaged'])),
+        ('ending_quantity is negative', WARNING, _negative('ending_quantity'))
+    ]
+}
+
+def _typed_column(values: pd.Series, sql_type: str, size: Optional[int],
+                  scale: Optional[int]) -> Tuple[pd.Series, pd.Series]:
+    """
+    Convert a source column to its staging type.
+
+    Returns:
+        The typed values and a mask of present values that do not fit the type
+    """
+    present = values.notna()
+    if sql_type == 'VARCHAR':
+        text = values.astype('string')
+        return text, present & (text.str.len() > size).fillna(False).astype(bool)
+    if sql_type in ('INTEGER', 'BIGINT'):
+        numbers = pd.to_numeric(values, errors='coerce')
+        limit = 2 ** 31 if sql_type == 'INTEGER' else 2 ** 63
+        bad = present & (numbers.isna() | (numbers % 1 != 0) | (numbers.abs() >= limit))
+        return numbers.where(~bad), bad
+    if sql_type == 'DECIMAL':
+        numbers = pd.to_numeric(values, errors='coerce')
+        bad = present & (numbers.isna() | (numbers.abs() >= 10.0 ** (size - scale)))
+        return numbers.where(~bad), bad
+    if sql_type in ('DATE', 'TIMESTAMP'):
+        parsed = pd.to_datetime(values, errors='coerce',
+                                format=DATE_FORMAT if sql_type == 'DATE' else TIMESTAMP_FORMAT)
+        return parsed, present & parsed.isna()
+    if sql_type == 'BOOLEAN':
+        flags = values.astype('string').str.lower().map({'true': True, 'false': False})
+        return flags, present & flags.isna()
+    return values, pd.Series(False, index=values.index)
+
+def validate_chunk(df: pd.DataFrame, staging_table: str, conn=None,
+                   foreign_keys: Optional[Dict[str, str]] = None, compact: bool = False
+                   ) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, int]]:
+    """
+    Validate a chunk of source rows.
+
+    Args:
+        df: Source rows as read from the file
+        staging_table: Name of the staging table the rows are loaded into
+        conn: Open database connection (needed for foreign key checks)
+        foreign_keys: Natural key column -> dimension table the rows must reference
+        compact: Check the ranges of the columns the compact fact layout narrows
+
+    Returns:
+        Tuple of the valid rows, the rejected rows with source_row (the
+        1-based row number taken from the index) and reject_reason columns,
+        and the number of rows per warning
+    """
+    reasons = pd.Series('', index=df.index, dtype=object)
+    warnings: Dict[str, int] = {}
+
+    def reject(mask: pd.Series, reason: str) -> None:
+        mask = pd.Series(mask, index=df.index).fillna(False).astype(bool)
+        if mask.any():
+            reasons[mask] = reasons[mask] + f'{reason}; '
+
+    # Types and lengths of the staged columns
+    typed = pd.DataFrame(index=df.index)
+    for column, (sql_type, size, scale) in column_types(staging_table).items():
+        if column in df.columns:
+            typed[column], bad = _typed_column(df[column], sql_type, size, scale)
+            reject(bad, f'invalid {column}')
+    for column in df.columns.difference(typed.columns):
+        typed[column] = df[column]
+
+    # Values the warehouse table requires (natural keys are checked below)
+    for column in required_columns(staging_table):
+        if column in df.columns and column not in KEY_PATTERNS:
+            reject(df[column].isna(), f'missing {column}')
+
+    # Natural key formats
+    for column, pattern in KEY_PATTERNS.items():
+        if column in df.columns:
+            reject(~_matches(df[column], pattern), f'missing or malformed {column}')
+
+    # Columns stored in narrower types by the compact fact layout
+    for column, (low, high) in (compact_ranges(staging_table) if compact else {}).items():
+        if column in typed.columns:
+            reject((typed[column] < low) | (typed[column] > high),
+                   f'{column} out of range for the compact layout')
+
+    # Ranges and consistency
+    for reason, severity, check in RULES.get(staging_table, []):
+        failed = pd.Series(check(typed), index=df.index).fillna(False).astype(bool)
+        if severity == ERROR:
+            reject(failed, reason)
+        elif failed.any():
+            warnings[reason] = int(failed.sum())
+
+    # Orphaned foreign keys
+    for column, dimension in (foreign_keys or {}).items():
+        cache = get_key_cache(dimension)
+        cache.refresh(conn)
+        reject(df[column].notna() & cache.map(df[column]).isna(), f'unknown {column}')
+
+    rejected = reasons != ''
+    rejects = df[rejected].copy()
+    rejects.insert(0, 'source_row', rejects.index + 1)
+    rejects['reject_reason'] = reasons[rejected].str.rstrip('; ')
+    return df[~rejected], rejects, warnings
+
+def rejects_path(csv_file: str, rejects_dir: str, run_id: Optional[int] = None) -> str:
+    """Return the reject file of a source file (per ETL run if a run id is given)."""
+    stem = os.path.splitext(csv_file)[0]
+    name = f'{stem}.run{run_id}.rejects.csv' if run_id is not None else f'{stem}.rejects.csv'
+    return os.path.join(rejects_dir, name)
+
+def write_rejects(rejects: pd.DataFrame, path: str) -> None:
+    """Append rejected rows to a reject file, writing the header for a new file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    rejects.to_csv(path, mode='a', index=False, header=not os.path.exists(path))
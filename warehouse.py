@@ -0,0 +1,233 @@
+"""
+Command line interface for the sales data warehouse.
+
+Subcommands import pandas, pyarrow and psycopg2 only when they run, so
+`--help` and small cron jobs do not pay for the modules other subcommands
+need.
+
+Usage:
+    python warehouse.py generate --scale 0.1
+    python warehouse.py setup
+    python warehouse.py etl --force --timings
+    python warehouse.py optimize
+    python warehouse.py report product_performance --output reports/products.parquet
+    python warehouse.py report --query "SELECT * FROM facts.v_sales" --output sales.ndjson
+    python warehouse.py partition --output-dir data/sharded --shards east,west
+    python warehouse.py ingest --landing-dir data/landing
+    python warehouse.py compact-inventory --older-than-days 90
+    tail -f sales.log | python warehouse.py ingest --stdin
+
+Setup, etl and report work on the shards given by --shards or the
+WAREHOUSE_SHARDS environment variable, if any (see utils/shards.py).
+"""
+import argparse
+import sys
+from typing import List, Optional
+
+def _shards(args: argparse.Namespace) -> List[str]:
+    """Return the shards of a command: --shards, or the configured ones."""
+    if args.shards is None:
+        from config import SHARDS
+        return list(SHARDS)
+    return [name.strip() for name in args.shards.split(',') if name.strip()]
+
+def generate(args: argparse.Namespace) -> int:
+    """Generate the sample source data."""
+    from utils.data_generator import generate_all_data
+    print("Starting data generation for Sales Data Warehouse...")
+    if args.output_dir:
+        pipeline = generate_all_data(args.scale, args.output_dir)
+    else:
+        pipeline = generate_all_data(args.scale)
+    if args.timings:
+        print(pipeline.report())
+    print("Data generation completed successfully!")
+    return 0
+
+def setup(args: argparse.Namespace) -> int:
+    """Create the warehouse database, schemas and tables."""
+    from utils.db_setup import setup_database
+    print("Starting database setup for Sales Data Warehouse...")
+    pipeline = setup_database()
+    if args.timings:
+        print(pipeline.report())
+    shards = _shards(args)
+    if shards:
+        from utils.shards import setup_shards
+        setup_shards(shards)
+    print("Database setup completed successfully!")
+    return 0
+
+def etl(args: argparse.Namespace) -> int:
+    """Load the source data into the warehouse."""
+    print("Starting ETL process for Sales Data Warehouse...")
+    kwargs = {'data_dir': args.data_dir} if args.data_dir else {}
+    shards = _shards(args)
+    if shards:
+        from utils.shards import run_sharded_etl
+        run_sharded_etl(shards=shards, workers=args.workers, keep_staging=args.keep_staging or None,
+                        resume=not args.no_resume, force=args.force, **kwargs)
+    else:
+        from utils.etl_utils import run_etl
+        pipeline = run_etl(keep_staging=args.keep_staging or None, resume=not args.no_resume,
+                           force=args.force, **kwargs)
+        if args.timings:
+            print(pipeline.report())
+    print("ETL process completed successfully!")
+    return 0
+
+def partition(args: argparse.Namespace) -> int:
+    """Split the fact files of a data directory into per-shard directories."""
+    from config import RAW_DATA_DIR
+    from utils.shards import partition_fact_files
+    rows = partition_fact_files(args.data_dir or RAW_DATA_DIR, args.output_dir, _shards(args),
+                                args.column)
+    for shard, count in rows.items():
+        print(f"{shard}: {count} fact rows")
+    return 0
+
+def ingest(args: argparse.Namespace) -> int:
+    """Merge micro-batches of new sales from a landing directory or standard input."""
+    from contextlib import nullcontext
+    from utils.streaming import LandingDirectory, LineStream, run_ingest
+    from utils.shards import shard_scope
+    source = LineStream() if args.stdin else LandingDirectory(args.landing_dir)
+    with shard_scope(args.shard) if args.shard else nullcontext():
+        try:
+            totals = run_ingest(source, args.max_batch_rows, args.max_batch_seconds, once=args.once)
+        except KeyboardInterrupt:
+            print("Ingestion stopped; unmerged files stay in the landing directory.")
+            return 130
+    print(f"Ingested {totals['new']} new sales ({totals['rejected']} rejected rows).")
+    return 0
+
+def compact_inventory(args: argparse.Namespace) -> int:
+    """Compact old weekly inventory snapshots into monthly ones."""
+    from utils.inventory import compact_inventory_snapshots
+    shards = _shards(args)
+    if shards:
+        from utils.shards import shard_scope
+        for shard in shards:
+            with shard_scope(shard):
+                removed = compact_inventory_snapshots(args.older_than_days)
+            print(f"{shard}: {removed} inventory snapshots compacted")
+    else:
+        removed = compact_inventory_snapshots(args.older_than_days)
+        print(f"{removed} inventory snapshots compacted")
+    return 0
+
+def optimize(args: argparse.Namespace) -> int:
+    """Convert the source files to Parquet."""
+    import optimize_data
+    optimize_data.main()
+    return 0
+
+def report(args: argparse.Namespace) -> int:
+    """Print or export an analytics report or a query result."""
+    from queries import export
+    if bool(args.name) == bool(args.query):
+        raise SystemExit('warehouse report: give either a report name or --query')
+    if args.query:
+        export.export_query(args.query, args.output, args.format, batch_rows=args.batch_rows)
+    elif _shards(args):
+        from queries.sharded import SHARDED_REPORTS
+        if args.name not in SHARDED_REPORTS:
+            raise SystemExit(f'warehouse report: {args.name} cannot be merged across shards; '
+                             'run it without --shards and WAREHOUSE_SHARDS, or run one of '
+                             f"{', '.join(SHARDED_REPORTS)}")
+        if args.approximate:
+            raise SystemExit('warehouse report: --approximate is not supported on shards')
+        export.export_report(args.name, args.output, args.format, shards=_shards(args),
+                             batch_rows=args.batch_rows)
+    else:
+        if args.approximate and args.name not in export.APPROXIMATE_REPORTS:
+            raise SystemExit('warehouse report: --approximate is only supported by '
+                             f"{', '.join(export.APPROXIMATE_REPORTS)}")
+        kwargs = {'approximate': True} if args.approximate else {}
+        export.export_report(args.name, args.output, args.format, batch_rows=args.batch_rows,
+                             **kwargs)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser of the command line interface."""
+    parser = argparse.ArgumentParser(prog='warehouse', description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+    shards_help = "comma-separated shards (defaults to WAREHOUSE_SHARDS; '' for none)"
+    timings_help = 'print the task timings and the critical path of the pipeline'
+
+    command = commands.add_parser('generate', help='generate the sample source data')
+    command.add_argument('--scale', type=float, default=1.0,
+                         help='scale factor relative to the default data set')
+    command.add_argument('--output-dir', help='directory for the CSV files (defaults to data/raw)')
+    command.add_argument('--timings', action='store_true', help=timings_help)
+    command.set_defaults(handler=generate)
+
+    command = commands.add_parser('setup', help='create the warehouse database and tables')
+    command.add_argument('--shards', help=shards_help)
+    command.add_argument('--timings', action='store_true', help=timings_help)
+    command.set_defaults(handler=setup)
+
+    command = commands.add_parser('etl', help='load the source data into the warehouse')
+    command.add_argument('--data-dir', help='directory with the source CSV files (defaults to data/raw)')
+    command.add_argument('--force', action='store_true', help='reload unchanged source files')
+    command.add_argument('--no-resume', action='store_true',
+                         help='start a new run instead of resuming an unfinished one')
+    command.add_argument('--keep-staging', action='store_true',
+                         help='keep the staging tables after the run')
+    command.add_argument('--shards', help=shards_help)
+    command.add_argument('--workers', type=int, help='shards loaded in parallel (defaults to all)')
+    command.add_argument('--timings', action='store_true', help=timings_help + ' (unsharded loads)')
+    command.set_defaults(handler=etl)
+
+    command = commands.add_parser('partition', help='split the fact files into per-shard directories')
+    command.add_argument('--data-dir', help='directory with the source CSV files (defaults to data/raw)')
+    command.add_argument('--output-dir', required=True, help='sharded data directory to write')
+    command.add_argument('--shards', help=shards_help)
+    command.add_argument('--column', help='column the fact rows are partitioned on (defaults to store_id)')
+    command.set_defaults(handler=partition)
+
+    command = commands.add_parser('ingest', help='merge micro-batches of new sales as they arrive')
+    source = command.add_mutually_exclusive_group()
+    source.add_argument('--landing-dir', help='directory watched for CSV files (defaults to data/landing)')
+    source.add_argument('--stdin', action='store_true', help='read CSV lines (header first) from standard input')
+    command.add_argument('--once', action='store_true',
+                         help='merge the files already in the landing directory and exit')
+    command.add_argument('--max-batch-rows', type=int, help='rows that trigger a merge')
+    command.add_argument('--max-batch-seconds', type=float,
+                         help='seconds a row waits at most before it is merged')
+    command.add_argument('--shard', help='shard to ingest into (see utils/shards.py)')
+    command.set_defaults(handler=ingest)
+
+    command = commands.add_parser('compact-inventory',
+                                  help='compact old weekly inventory snapshots into monthly ones')
+    command.add_argument('--older-than-days', type=int,
+                         help='age of the snapshots to compact, relative to the latest one '
+                              '(defaults to ETL_INVENTORY_COMPACT_AFTER_DAYS)')
+    command.add_argument('--shards', help=shards_help)
+    command.set_defaults(handler=compact_inventory)
+
+    command = commands.add_parser('optimize', help='convert the source files to Parquet')
+    command.set_defaults(handler=optimize)
+
+    command = commands.add_parser('report', help='print or export an analytics report')
+    command.add_argument('name', nargs='?',
+                         help='report name (e.g. product_performance, see queries/export.py)')
+    command.add_argument('--query', help='SQL query to export instead of a report')
+    command.add_argument('--output', default='-',
+                         help="output file (defaults to standard output as NDJSON)")
+    command.add_argument('--format', choices=['json', 'ndjson', 'csv', 'parquet'],
+                         help='export format (defaults to the output file extension)')
+    command.add_argument('--approximate', action='store_true',
+                         help='estimate the report from samples and sketches where supported')
+    command.add_argument('--batch-rows', type=int, help='rows fetched and written per batch')
+    command.add_argument('--shards', help=shards_help)
+    command.set_defaults(handler=report)
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run a warehouse command."""
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+if __name__ == '__main__':
+    sys.exit(main())